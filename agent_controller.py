@@ -1,25 +1,33 @@
-from services.ai_service import AIService
-from infrastructure.database import SessionLocal, Experiment, PerformanceMetrics
-from typing import List, Dict, Any
+from ai_service import AIService, AsyncAIService
+from database import SessionLocal, Experiment
+from config import Config
+from experiment_writer import ExperimentWriter
+from rule_engine import RuleEngine
+from single_flight import SingleFlight
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import asyncio
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
 class AgentController:
-    def __init__(self):
-        self.ai_service = AIService()
-        self.db = SessionLocal()
+    def __init__(self, writer: Optional[ExperimentWriter] = None, rules: Optional[RuleEngine] = None):
+        self.ai_service = AIService(rules=rules)
+        self.writer = writer
+        self.rules = rules
     
     def analyze_client_performance(self, client_id: int, domain: str, metrics: Dict[str, float]) -> Dict[str, Any]:
         """Main RSI cycle for a client"""
         
-        # 1. Analyze gaps
-        gaps = self.ai_service.analyze_performance_gaps(metrics, domain)
-        print(f"Identified gaps for client {client_id}: {gaps}")
+        # 1. Analyze gaps (clear-cut cases are answered by the rules)
+        gaps = self.rules.evaluate(metrics, domain) if self.rules else None
+        if gaps is None:
+            gaps = self.ai_service.analyze_performance_gaps(metrics, domain, client_id)
+        logger.info(f"Identified gaps for client {client_id}: {gaps}")
         
-        # 2. Generate proposals
-        proposals_data = self.ai_service.generate_improvement_plan(gaps, domain)
+        # 2. Generate proposals (nothing to fix without gaps)
+        proposals_data = self.ai_service.generate_improvement_plan(gaps, domain, client_id) if gaps else {}
         
         # 3. Test top proposal
         tested_proposals = []
@@ -30,15 +38,7 @@ class AgentController:
             )
             
             # Save experiment
-            experiment = Experiment(
-                client_id=client_id,
-                hypothesis=proposal["hypothesis"],
-                intervention_type=proposal["intervention"],
-                status="completed",
-                results=json.dumps(test_result)
-            )
-            self.db.add(experiment)
-            self.db.commit()
+            self._save_experiment(client_id, proposal, test_result)
             
             tested_proposals.append({
                 "hypothesis": proposal["hypothesis"],
@@ -71,6 +71,25 @@ class AgentController:
         }
         return test_data.get(domain, [])
     
+    def _save_experiment(self, client_id: int, proposal: Dict[str, Any], test_result: Dict[str, Any]) -> None:
+        """Persist one tested proposal, through the write-behind buffer when there is one"""
+        row = {
+            "client_id": client_id,
+            "hypothesis": proposal["hypothesis"],
+            "intervention_type": proposal["intervention"],
+            "status": "completed",
+            "results": json.dumps(test_result)
+        }
+        if self.writer is not None:
+            self.writer.add(row)
+            return
+        db = SessionLocal()
+        try:
+            db.add(Experiment(**row))
+            db.commit()
+        finally:
+            db.close()
+    
     def _generate_recommendations(self, proposals: List[Dict]) -> List[str]:
         """Generate business recommendations from test results"""
         recommendations = []
@@ -80,4 +99,94 @@ class AgentController:
             else:
                 recommendations.append(f"REJECT: {proposal['hypothesis']} - Low success rate")
         
-        return recommendations
\ No newline at end of file
+        return recommendations
+
+class AsyncAgentController(AgentController):
+    """RSI cycle on AsyncAIService with the intervention tests run concurrently.
+
+    Experiments are saved as soon as each test finishes (buffered, or from a
+    worker thread), so the SQLite commits overlap with the tests still waiting
+    on the LLM. With a SingleFlight, identical concurrent cycles for the same
+    client run once and share the result.
+    """
+
+    def __init__(self, max_concurrent_tests: Optional[int] = None, writer: Optional[ExperimentWriter] = None,
+                 rules: Optional[RuleEngine] = None, single_flight: Optional[SingleFlight] = None):
+        self.ai_service = AsyncAIService(rules=rules)
+        self.writer = writer
+        self.rules = rules
+        self.single_flight = single_flight
+        self.max_concurrent_tests = max_concurrent_tests or Config.MAX_CONCURRENT_TESTS
+
+    async def analyze_client_performance(self, client_id: int, domain: str, metrics: Dict[str, float]) -> Dict[str, Any]:
+        """Main RSI cycle for a client"""
+        if self.single_flight is None:
+            return await self._run_cycle(client_id, domain, metrics)
+        key = (client_id, domain, json.dumps(metrics, sort_keys=True))
+        return await self.single_flight.do(key, lambda: self._run_cycle(client_id, domain, metrics))
+
+    async def _run_cycle(self, client_id: int, domain: str, metrics: Dict[str, float]) -> Dict[str, Any]:
+        async for event, data in self.stream_client_performance(client_id, domain, metrics):
+            if event == "recommendations":
+                return data
+
+    async def stream_client_performance(
+        self, client_id: int, domain: str, metrics: Dict[str, float]
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """The RSI cycle as (event, data) pairs, each yielded as soon as it is known.
+
+        Events: performance_gaps, one proposal per proposal to test, one
+        test_result per finished test (in completion order, tagged with the
+        proposal's index), and finally recommendations with the full result.
+        """
+        
+        # 1. Analyze gaps (clear-cut cases are answered by the rules)
+        gaps = self.rules.evaluate(metrics, domain) if self.rules else None
+        if gaps is None:
+            gaps = await self.ai_service.analyze_performance_gaps(metrics, domain, client_id)
+        logger.info(f"Identified gaps for client {client_id}: {gaps}")
+        yield "performance_gaps", {"performance_gaps": gaps}
+        
+        # 2. Generate proposals (nothing to fix without gaps)
+        proposals_data = await self.ai_service.generate_improvement_plan(gaps, domain, client_id) if gaps else {}
+        proposals = proposals_data.get("proposals", [])[:2]
+        for index, proposal in enumerate(proposals):
+            yield "proposal", {"index": index, **proposal}
+        
+        # 3. Test top proposals concurrently, bounded by the fan-out limit
+        semaphore = asyncio.Semaphore(self.max_concurrent_tests)
+        test_data = self._get_test_data(domain)
+        
+        async def test_and_save(index: int, proposal: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+            async with semaphore:
+                test_result = await self.ai_service.test_intervention(proposal["hypothesis"], test_data)
+            if self.writer is not None:
+                self._save_experiment(client_id, proposal, test_result)
+            else:
+                await asyncio.to_thread(self._save_experiment, client_id, proposal, test_result)
+            return index, {
+                "hypothesis": proposal["hypothesis"],
+                "intervention": proposal["intervention"],
+                "test_results": test_result
+            }
+        
+        tasks = [asyncio.ensure_future(test_and_save(index, proposal)) for index, proposal in enumerate(proposals)]
+        tested_proposals = [None] * len(tasks)
+        try:
+            for finished in asyncio.as_completed(tasks):
+                index, tested = await finished
+                tested_proposals[index] = tested
+                yield "test_result", {"index": index, **tested}
+        finally:
+            # The consumer went away (e.g. a closed stream): stop the remaining tests
+            for task in tasks:
+                task.cancel()
+        
+        # 4. Return actionable recommendations
+        yield "recommendations", {
+            "client_id": client_id,
+            "domain": domain,
+            "performance_gaps": gaps,
+            "tested_proposals": tested_proposals,
+            "recommendations": self._generate_recommendations(tested_proposals)
+        }
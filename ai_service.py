@@ -1,79 +1,332 @@
-import openai
 from config import Config
-from typing import List, Dict, Any
+from llm_cache import LLMResultCache
+from llm_router import LLMRouter
+from circuit_breaker import CircuitBreaker, CircuitOpen
+import instrumentation
+import prompts
+from typing import Callable, List, Dict, Any, Optional, Tuple
+import ast
+import asyncio
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
-class AIService:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=Config.OPENAI_API_KEY)
-    
-    def analyze_performance_gaps(self, metrics: Dict[str, float], domain: str) -> List[str]:
-        """Analyze metrics to identify performance gaps"""
-        prompt = f"""
-        As a business AI analyst, analyze these {domain} metrics and identify the top 3 performance gaps:
-        
-        Metrics: {metrics}
-        
-        Return ONLY a JSON array of gap descriptions, no other text.
-        Example: ["High response time affecting customer satisfaction", "Low resolution rate for technical issues"]
-        """
-        
+def _parse(content: str) -> Any:
+    """An LLM answer as data: JSON, else a Python literal; never executed"""
+    try:
+        return json.loads(content)
+    except ValueError:
+        return ast.literal_eval(content.strip())
+
+def _gaps_prompt(metrics: Dict[str, float], domain: str) -> str:
+    return prompts.GAPS.render(domain=domain, metrics=prompts.compact_metrics(metrics))
+
+def _plan_prompt(gaps: List[str], domain: str) -> str:
+    return prompts.PLAN.render(domain=domain, gaps=prompts.compact_list(gaps))
+
+def _test_prompt(hypothesis: str, test_data: List[str]) -> str:
+    """The test prompt within PROMPT_TOKEN_BUDGET, cutting the hypothesis and cutting or sampling the conversations to fit"""
+    # The hypothesis may take what is left once there is room for one conversation
+    hypothesis = prompts.truncate_tokens(
+        " ".join(hypothesis.split()),
+        Config.PROMPT_TOKEN_BUDGET - prompts.TEST.static_tokens - Config.PROMPT_SAMPLE_TOKENS - 1
+    )
+    budget = Config.PROMPT_TOKEN_BUDGET - prompts.TEST.static_tokens - prompts.count_tokens(hypothesis)
+    conversations = prompts.fit_samples(test_data, budget, Config.PROMPT_SAMPLE_TOKENS)
+    return prompts.TEST.render(hypothesis=hypothesis, conversations="\n".join(conversations))
+
+def _gaps_batch_prompt(metrics_list: List[Dict[str, float]], domain: str) -> str:
+    sets = "\n".join(f"{i}: {prompts.compact_metrics(metrics)}" for i, metrics in enumerate(metrics_list))
+    return prompts.GAPS_BATCH.render(domain=domain, sets=sets)
+
+def _demux_gaps(content: str, count: int) -> List[Optional[List[str]]]:
+    """Split a batched gap analysis back into one gap list per metric set (None if missing)"""
+    parsed = _parse(content)
+    results = []
+    for i in range(count):
+        gaps = parsed.get(str(i), parsed.get(i))
+        results.append(list(gaps)[:3] if isinstance(gaps, (list, tuple)) else None)
+    return results
+
+def _batch_keys(metrics_list: List[Dict[str, float]], domain: str, cache: LLMResultCache, model: str) -> List[str]:
+    """Cache key of every metric set in a batch"""
+    return [cache.make_key(model, "analyze_performance_gaps", domain, metrics) for metrics in metrics_list]
+
+def _plan_batch(batch_keys: List[str], cached: Dict[str, Any]):
+    """Place cached gap analyses and chunk the remaining unique metric sets.
+
+    Returns (results, keys, chunks): results holds cached gaps or None, keys maps
+    each uncached key to the indices sharing it, chunks lists keys per LLM call.
+    """
+    results = [None] * len(batch_keys)
+    keys = {}
+    for i, key in enumerate(batch_keys):
+        if key in cached:
+            results[i] = cached[key]
+        else:
+            keys.setdefault(key, []).append(i)
+    pending = list(keys)
+    chunks = [pending[i:i + Config.ANALYSIS_BATCH_SIZE] for i in range(0, len(pending), Config.ANALYSIS_BATCH_SIZE)]
+    return results, keys, chunks
+
+def _fill_gaps_chunk(cache: LLMResultCache, chunk: List[str], keys: Dict[str, List[int]],
+                     parsed: List[Optional[List[str]]], latency: float, results: List,
+                     fallback: Callable[[int], List[str]]) -> None:
+    """Demultiplex one batched answer into results, caching every set the LLM answered.
+
+    Sets it didn't answer get fallback(index of the set).
+    """
+    for key, gaps in zip(chunk, parsed):
+        if gaps is not None:
+            cache.put(key, gaps, latency)
+        else:
+            gaps = fallback(keys[key][0])
+        for i in keys[key]:
+            results[i] = gaps
+
+def _fallback_gaps(rules, last_good: Dict, metrics: Dict[str, float], domain: str,
+                   client_id: Optional[int]) -> List[str]:
+    """Gaps without the LLM: the rules applied to the known metrics, else the client's last LLM answer for the domain"""
+    gaps = rules.evaluate(metrics, domain, strict=False) if rules is not None else None
+    if gaps is None:
+        gaps = last_good.get((client_id, "analyze_performance_gaps", domain))
+    return gaps if gaps is not None else ["Error in analysis - using fallback rules"]
+
+def _default_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        failure_rate=Config.CIRCUIT_FAILURE_RATE,
+        slow_rate=Config.CIRCUIT_SLOW_RATE,
+        slow_seconds=Config.CIRCUIT_SLOW_SECONDS,
+        window=Config.CIRCUIT_WINDOW,
+        min_calls=Config.CIRCUIT_MIN_CALLS,
+        open_seconds=Config.CIRCUIT_OPEN_SECONDS,
+        probes=Config.CIRCUIT_PROBES
+    )
+
+def _default_router() -> LLMRouter:
+    fast = (Config.FAST_MODEL, Config.FAST_BASE_URL)
+    return LLMRouter(
+        default=(Config.BASE_MODEL, Config.OPENAI_BASE_URL),
+        api_key=Config.OPENAI_API_KEY,
+        stages={"analyze_performance_gaps": fast, "analyze_performance_gaps_batch": fast},
+        hedge=(Config.HEDGE_MODEL, Config.HEDGE_BASE_URL),
+        hedge_quantile=Config.HEDGE_QUANTILE,
+        max_hedge_rate=Config.HEDGE_MAX_RATE,
+        min_samples=Config.HEDGE_MIN_SAMPLES,
+        breaker=_default_breaker,
+        timeout=Config.LLM_TIMEOUT,
+        max_retries=Config.LLM_MAX_RETRIES
+    )
+
+def _default_cache() -> LLMResultCache:
+    return LLMResultCache(
+        max_size=Config.LLM_CACHE_SIZE,
+        ttl=Config.LLM_CACHE_TTL,
+        digits=Config.LLM_CACHE_DIGITS,
+        db_path=Config.LLM_CACHE_DB or None
+    )
+
+class _Call:
+    """One cached LLM step: its cache key, how to ask, how to read the answer and what to answer without the LLM"""
+
+    def __init__(self, service: "_AIServiceBase", method: str, domain: str, payload: Any,
+                 prompt: Callable[[], str], max_tokens: int, failure: str, fallback: Callable[[], Any],
+                 read: Callable[[Any], Any] = lambda answer: answer, client_id: Optional[int] = None):
+        self.method = method
+        self.domain = domain
+        self.key = service.cache.make_key(service._model(method), method, domain, payload)
+        self.prompt = prompt  # Built only on a cache miss
+        self.max_tokens = max_tokens
+        self.failure = failure
+        self.fallback = fallback
+        self.read = read
+        self.client_id = client_id
+
+class _AIServiceBase:
+    """Prompts, answer parsing, caching and fallbacks shared by AIService and AsyncAIService.
+
+    The two differ only in how they reach the LLM (and the cache's SQLite
+    tier): each runs the _Call built here through its own _complete.
+
+    While the LLM's circuit breaker is open the fallbacks are instant: gaps
+    come from rules (a RuleEngine) applied to whatever metrics it knows, else
+    from the client's last good answer for the domain, and proposals are the
+    client's last good plan for the domain. Only calls given a client_id
+    remember or get a last good answer.
+    """
+
+    def __init__(self, cache: Optional[LLMResultCache] = None, router: Optional[LLMRouter] = None, rules=None):
+        self.cache = cache or _default_cache()
+        self.router = router or _default_router()
+        self.rules = rules
+        self._last_good = {}  # (client_id, method, domain) -> last LLM answer
+
+    def _model(self, method: str) -> str:
+        return self.router.route(method).model
+
+    def _gaps_call(self, metrics: Dict[str, float], domain: str, client_id: Optional[int]) -> _Call:
+        return _Call(self, "analyze_performance_gaps", domain, metrics,
+                     prompt=lambda: _gaps_prompt(metrics, domain), max_tokens=prompts.GAPS.max_tokens,
+                     failure="AI analysis failed", read=lambda gaps: gaps[:3], client_id=client_id,
+                     fallback=lambda: _fallback_gaps(self.rules, self._last_good, metrics, domain, client_id))
+
+    def _plan_call(self, gaps: List[str], domain: str, client_id: Optional[int]) -> _Call:
+        return _Call(self, "generate_improvement_plan", domain, gaps,
+                     prompt=lambda: _plan_prompt(gaps, domain), max_tokens=prompts.PLAN.max_tokens,
+                     failure="Proposal generation failed", client_id=client_id,
+                     fallback=lambda: self._last_good.get((client_id, "generate_improvement_plan", domain),
+                                                          {"proposals": []}))
+
+    def _test_call(self, hypothesis: str, test_data: List[str]) -> _Call:
+        return _Call(self, "test_intervention", "", {"hypothesis": hypothesis, "test_data": test_data},
+                     prompt=lambda: _test_prompt(hypothesis, test_data), max_tokens=prompts.TEST.max_tokens,
+                     failure="Intervention test failed",
+                     fallback=lambda: {"success_rate": 0.0, "improvement": 0.0, "risks": ["Test failed"]})
+
+    def _accept(self, call: _Call, content: str, start: float) -> Any:
+        """Read an LLM answer, cache it and remember it as the client's last good one"""
+        result = call.read(_parse(content))
+        self.cache.put(call.key, result, time.perf_counter() - start)
+        if call.client_id is not None:
+            self._last_good[(call.client_id, call.method, call.domain)] = result
+        return result
+
+    def _failed(self, call: _Call, e: Exception) -> Any:
+        # An open breaker is expected while the LLM is down; only real failures are logged
+        if not isinstance(e, CircuitOpen):
+            logger.error(f"{call.failure}: {e}")
+        return call.fallback()
+
+    def _batch_keys(self, metrics_list: List[Dict[str, float]], domain: str) -> List[str]:
+        return _batch_keys(metrics_list, domain, self.cache, self._model("analyze_performance_gaps_batch"))
+
+    def _chunk_request(self, chunk: List[str], keys: Dict[str, List[int]],
+                       metrics_list: List[Dict[str, float]], domain: str) -> Tuple[str, int, str]:
+        """_complete arguments for one chunk of a batched gap analysis"""
+        prompt = _gaps_batch_prompt([metrics_list[keys[key][0]] for key in chunk], domain)
+        return prompt, prompts.GAPS_BATCH.max_tokens * len(chunk), "analyze_performance_gaps_batch"
+
+    def _fill_chunk(self, chunk: List[str], keys: Dict[str, List[int]], metrics_list: List[Dict[str, float]],
+                    domain: str, results: List, client_ids: Optional[List[int]],
+                    content: Optional[str], start: float) -> None:
+        """Spread one chunk's answer over results; content is None when the LLM call failed"""
+        parsed, latency = [None] * len(chunk), 0.0
+        if content is not None:
+            try:
+                parsed = _demux_gaps(content, len(chunk))
+                latency = (time.perf_counter() - start) / len(chunk)
+            except Exception as e:
+                logger.error(f"Batched AI analysis failed: {e}")
+        _fill_gaps_chunk(self.cache, chunk, keys, parsed, latency, results,
+                         lambda i: _fallback_gaps(self.rules, self._last_good, metrics_list[i], domain,
+                                                  client_ids[i] if client_ids else None))
+
+    def _chunk_failed(self, e: Exception) -> None:
+        if not isinstance(e, CircuitOpen):
+            logger.error(f"Batched AI analysis failed: {e}")
+
+class AIService(_AIServiceBase):
+    """LLM analysis steps, each cached and with a fallback answer when the LLM fails"""
+
+    def warm_up(self) -> None:
+        """Build the OpenAI clients ahead of the first call (e.g. from a background thread)"""
+        self.router.warm_up(use_async=False)
+
+    def _complete(self, prompt: str, max_tokens: int, method: str) -> str:
+        with instrumentation.timed(f"llm_{method}"):
+            return self.router.complete(prompt, max_tokens, method)
+
+    def _run(self, call: _Call) -> Any:
+        cached = self.cache.get(call.key)
+        if cached is not None:
+            return cached
         try:
-            response = self.client.chat.completions.create(
-                model=Config.BASE_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200
-            )
-            
-            gaps = eval(response.choices[0].message.content)
-            return gaps[:3]  # Return top 3 gaps
-            
+            start = time.perf_counter()
+            return self._accept(call, self._complete(call.prompt(), call.max_tokens, call.method), start)
         except Exception as e:
-            logger.error(f"AI analysis failed: {e}")
-            return ["Error in analysis - using fallback rules"]
-    
-    def generate_improvement_plan(self, gaps: List[str], domain: str) -> Dict[str, Any]:
+            return self._failed(call, e)
+
+    def analyze_performance_gaps(self, metrics: Dict[str, float], domain: str,
+                                 client_id: Optional[int] = None) -> List[str]:
+        """Analyze metrics to identify performance gaps"""
+        return self._run(self._gaps_call(metrics, domain, client_id))
+
+    def analyze_performance_gaps_batch(self, metrics_list: List[Dict[str, float]], domain: str,
+                                       client_ids: Optional[List[int]] = None) -> List[List[str]]:
+        """Analyze many metric sets of one domain, several per LLM call; client_ids[i] owns metrics_list[i]"""
+        batch_keys = self._batch_keys(metrics_list, domain)
+        results, keys, chunks = _plan_batch(batch_keys, self.cache.get_many(batch_keys))
+        for chunk in chunks:
+            start, content = time.perf_counter(), None
+            try:
+                content = self._complete(*self._chunk_request(chunk, keys, metrics_list, domain))
+            except Exception as e:
+                self._chunk_failed(e)
+            self._fill_chunk(chunk, keys, metrics_list, domain, results, client_ids, content, start)
+        return results
+
+    def generate_improvement_plan(self, gaps: List[str], domain: str,
+                                  client_id: Optional[int] = None) -> Dict[str, Any]:
         """Generate specific improvement proposals"""
-        prompt = f"""
-        For {domain} business, generate specific improvement proposals for these gaps: {gaps}
-        
-        Return JSON: {{"proposals": [{{"hypothesis": "text", "intervention": "prompt_change|adapter_training", "expected_impact": 0.15}}]}}
-        """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=Config.BASE_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300
-            )
-            
-            return eval(response.choices[0].message.content)
-            
-        except Exception as e:
-            logger.error(f"Proposal generation failed: {e}")
-            return {"proposals": []}
-    
+        return self._run(self._plan_call(gaps, domain, client_id))
+
     def test_intervention(self, hypothesis: str, test_data: List[str]) -> Dict[str, Any]:
         """Test a specific intervention with sample data"""
-        prompt = f"""
-        Test this business hypothesis: {hypothesis}
-        
-        With sample conversations: {test_data}
-        
-        Return JSON: {{"success_rate": 0.85, "improvement": 0.12, "risks": ["risk1", "risk2"]}}
-        """
-        
+        return self._run(self._test_call(hypothesis, test_data))
+
+class AsyncAIService(_AIServiceBase):
+    """AIService on the non-blocking OpenAI client, with hedging"""
+
+    def warm_up(self) -> None:
+        """Build the OpenAI clients ahead of the first call (e.g. from a background thread)"""
+        self.router.warm_up(use_async=True)
+
+    async def _complete(self, prompt: str, max_tokens: int, method: str) -> str:
+        with instrumentation.timed(f"llm_{method}"):
+            return await self.router.acomplete(prompt, max_tokens, method)
+
+    async def _run(self, call: _Call) -> Any:
+        cached = await self.cache.aget(call.key)
+        if cached is not None:
+            return cached
         try:
-            response = self.client.chat.completions.create(
-                model=Config.BASE_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200
-            )
-            
-            return eval(response.choices[0].message.content)
-            
+            start = time.perf_counter()
+            return self._accept(call, await self._complete(call.prompt(), call.max_tokens, call.method), start)
         except Exception as e:
-            logger.error(f"Intervention test failed: {e}")
-            return {"success_rate": 0.0, "improvement": 0.0, "risks": ["Test failed"]}
\ No newline at end of file
+            return self._failed(call, e)
+
+    async def analyze_performance_gaps(self, metrics: Dict[str, float], domain: str,
+                                       client_id: Optional[int] = None) -> List[str]:
+        """Analyze metrics to identify performance gaps"""
+        return await self._run(self._gaps_call(metrics, domain, client_id))
+
+    async def analyze_performance_gaps_batch(self, metrics_list: List[Dict[str, float]], domain: str,
+                                             client_ids: Optional[List[int]] = None) -> List[List[str]]:
+        """Analyze many metric sets of one domain, several per LLM call; client_ids[i] owns metrics_list[i]"""
+        batch_keys = self._batch_keys(metrics_list, domain)
+        results, keys, chunks = _plan_batch(batch_keys, await self.cache.aget_many(batch_keys))
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_BATCHES)
+
+        async def run(chunk: List[str]) -> None:
+            async with semaphore:
+                start, content = time.perf_counter(), None
+                try:
+                    content = await self._complete(*self._chunk_request(chunk, keys, metrics_list, domain))
+                except Exception as e:
+                    self._chunk_failed(e)
+                self._fill_chunk(chunk, keys, metrics_list, domain, results, client_ids, content, start)
+
+        await asyncio.gather(*(run(chunk) for chunk in chunks))
+        return results
+
+    async def generate_improvement_plan(self, gaps: List[str], domain: str,
+                                        client_id: Optional[int] = None) -> Dict[str, Any]:
+        """Generate specific improvement proposals"""
+        return await self._run(self._plan_call(gaps, domain, client_id))
+
+    async def test_intervention(self, hypothesis: str, test_data: List[str]) -> Dict[str, Any]:
+        """Test a specific intervention with sample data"""
+        return await self._run(self._test_call(hypothesis, test_data))
@@ -0,0 +1,97 @@
+from typing import Dict, Iterable, List, Optional
+import math
+import threading
+import time
+
+class _State:
+    """EWMA mean/variance and alert state of one (client, metric) series"""
+
+    __slots__ = ("count", "mean", "var", "in_alert", "last_alert")
+
+    def __init__(self, value: float):
+        self.count = 1
+        self.mean = value
+        self.var = 0.0
+        self.in_alert = False
+        self.last_alert = float("-inf")
+
+class AnomalyDetector:
+    """Online detector for sudden metric degradation.
+
+    Keeps O(1) state per (client, metric): an exponentially weighted mean and
+    variance. A value scoring worse than `enter` standard deviations from the
+    mean starts an alert. The series must recover to within `exit` standard
+    deviations before it can alert again (hysteresis), and alerts for the same
+    series are at least `cooldown` seconds apart (debouncing).
+
+    The standard deviation is floored at rel_floor * |mean| and abs_floor, so a
+    series that has been flat (zero variance) still alerts on a sudden cliff.
+    Values that aren't finite numbers (NaN, infinities, strings, None) are
+    ignored rather than folded into the mean.
+    """
+
+    def __init__(self, alpha: float = 0.1, enter: float = 3.0, exit: float = 1.0,
+                 warmup: int = 5, cooldown: float = 900.0, higher_is_worse: Iterable[str] = (),
+                 rel_floor: float = 0.02, abs_floor: float = 0.01):
+        self.alpha = alpha
+        self.enter = enter
+        self.exit = exit
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.higher_is_worse = set(higher_is_worse)
+        self.rel_floor = rel_floor
+        self.abs_floor = abs_floor
+        self._states = {}  # (client_id, metric) -> _State
+        self._lock = threading.Lock()
+        self.alerts = 0
+        self.rejected = 0
+
+    def update(self, client_id: int, metrics: Dict[str, float], now: Optional[float] = None) -> List[Dict]:
+        """Fold one snapshot into the state; returns the alerts it triggers"""
+        now = time.time() if now is None else now
+        alerts = []
+        with self._lock:
+            for metric, value in metrics.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = math.nan
+                if not math.isfinite(value):
+                    self.rejected += 1
+                    continue
+                key = (client_id, metric)
+                state = self._states.get(key)
+                if state is None:
+                    self._states[key] = _State(value)
+                    continue
+
+                # Score against the baseline before this value moves it; negative means worse
+                std = max(math.sqrt(state.var), self.rel_floor * abs(state.mean), self.abs_floor)
+                score = (value - state.mean) / std
+                if metric in self.higher_is_worse:
+                    score = -score
+
+                if state.in_alert and score > -self.exit:
+                    state.in_alert = False
+                elif (not state.in_alert and state.count >= self.warmup and score < -self.enter
+                        and now - state.last_alert >= self.cooldown):
+                    state.in_alert = True
+                    state.last_alert = now
+                    self.alerts += 1
+                    alerts.append({"metric": metric, "baseline": state.mean, "value": value, "score": score})
+
+                diff = value - state.mean
+                increment = self.alpha * diff
+                state.mean += increment
+                state.var = (1 - self.alpha) * (state.var + diff * increment)
+                state.count += 1
+        return alerts
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "series": len(self._states),
+                "in_alert": sum(1 for state in self._states.values() if state.in_alert),
+                "alerts": self.alerts,
+                "rejected_values": self.rejected
+            }
@@ -1,65 +1,10 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
-import sqlite3
-import json
 import os
+from simple_main import create_app
 
-app = FastAPI(title="AICSA Pro")
-
-# Simple in-memory storage for demo
-clients = {}
-experiments = []
-
-@app.get("/", response_class=HTMLResponse)
-async def dashboard():
-    return """
-    <html>
-    <head><title>AICSA Pro</title></head>
-    <body>
-        <h1>🚀 AICSA Pro - AI Customer Success Automation</h1>
-        <p>Your AI business optimization platform is running!</p>
-        <p>Dashboard features coming soon...</p>
-    </body>
-    </html>
-    """
-
-@app.post("/register-client")
-async def register_client(client_data: dict):
-    client_id = len(clients) + 1
-    api_key = f"acs_{client_id}_{os.urandom(4).hex()}"
-    clients[api_key] = {
-        "id": client_id,
-        "name": client_data.get("client_name", "Test Client"),
-        "domain": client_data.get("domain", "customer_support")
-    }
-    return {
-        "client_id": client_id,
-        "api_key": api_key,
-        "message": "Client registered successfully"
-    }
-
-@app.post("/analyze-performance")
-async def analyze_performance(metrics_data: dict):
-    # Simple AI simulation
-    metrics = metrics_data.get("metrics", {})
-    
-    performance_gaps = []
-    if metrics.get("response_accuracy", 1) < 0.8:
-        performance_gaps.append("Improve response accuracy")
-    if metrics.get("resolution_time", 0) > 2.0:
-        performance_gaps.append("Reduce resolution time")
-    
-    return {
-        "status": "success",
-        "performance_gaps": performance_gaps,
-        "recommendations": ["Implement AI-powered response templates", "Optimize workflow processes"]
-    }
-
-@app.get("/health")
-async def health():
-    return {"status": "healthy", "service": "AICSA Pro"}
+# Render runs `uvicorn app:app`; the app itself is built by simple_main.create_app
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import threading
+import time
+
+# Sentinel stored for API keys that are known to be invalid
+_MISSING = object()
+
+class AuthCache:
+    """Bounded LRU cache of API key -> client with TTL and negative caching.
+
+    With a shared_state.Watch, invalidate_client() on any worker empties the
+    cache on every worker, so a deactivated key stops working everywhere.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0, watch=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.watch = watch
+        self._entries = OrderedDict()  # api_key -> (expires_at, client or _MISSING)
+        self._keys_by_client = {}  # client_id -> api_key, for invalidation by id
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def get_client(self, api_key: str, loader: Callable[[str], Optional[Any]]) -> Optional[Any]:
+        """Return the cached client for an API key, calling loader on a miss.
+
+        loader must return a client object detached from its session, or None
+        if the key is unknown. Unknown keys are cached for negative_ttl seconds.
+        """
+        if self.watch is not None and self.watch.changed():
+            self.clear()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(api_key)
+                    if entry[1] is _MISSING:
+                        self.negative_hits += 1
+                        return None
+                    self.hits += 1
+                    return entry[1]
+                self._remove(api_key)
+            self.misses += 1
+
+        client = loader(api_key)
+        self.put(api_key, client)
+        return client
+
+    def put(self, api_key: str, client: Optional[Any]) -> None:
+        """Store a lookup result (None means the key is invalid)"""
+        now = time.monotonic()
+        with self._lock:
+            self._remove(api_key)
+            if client is None:
+                self._entries[api_key] = (now + self.negative_ttl, _MISSING)
+            else:
+                self._entries[api_key] = (now + self.ttl, client)
+                self._keys_by_client[client.id] = api_key
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, api_key: str) -> None:
+        """Drop a single API key, e.g. after a client is created with it"""
+        with self._lock:
+            self._remove(api_key)
+
+    def invalidate_client(self, client_id: int) -> None:
+        """Drop the cached entry for a client, e.g. after it is deactivated"""
+        with self._lock:
+            api_key = self._keys_by_client.get(client_id)
+            if api_key is not None:
+                self._remove(api_key)
+        if self.watch is not None:
+            self.watch.bump()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_client.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, api_key: str) -> None:
+        # Caller must hold the lock
+        entry = self._entries.pop(api_key, None)
+        if entry is not None and entry[1] is not _MISSING:
+            if self._keys_by_client.get(entry[1].id) == api_key:
+                del self._keys_by_client[entry[1].id]
+
+def parse_api_key(auth_header: Optional[str]) -> Optional[str]:
+    """Extract the API key from an Authorization header"""
+    if not auth_header:
+        return None
+    if auth_header.startswith("Bearer "):
+        return auth_header.replace("Bearer ", "")
+    return auth_header
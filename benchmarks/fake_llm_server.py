@@ -0,0 +1,89 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uvicorn
+
+# OpenAI-compatible stand-in for load tests; point the service at it with
+# OPENAI_BASE_URL=http://127.0.0.1:8002/v1
+# Latency is lognormal around FAKE_LLM_LATENCY_MS, e.g. FAKE_LLM_LATENCY_MS=800 FAKE_LLM_LATENCY_SIGMA=0.5
+FAKE_LLM_PORT = int(os.getenv("FAKE_LLM_PORT", "8002"))
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "500"))
+FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.4"))
+# Tail latency: this share of requests takes FAKE_LLM_SLOW_MS instead, e.g. to exercise hedging
+FAKE_LLM_SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+FAKE_LLM_SLOW_MS = float(os.getenv("FAKE_LLM_SLOW_MS", "5000"))
+FAKE_LLM_MS_PER_TOKEN = float(os.getenv("FAKE_LLM_MS_PER_TOKEN", "0"))  # Extra latency per completion token
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_THROTTLE_RATE = float(os.getenv("FAKE_LLM_THROTTLE_RATE", "0"))  # Share of 429 responses
+FAKE_LLM_COMPLETION_TOKENS = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", "60"))
+
+app = FastAPI(title="Fake LLM Server")
+stats = {"requests": 0, "slow": 0, "errors": 0, "throttled": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def answer(prompt: str) -> str:
+    """A well-formed reply for whichever AIService prompt this is"""
+    if "mapping each set number" in prompt:
+        count = len(re.findall(r"^\s*\d+: ", prompt, flags=re.M))
+        return json.dumps({str(i): ["Low response accuracy", "Slow resolution"] for i in range(count)})
+    if "improvement proposals" in prompt:
+        return json.dumps({"proposals": [
+            {"hypothesis": "Add verified answer snippets to the prompt", "intervention": "prompt_change", "expected_impact": 0.15},
+            {"hypothesis": "Fine-tune on resolved tickets", "intervention": "adapter_training", "expected_impact": 0.1}
+        ]})
+    if "hypothesis" in prompt:
+        return json.dumps({"success_rate": round(random.uniform(0.5, 0.95), 2), "improvement": 0.1, "risks": ["Tone drift"]})
+    return json.dumps(["Low response accuracy", "Slow resolution", "Low first contact resolution"])
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+    stats["requests"] += 1
+
+    latency = random.lognormvariate(0, FAKE_LLM_LATENCY_SIGMA) * FAKE_LLM_LATENCY_MS
+    if random.random() < FAKE_LLM_SLOW_RATE:
+        stats["slow"] += 1
+        latency = FAKE_LLM_SLOW_MS
+    latency += FAKE_LLM_MS_PER_TOKEN * FAKE_LLM_COMPLETION_TOKENS
+    await asyncio.sleep(latency / 1000)
+
+    roll = random.random()
+    if roll < FAKE_LLM_THROTTLE_RATE:
+        stats["throttled"] += 1
+        return JSONResponse(status_code=429, content={"error": {"message": "Rate limit reached", "type": "requests"}})
+    if roll < FAKE_LLM_THROTTLE_RATE + FAKE_LLM_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Simulated failure", "type": "server_error"}})
+
+    prompt_tokens = max(1, len(prompt) // 4)
+    stats["prompt_tokens"] += prompt_tokens
+    stats["completion_tokens"] += FAKE_LLM_COMPLETION_TOKENS
+    return {
+        "id": f"chatcmpl-fake-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer(prompt)},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": FAKE_LLM_COMPLETION_TOKENS,
+            "total_tokens": prompt_tokens + FAKE_LLM_COMPLETION_TOKENS
+        }
+    }
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+if __name__ == "__main__":
+    print(f"🤖 Fake LLM server on http://127.0.0.1:{FAKE_LLM_PORT}/v1 ({FAKE_LLM_LATENCY_MS:g} ms median)")
+    uvicorn.run(app, host="127.0.0.1", port=FAKE_LLM_PORT, log_level="warning")
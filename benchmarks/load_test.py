@@ -0,0 +1,277 @@
+"""Load test for the AICSA Pro API against local fake LLM and webhook servers.
+
+Starts the fake LLM server, the webhook receiver and simple_main under uvicorn
+(unless --url points at a running service), drives the chosen endpoints at a
+fixed concurrency and writes latency percentiles, throughput and error counts
+as JSON so runs on different commits can be compared:
+
+    python benchmarks/load_test.py --concurrency 32 --requests 1000 --output after.json --compare before.json
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["register-client", "client-metrics", "analyze-performance", "test-webhook"]
+LOCK_ERROR = "database is locked"
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def random_metrics(novel: bool) -> Dict[str, float]:
+    """Customer-support metrics around the rule thresholds; novel adds a metric only the LLM can judge"""
+    metrics = {
+        "response_accuracy": round(random.uniform(0.6, 0.95), 3),
+        "resolution_time": round(random.uniform(1.0, 4.0), 2),
+        "customer_satisfaction": round(random.uniform(3.0, 4.8), 2)
+    }
+    if novel:
+        metrics["sentiment_drift"] = round(random.uniform(-1, 1), 3)
+    return metrics
+
+def spawn(args: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable] + args, cwd=ROOT, env={**os.environ, **env},
+                            stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:g}s")
+
+def fake_llm(options, port: int, workdir: str, name: str) -> subprocess.Popen:
+    return spawn(["benchmarks/fake_llm_server.py"], {
+        "FAKE_LLM_PORT": str(port),
+        "FAKE_LLM_LATENCY_MS": str(options.llm_latency_ms),
+        "FAKE_LLM_LATENCY_SIGMA": str(options.llm_latency_sigma),
+        "FAKE_LLM_SLOW_RATE": str(options.llm_slow_rate),
+        "FAKE_LLM_SLOW_MS": str(options.llm_slow_ms),
+        "FAKE_LLM_ERROR_RATE": str(options.llm_error_rate),
+        "FAKE_LLM_COMPLETION_TOKENS": str(options.llm_tokens)
+    }, os.path.join(workdir, f"{name}.log"))
+
+def start_stack(options, workdir: str) -> List[subprocess.Popen]:
+    """Fake LLM server(s), webhook receiver and the service, all on localhost"""
+    processes = [
+        fake_llm(options, options.llm_port, workdir, "fake_llm"),
+        spawn(["test_webhook_receiver.py"], {
+            "RECEIVER_PORT": str(options.receiver_port),
+            "RECEIVER_DELAY": str(options.receiver_delay),
+            "RECEIVER_FAIL_RATE": str(options.receiver_fail_rate),
+            "RECEIVER_QUIET": "1"
+        }, os.path.join(workdir, "receiver.log"))
+    ]
+    hedge_env = {"HEDGE_MAX_RATE": str(options.hedge_max_rate)}
+    if options.hedge_llm_port:
+        processes.append(fake_llm(options, options.hedge_llm_port, workdir, "fake_llm_hedge"))
+        wait_until_up(f"http://127.0.0.1:{options.hedge_llm_port}/stats")
+        hedge_env["HEDGE_BASE_URL"] = f"http://127.0.0.1:{options.hedge_llm_port}/v1"
+    wait_until_up(f"http://127.0.0.1:{options.llm_port}/stats")
+    wait_until_up(f"http://127.0.0.1:{options.receiver_port}/")
+    processes.append(spawn(
+        ["-m", "uvicorn", "simple_main:app", "--port", str(options.port), "--log-level", "warning"],
+        {
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "METRICS_DATA_DIR": os.path.join(workdir, "metrics_data"),
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{options.llm_port}/v1",
+            "OPENAI_API_KEY": "benchmark",
+            "LLM_CACHE_DB": "",
+            "QUOTA_FREE_MONTHLY": "100000000",
+            "QUOTA_FREE_RPM": "100000000",
+            **hedge_env
+        },
+        os.path.join(workdir, "service.log")
+    ))
+    wait_until_up(f"http://127.0.0.1:{options.port}/health")
+    return processes
+
+async def setup_clients(http: httpx.AsyncClient, count: int, receiver_url: str) -> List[str]:
+    """Register clients, each with a webhook at the fake receiver"""
+    keys = []
+    tag = int(time.time() * 1000)
+    for i in range(count):
+        response = await http.post("/register-client", json={
+            "client_name": f"bench_{tag}_{i}", "domain": "customer_support", "metrics": {}
+        })
+        response.raise_for_status()
+        key = response.json()["api_key"]
+        await http.post("/register-webhook", headers={"Authorization": key},
+                        json={"webhook_url": receiver_url, "event_types": "all"})
+        keys.append(key)
+    return keys
+
+def make_request(scenario: str, keys: List[str], novel: bool, sequence: int):
+    key = random.choice(keys)
+    headers = {"Authorization": key}
+    if scenario == "register-client":
+        return "POST", "/register-client", None, {
+            "client_name": f"bench_new_{time.time_ns()}_{sequence}", "domain": "customer_support", "metrics": {}
+        }
+    if scenario == "client-metrics":
+        return "POST", "/client-metrics", headers, {"metrics": random_metrics(novel)}
+    if scenario == "analyze-performance":
+        return "POST", "/analyze-performance", headers, {"domain": "customer_support", "metrics": random_metrics(novel)}
+    if scenario == "test-webhook":
+        return "POST", "/test-webhook", headers, None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+async def run_scenario(http: httpx.AsyncClient, scenario: str, keys: List[str], options) -> Dict[str, Any]:
+    latencies = []
+    statuses = {}
+    lock_errors = 0
+    issued = 0
+
+    async def worker() -> None:
+        nonlocal issued, lock_errors
+        while issued < options.requests:
+            issued += 1
+            method, path, headers, body = make_request(scenario, keys, options.novel, issued)
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, path, headers=headers, json=body)
+                status = str(response.status_code)
+                if LOCK_ERROR in response.text:
+                    lock_errors += 1
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(options.concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "ok": statuses.get("200", 0) + statuses.get("202", 0),
+        "statuses": statuses,
+        "lock_errors": lock_errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None
+        }
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print relative change per scenario; negative latency and positive throughput are better"""
+    print(f"\nCompared with {baseline.get('commit')}:")
+    for scenario, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        changes = []
+        for name in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][name], current["latency_ms"][name]
+            if old and new is not None:
+                changes.append(f"{name} {100 * (new - old) / old:+.1f}%")
+        old, new = before["requests_per_second"], current["requests_per_second"]
+        if old and new is not None:
+            changes.append(f"rps {100 * (new - old) / old:+.1f}%")
+        print(f"  {scenario:20s} " + ", ".join(changes))
+
+async def run(options) -> Dict[str, Any]:
+    base_url = options.url or f"http://127.0.0.1:{options.port}"
+    receiver_url = options.receiver_url or f"http://127.0.0.1:{options.receiver_port}/webhook"
+    limits = httpx.Limits(max_connections=options.concurrency, max_keepalive_connections=options.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=options.timeout, limits=limits) as http:
+        keys = await setup_clients(http, options.clients, receiver_url)
+        scenarios = {}
+        for scenario in options.scenarios.split(","):
+            print(f"▶ {scenario}: {options.requests} requests at concurrency {options.concurrency}")
+            scenarios[scenario] = await run_scenario(http, scenario, keys, options)
+            summary = scenarios[scenario]
+            print(f"  {summary['requests_per_second']} req/s, p50 {summary['latency_ms']['p50']:.1f} ms, "
+                  f"p95 {summary['latency_ms']['p95']:.1f} ms, p99 {summary['latency_ms']['p99']:.1f} ms, "
+                  f"statuses {summary['statuses']}, lock errors {summary['lock_errors']}")
+    return scenarios
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running service instead of starting one")
+    parser.add_argument("--receiver-url", help="Webhook URL to register (default: the local fake receiver)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=300, help="Requests per scenario")
+    parser.add_argument("--clients", type=int, default=8, help="Clients registered for the run")
+    parser.add_argument("--novel", action="store_true", help="Add a metric the rules can't judge, so every analysis hits the LLM")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--llm-port", type=int, default=8002)
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.4)
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Share of LLM calls that take --llm-slow-ms")
+    parser.add_argument("--llm-slow-ms", type=float, default=5000)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-tokens", type=int, default=60)
+    parser.add_argument("--hedge-llm-port", type=int, default=0, help="Start a second fake LLM server as the hedge endpoint")
+    parser.add_argument("--hedge-max-rate", type=float, default=0.05, help="HEDGE_MAX_RATE for the service (0 disables)")
+    parser.add_argument("--receiver-port", type=int, default=8001)
+    parser.add_argument("--receiver-delay", type=float, default=0.0)
+    parser.add_argument("--receiver-fail-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aicsa_bench_")
+    processes = [] if options.url else start_stack(options, workdir)
+    try:
+        scenarios = asyncio.run(run(options))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    service_log = os.path.join(workdir, "service.log")
+    logged_lock_errors = 0
+    if os.path.exists(service_log):
+        with open(service_log) as f:
+            logged_lock_errors = f.read().count(LOCK_ERROR)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {name: value for name, value in vars(options).items() if name not in ("output", "compare")},
+        "logged_lock_errors": logged_lock_errors,
+        "scenarios": scenarios
+    }
+    print(f"DB lock errors in service log: {logged_lock_errors}  (logs in {workdir})")
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {options.output}")
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
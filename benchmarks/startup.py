@@ -0,0 +1,179 @@
+"""Cold-start benchmark for the AICSA Pro app factory.
+
+Each run starts a fresh interpreter and measures, in milliseconds:
+
+    import        importing simple_main (builds the app, touches no database or LLM client)
+    create_app    building one more app from the factory
+    startup       the lifespan startup (schema, workers)
+    first_health  the first GET /health after startup
+    first_llm     registering a client and its first LLM-backed analysis
+    uvicorn_ready spawning `uvicorn app:app` until /health answers
+
+The LLM is the local fake server. Medians go to stdout, or as JSON to --output so
+runs on different commits can be compared:
+
+    python benchmarks/startup.py --runs 7 --output after.json --compare before.json
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+from load_test import git_commit, spawn, wait_until_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["import", "create_app", "startup", "first_health", "first_llm", "uvicorn_ready"]
+
+# Runs in the fresh interpreter; prints one JSON line of stage timings
+PROBE = """
+import time
+import asyncio, json, httpx
+timings = {}
+
+def lap(stage, since):
+    now = time.perf_counter()
+    timings[stage] = round((now - since) * 1000, 2)
+    return now
+
+mark = time.perf_counter()
+import simple_main
+mark = lap("import", mark)
+simple_main.create_app()
+mark = lap("create_app", mark)
+
+async def main():
+    app = simple_main.app
+    mark = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        mark = lap("startup", mark)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://probe", timeout=60) as http:
+            (await http.get("/health")).raise_for_status()
+            mark = lap("first_health", mark)
+            key = (await http.post("/register-client", json={
+                "client_name": "startup_probe", "domain": "customer_support", "metrics": {}
+            })).json()["api_key"]
+            (await http.post("/analyze-performance", headers={"Authorization": key}, json={
+                "domain": "customer_support",
+                "metrics": {"response_accuracy": 0.7, "sentiment_drift": 0.4}
+            })).raise_for_status()
+            lap("first_llm", mark)
+
+asyncio.run(main())
+print(json.dumps(timings))
+"""
+
+def service_env(workdir: str, run: int, llm_port: int) -> Dict[str, str]:
+    """A fresh database per run, so every run pays for creating the schema"""
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, f'startup_{run}.db')}",
+        "METRICS_DATA_DIR": os.path.join(workdir, f"metrics_{run}"),
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "LLM_CACHE_DB": "",
+        "QUOTA_FREE_MONTHLY": "100000000",
+        "QUOTA_FREE_RPM": "100000000"
+    }
+
+def probe(env: Dict[str, str]) -> Dict[str, float]:
+    output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=ROOT, env={**os.environ, **env},
+                                     stderr=subprocess.DEVNULL, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+def uvicorn_ready(env: Dict[str, str], port: int, workdir: str) -> float:
+    """Milliseconds from spawning the deployed entry point until /health answers"""
+    start = time.perf_counter()
+    process = spawn(["-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                    env, os.path.join(workdir, "uvicorn.log"))
+    try:
+        # One client for all polls; building one per poll costs more than the poll
+        with httpx.Client(timeout=1.0) as http:
+            deadline = start + 60
+            while time.perf_counter() < deadline:
+                try:
+                    if http.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                        return round((time.perf_counter() - start) * 1000, 2)
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError("uvicorn did not answer /health within 60s")
+    finally:
+        process.terminate()
+        process.wait()
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, Dict[str, Optional[float]]]:
+    summary = {}
+    for stage in STAGES:
+        values = sorted(run[stage] for run in runs if stage in run)
+        summary[stage] = {
+            "median": round(statistics.median(values), 2) if values else None,
+            "min": values[0] if values else None,
+            "max": values[-1] if values else None
+        }
+    return summary
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print the relative change of each stage median; negative is faster"""
+    print(f"\nCompared with {baseline.get('commit')}:")
+    for stage, current in results["stages"].items():
+        old = baseline.get("stages", {}).get(stage, {}).get("median")
+        new = current["median"]
+        if old and new is not None:
+            print(f"  {stage:14s} {old:9.1f} ms -> {new:9.1f} ms  ({100 * (new - old) / old:+.1f}%)")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--llm-port", type=int, default=8002)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--skip-uvicorn", action="store_true", help="Only measure in-process stages")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aicsa_startup_")
+    fake_llm = spawn(["benchmarks/fake_llm_server.py"], {
+        "FAKE_LLM_PORT": str(options.llm_port),
+        "FAKE_LLM_LATENCY_MS": str(options.llm_latency_ms),
+        "FAKE_LLM_LATENCY_SIGMA": "0"
+    }, os.path.join(workdir, "fake_llm.log"))
+    runs = []
+    try:
+        wait_until_up(f"http://127.0.0.1:{options.llm_port}/stats")
+        for run in range(options.runs):
+            env = service_env(workdir, run, options.llm_port)
+            timings = probe(env)
+            if not options.skip_uvicorn:
+                timings["uvicorn_ready"] = uvicorn_ready(env, options.port, workdir)
+            runs.append(timings)
+            print(f"▶ run {run + 1}/{options.runs}: " + ", ".join(f"{k} {v:.1f}" for k, v in timings.items()))
+    finally:
+        fake_llm.terminate()
+        fake_llm.wait()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {name: value for name, value in vars(options).items() if name not in ("output", "compare")},
+        "stages": summarize(runs),
+        "runs": runs
+    }
+    print("\nMedian ms: " + ", ".join(f"{stage} {value['median']}" for stage, value in results["stages"].items()
+                                     if value["median"] is not None))
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {options.output}")
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from collections import deque
+from typing import Any, Dict
+import logging
+import threading
+import time
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpen(Exception):
+    """A call was refused without being tried, because its breaker is open"""
+
+class CircuitBreaker:
+    """Fails calls to a sick dependency instantly instead of waiting for its timeout.
+
+    Closed: calls go through, and the last `window` outcomes are kept. Once
+    min_calls are in, a failure share of failure_rate or a share of calls
+    slower than slow_seconds of slow_rate opens the breaker. Open: acquire()
+    raises CircuitOpen for open_seconds. Half-open: up to `probes` calls at a
+    time go through; when `probes` of them succeed quickly the breaker closes,
+    and any failure or slow probe opens it again.
+
+    Each call takes a ticket from acquire() and hands it back to record(), or
+    to release() if it was cancelled, so an outcome is only counted against
+    the state it was admitted in.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, slow_rate: float = 0.8,
+                 slow_seconds: float = 10.0, window: int = 50, min_calls: int = 10,
+                 open_seconds: float = 30.0, probes: int = 1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # (failed, slow) of calls admitted while closed
+        self._opened_at = 0.0
+        self._probing = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        instrumentation.CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], name)
+
+    def acquire(self) -> str:
+        """Admit a call, returning its ticket, or raise CircuitOpen"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return CLOSED
+            if self.state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return HALF_OPEN
+            self.rejected += 1
+        instrumentation.CIRCUIT_REJECTED.inc(self.name)
+        raise CircuitOpen(f"Circuit {self.name} is {self.state}")
+
+    def is_open(self) -> bool:
+        """Whether acquire() would refuse a call right now"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at < self.open_seconds
+            return self.state == HALF_OPEN and self._probing >= self.probes
+
+    def record(self, ticket: str, ok: bool, seconds: float) -> None:
+        """Count the outcome of an admitted call"""
+        failed, slow = not ok, seconds >= self.slow_seconds
+        with self._lock:
+            if ticket != self.state:
+                # Admitted before the last transition; says nothing about the current state
+                return
+            if ticket == HALF_OPEN:
+                self._probing -= 1
+                if failed or slow:
+                    self._transition(OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self._transition(CLOSED)
+                return
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            if failures >= self.failure_rate * calls or slow_calls >= self.slow_rate * calls:
+                self._transition(OPEN)
+
+    def release(self, ticket: str) -> None:
+        """Hand back the ticket of a call that was cancelled before it finished"""
+        with self._lock:
+            if ticket == HALF_OPEN and self.state == HALF_OPEN:
+                self._probing -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_failure_rate": round(sum(1 for failed, _ in self._outcomes if failed) / calls, 4) if calls else 0.0,
+                "rejected": self.rejected
+            }
+
+    def _transition(self, state: str) -> None:
+        # Caller must hold the lock
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        self._outcomes.clear()
+        self._probing = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        instrumentation.CIRCUIT_STATE.set(_STATE_VALUES[state], self.name)
+        instrumentation.CIRCUIT_TRANSITIONS.inc(self.name, state)
@@ -0,0 +1,121 @@
+import os
+
+class Config:
+    """Runtime settings, read from environment variables"""
+
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "demo_key")
+    BASE_MODEL = os.getenv("BASE_MODEL", "gpt-3.5-turbo")
+    # OpenAI-compatible endpoint; empty uses api.openai.com (set it to benchmark against a fake server)
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "") or None
+
+    # Gap analysis runs on FAST_MODEL; proposals and tests stay on BASE_MODEL.
+    # Each *_BASE_URL defaults to OPENAI_BASE_URL
+    FAST_MODEL = os.getenv("FAST_MODEL", "") or BASE_MODEL
+    FAST_BASE_URL = os.getenv("FAST_BASE_URL", "") or OPENAI_BASE_URL
+
+    # Hedging: a call still running past its route's HEDGE_QUANTILE latency gets a duplicate
+    # on HEDGE_MODEL/HEDGE_BASE_URL, and the first answer wins. At most HEDGE_MAX_RATE of
+    # calls are hedged (0 disables); routes need HEDGE_MIN_SAMPLES latencies first
+    HEDGE_MODEL = os.getenv("HEDGE_MODEL", "") or BASE_MODEL
+    HEDGE_BASE_URL = os.getenv("HEDGE_BASE_URL", "") or OPENAI_BASE_URL
+    HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+    HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+    # LLM client timeout and retries per call
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+    # Circuit breaker per LLM route: opens when CIRCUIT_FAILURE_RATE of the last CIRCUIT_WINDOW
+    # calls failed, or CIRCUIT_SLOW_RATE took CIRCUIT_SLOW_SECONDS or more (after CIRCUIT_MIN_CALLS).
+    # While open, analyses use rule-based and last-known-good fallbacks; after CIRCUIT_OPEN_SECONDS,
+    # CIRCUIT_PROBES trial calls decide whether it closes
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_SLOW_RATE = float(os.getenv("CIRCUIT_SLOW_RATE", "0.8"))
+    CIRCUIT_SLOW_SECONDS = float(os.getenv("CIRCUIT_SLOW_SECONDS", "10"))
+    CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "50"))
+    CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    CIRCUIT_PROBES = int(os.getenv("CIRCUIT_PROBES", "1"))
+
+    # Max number of test_intervention calls in flight per analysis
+    MAX_CONCURRENT_TESTS = int(os.getenv("MAX_CONCURRENT_TESTS", "4"))
+
+    # Input tokens per LLM call (estimated); sample conversations are cut to
+    # PROMPT_SAMPLE_TOKENS each, then sampled, to stay within it
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "600"))
+    PROMPT_SAMPLE_TOKENS = int(os.getenv("PROMPT_SAMPLE_TOKENS", "60"))
+
+    # AIService result cache; set LLM_CACHE_DB to a file path to persist across restarts
+    LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "5000"))
+    LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+    LLM_CACHE_DIGITS = int(os.getenv("LLM_CACHE_DIGITS", "2"))
+    LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+
+    # /client-metrics/batch: snapshots per request, metric sets per LLM call, batch calls in flight
+    MAX_BATCH_SNAPSHOTS = int(os.getenv("MAX_BATCH_SNAPSHOTS", "1000"))
+    ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "20"))
+    MAX_CONCURRENT_BATCHES = int(os.getenv("MAX_CONCURRENT_BATCHES", "4"))
+
+    # SQLite connection pool and pragmas
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./aicsa.db")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+    # Write-behind buffer for Experiment rows: flush every N rows or M milliseconds
+    EXPERIMENT_FLUSH_ROWS = int(os.getenv("EXPERIMENT_FLUSH_ROWS", "100"))
+    EXPERIMENT_FLUSH_MS = int(os.getenv("EXPERIMENT_FLUSH_MS", "200"))
+
+    # Time-series store for ingested metrics; empty METRICS_DATA_DIR keeps it in memory only
+    METRICS_DATA_DIR = os.getenv("METRICS_DATA_DIR", "metrics_data")
+    METRICS_COMPACT_INTERVAL = float(os.getenv("METRICS_COMPACT_INTERVAL", "60"))
+
+    # Rule-based fast path: JSON file overriding rule_engine.DEFAULT_RULES, and the
+    # relative distance from a threshold below which a value is escalated to the LLM
+    RULES_PATH = os.getenv("RULES_PATH", "")
+    RULES_AMBIGUITY_MARGIN = float(os.getenv("RULES_AMBIGUITY_MARGIN", "0.05"))
+
+    # Streaming anomaly detection on ingested metrics (EWMA z-scores)
+    ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.1"))
+    ANOMALY_ENTER_SCORE = float(os.getenv("ANOMALY_ENTER_SCORE", "3.0"))
+    ANOMALY_EXIT_SCORE = float(os.getenv("ANOMALY_EXIT_SCORE", "1.0"))
+    ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "5"))
+    ANOMALY_COOLDOWN = float(os.getenv("ANOMALY_COOLDOWN", "900"))
+    # Floors on the standard deviation (relative to the mean, and absolute) so flat series can alert
+    ANOMALY_REL_FLOOR = float(os.getenv("ANOMALY_REL_FLOOR", "0.02"))
+    ANOMALY_ABS_FLOOR = float(os.getenv("ANOMALY_ABS_FLOOR", "0.01"))
+
+    # Plan quotas: limits for clients without an active subscription, and how often
+    # plans are re-read and metered usage is flushed to the client_usage table
+    QUOTA_FREE_MONTHLY = int(os.getenv("QUOTA_FREE_MONTHLY", "100"))
+    QUOTA_FREE_RPM = float(os.getenv("QUOTA_FREE_RPM", "20"))
+    QUOTA_BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", "10"))
+    QUOTA_PLAN_TTL = float(os.getenv("QUOTA_PLAN_TTL", "300"))
+    QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "5"))
+
+    # Identical concurrent /analyze-performance cycles share one run; the result is
+    # reused for this many seconds after it completes (0 disables reuse)
+    SINGLE_FLIGHT_GRACE = float(os.getenv("SINGLE_FLIGHT_GRACE", "1.0"))
+
+    # Queued analyses (POST /analyze-performance?async=true): concurrent jobs
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+    # Jobs and webhook deliveries are leased to the worker process running them; a
+    # process that stops renewing (it died) has its work taken over after this long
+    WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "30"))
+
+    # Add a Server-Timing header with per-stage durations to every response; when
+    # off, only requests sending "X-Debug-Timing: 1" get it
+    TIMING_HEADER = os.getenv("TIMING_HEADER", "") == "1"
+
+    # Threads for blocking work (SQLite, file I/O); async endpoints never block the event loop
+    THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+    # State shared by all workers on this host (quota counters, cache invalidation): a
+    # SQLite file, or "memory" for a single worker. Empty puts it next to a SQLite database
+    SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "")
+    # How often a worker checks for webhook and API key changes made by other workers
+    SHARED_STATE_POLL = float(os.getenv("SHARED_STATE_POLL", "0.5"))
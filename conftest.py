@@ -0,0 +1,14 @@
+"""pytest setup: point the app at throwaway storage before any test module imports it.
+
+Config reads the environment once, when config is first imported, so this has
+to run ahead of test collection rather than in the individual test modules.
+"""
+import os
+import tempfile
+
+_data = tempfile.mkdtemp(prefix="aicsa_test_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_data}/test.db")
+os.environ.setdefault("SHARED_STATE_DB", "memory")
+os.environ.setdefault("METRICS_DATA_DIR", "")
+os.environ.setdefault("LLM_CACHE_DB", "")
+os.environ.setdefault("QUOTA_FREE_RPM", "100000")
@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+from config import Config
+import instrumentation
+import threading
+import time
 
 Base = declarative_base()
 
@@ -16,6 +21,11 @@ class Client(Base):
 
 class Experiment(Base):
     __tablename__ = "experiments"
+    __table_args__ = (
+        Index("ix_experiments_client_created", "client_id", "created_at", "id"),
+        Index("ix_experiments_client_type_created", "client_id", "intervention_type", "created_at", "id"),
+        Index("ix_experiments_client_status_created", "client_id", "status", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(Integer)
     hypothesis = Column(Text)
@@ -24,15 +34,243 @@ class Experiment(Base):
     results = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-engine = create_engine("sqlite:///./aicsa.db")
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (Index("ix_analysis_jobs_status_created", "status", "created_at"),)
+    
+    id = Column(String, primary_key=True)
+    client_id = Column(Integer, index=True)
+    domain = Column(String)
+    metrics = Column(Text)  # JSON
+    notify = Column(Boolean, default=False)  # Send an analysis_completed webhook when done
+    status = Column(String, default="queued")  # queued, running, completed, failed
+    result = Column(Text)  # JSON
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    claimed_by = Column(String)  # JobQueue.owner of the worker process holding the job
+    lease_expires_at = Column(DateTime)  # Recovered by another worker once this passes
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+    __table_args__ = (Index("ix_subscriptions_client_status", "client_id", "status"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer)
+    plan_type = Column(String)  # basic, advanced, enterprise
+    status = Column(String)  # active, canceled, expired
+    charge_id = Column(String)  # Yoco charge ID
+    amount_paid = Column(Float)
+    start_date = Column(DateTime, default=datetime.utcnow)
+    end_date = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Webhook(Base):
+    __tablename__ = "webhooks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer)
+    webhook_url = Column(String)  # Client's URL to receive notifications
+    event_types = Column(String)  # Types of events client wants to receive
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WebhookSubscription(Base):
+    __tablename__ = "webhook_subscriptions"
+    __table_args__ = (Index("ix_webhook_subscriptions_event_client", "event_type", "client_id"),)
+    
+    id = Column(Integer, primary_key=True)
+    webhook_id = Column(Integer, index=True)
+    client_id = Column(Integer)
+    event_type = Column(String)  # One of WebhookManager.webhook_types, or "all"
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_outbox"
+    __table_args__ = (Index("ix_webhook_outbox_status_due", "status", "next_attempt_at"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer)
+    webhook_url = Column(String)
+    event_type = Column(String)
+    payload = Column(Text)  # JSON body to POST
+    status = Column(String)  # pending, delivering, delivered, dead
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_status_code = Column(Integer)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime)
+    claimed_by = Column(String)  # WebhookDispatcher.owner of the worker process delivering it
+    lease_expires_at = Column(DateTime)  # Back to pending once this passes
+
+class WebhookAttempt(Base):
+    __tablename__ = "webhook_attempts"
+    __table_args__ = (Index("ix_webhook_attempts_client_created", "client_id", "created_at"),)
+    
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer)
+    delivery_id = Column(Integer)
+    attempt = Column(Integer)
+    status_code = Column(Integer)
+    latency_ms = Column(Float)
+    success = Column(Boolean)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WebhookStats(Base):
+    __tablename__ = "webhook_stats"
+    
+    client_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, default=0)
+    successes = Column(Integer, default=0)
+    last_sent_at = Column(DateTime)
+
+class ClientUsage(Base):
+    __tablename__ = "client_usage"
+    
+    client_id = Column(Integer, primary_key=True)
+    period = Column(String, primary_key=True)  # YYYY-MM
+    analyses = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class WebhookLatencyBucket(Base):
+    __tablename__ = "webhook_latency_buckets"
+    
+    client_id = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)  # Index into webhooks.LATENCY_BUCKETS_MS
+    count = Column(Integer, default=0)
+
+def create_db_engine(url: str = Config.DATABASE_URL):
+    """SQLite engine tuned for concurrent requests.
+
+    WAL lets readers proceed while a writer commits, busy_timeout makes writers
+    wait for the lock instead of failing with "database is locked", and a
+    QueuePool reuses connections across request threads.
+    """
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": Config.DB_BUSY_TIMEOUT_MS / 1000},
+        poolclass=QueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={Config.DB_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    # Every statement is a db_query stage in the latency histograms
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        instrumentation.observe("db_query", time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def count_query_error(context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            instrumentation.observe("db_query", time.perf_counter() - started.pop(), error=True)
+
+    return engine
+
+class LazyInitSession(Session):
+    """Creates the schema on first use, so importing the app never touches the database"""
+
+    def __init__(self, *args, **kwargs):
+        init_db()
+        super().__init__(*args, **kwargs)
+
+engine = create_db_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=LazyInitSession)
+
+# Session commits (including their flush) are the db_commit stage
+@event.listens_for(SessionLocal, "before_commit")
+def start_commit_timer(session):
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(SessionLocal, "after_commit")
+def stop_commit_timer(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        instrumentation.observe("db_commit", time.perf_counter() - started)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def count_commit_error(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        instrumentation.observe("db_commit", time.perf_counter() - started, error=True)
+
+# Schema changes for databases created before a model changed; create_all only
+# creates missing tables. Entry N upgrades PRAGMA user_version N-1 to N.
+MIGRATIONS = [
+    # 1: composite indexes for experiment history and subscription lookups
+    [
+        "CREATE INDEX IF NOT EXISTS ix_experiments_client_created ON experiments (client_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_experiments_client_type_created "
+        "ON experiments (client_id, intervention_type, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_experiments_client_status_created "
+        "ON experiments (client_id, status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_subscriptions_client_status ON subscriptions (client_id, status)",
+    ],
+    # 2: worker leases on claimed jobs and webhook deliveries
+    [
+        lambda conn: _add_column(conn, "analysis_jobs", "claimed_by", "VARCHAR"),
+        lambda conn: _add_column(conn, "analysis_jobs", "lease_expires_at", "DATETIME"),
+        lambda conn: _add_column(conn, "webhook_outbox", "claimed_by", "VARCHAR"),
+        lambda conn: _add_column(conn, "webhook_outbox", "lease_expires_at", "DATETIME"),
+    ],
+]
+
+def _add_column(conn, table: str, column: str, type_: str) -> None:
+    """ALTER TABLE ADD COLUMN, unless create_all already made the table with it"""
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {type_}")
+
+def migrate_db(conn):
+    """Apply pending MIGRATIONS (SQL strings or callables taking conn) in order, tracking progress in PRAGMA user_version"""
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    for target, statements in enumerate(MIGRATIONS, start=1):
+        if version >= target:
+            continue
+        for statement in statements:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.exec_driver_sql(statement)
+        conn.exec_driver_sql(f"PRAGMA user_version = {target}")
+
+_initialized = False
+_init_lock = threading.Lock()
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """Create missing tables and apply migrations, once per process"""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            with engine.begin() as conn:
+                # Worker processes starting together take turns; later ones find the schema in place
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                Base.metadata.create_all(bind=conn)
+                migrate_db(conn)
+            _initialized = True
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
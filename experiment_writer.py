@@ -0,0 +1,133 @@
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ExperimentWriter:
+    """Write-behind buffer for Experiment rows.
+
+    Rows from all in-flight requests are collected and bulk-inserted by a
+    background thread every max_rows rows or max_delay seconds, whichever comes
+    first. Callers that need the row on disk pass durable=True and wait on the
+    returned Future, which resolves once the batch holding it is committed.
+    """
+
+    def __init__(self, session_factory: Callable, model, max_rows: int = 100,
+                 max_delay: float = 0.2, max_retries: int = 3):
+        self.session_factory = session_factory
+        self.model = model
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self._buffer = []  # (row, future or None, last row of its add_many call)
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.rows_written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, row: Dict[str, Any], durable: bool = False) -> Optional[Future]:
+        """Buffer one row of Experiment column values"""
+        return self.add_many([row], durable)
+
+    def add_many(self, rows: List[Dict[str, Any]], durable: bool = False) -> Optional[Future]:
+        """Buffer several rows; with durable=True the Future resolves after they commit"""
+        future = Future() if durable else None
+        if not rows:
+            if future is not None:
+                future.set_result(0)
+            return future
+        now = datetime.utcnow()
+        with self._cond:
+            self._ensure_started()
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            for i, row in enumerate(rows):
+                row.setdefault("created_at", now)
+                last = i == len(rows) - 1
+                # Only the last row carries the future; a call is never split across flushes
+                self._buffer.append((row, future if last else None, last))
+            self._cond.notify()
+        return future
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush everything buffered and stop the background thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending": len(self._buffer),
+                "rows_written": self.rows_written,
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "dropped": self.dropped
+            }
+
+    def _ensure_started(self) -> None:
+        # Caller must hold the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="experiment-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._buffer and not self._stopping:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                while len(self._buffer) < self.max_rows and not self._stopping:
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # Cut after max_rows, extended to the end of the add_many call it falls in
+                end = min(self.max_rows, len(self._buffer))
+                while not self._buffer[end - 1][2]:
+                    end += 1
+                batch, self._buffer = self._buffer[:end], self._buffer[end:]
+                self._oldest = time.monotonic()
+            self._write(batch)
+
+    def _write(self, batch: List) -> None:
+        rows = [row for row, _, _ in batch]
+        futures = [future for _, future, _ in batch if future is not None]
+        for attempt in range(1, self.max_retries + 1):
+            db = self.session_factory()
+            try:
+                db.execute(self.model.__table__.insert(), rows)
+                db.commit()
+                with self._cond:
+                    self.rows_written += len(rows)
+                    self.flushes += 1
+                for future in futures:
+                    future.set_result(len(rows))
+                return
+            except Exception as e:
+                db.rollback()
+                with self._cond:
+                    self.failures += 1
+                logger.error(f"Experiment flush failed (attempt {attempt}): {e}")
+                error = e
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
+            finally:
+                db.close()
+        with self._cond:
+            self.dropped += len(rows)
+        for future in futures:
+            future.set_exception(error)
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import time
+
+# Seconds; covers a sub-millisecond cache hit up to a slow LLM completion
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request being handled, for the Server-Timing header
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+class Gauge:
+    """Last set value per label set"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket histogram per label set (Prometheus semantics)"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labels, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+REQUEST_SECONDS = Histogram("aicsa_http_request_duration_seconds", "HTTP request latency",
+                            ("method", "route", "status"))
+STAGE_SECONDS = Histogram("aicsa_stage_duration_seconds", "Time spent in one hot-path stage", ("stage",))
+STAGE_ERRORS = Counter("aicsa_stage_errors_total", "Hot-path stages that raised or failed", ("stage",))
+LLM_TOKENS = Counter("aicsa_llm_tokens_total", "LLM tokens used, by AIService method", ("method", "kind"))
+LLM_CALL_TOKENS = Histogram("aicsa_llm_call_tokens", "Tokens in one LLM call, by AIService method", ("method", "kind"),
+                            buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192))
+LLM_SECONDS_PER_TOKEN = Histogram("aicsa_llm_seconds_per_completion_token",
+                                  "LLM call latency divided by its completion tokens", ("method",),
+                                  buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+LLM_HEDGES = Counter("aicsa_llm_hedges_total", "Hedged LLM calls, by which request answered first", ("method", "winner"))
+CIRCUIT_STATE = Gauge("aicsa_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ("breaker",))
+CIRCUIT_TRANSITIONS = Counter("aicsa_circuit_transitions_total", "Circuit breaker state changes, by new state",
+                              ("breaker", "state"))
+CIRCUIT_REJECTED = Counter("aicsa_circuit_rejected_total", "Calls failed fast by an open circuit breaker", ("breaker",))
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, STAGE_ERRORS, LLM_TOKENS, LLM_CALL_TOKENS, LLM_SECONDS_PER_TOKEN, LLM_HEDGES,
+           CIRCUIT_STATE, CIRCUIT_TRANSITIONS, CIRCUIT_REJECTED]
+
+def observe(stage: str, seconds: float, error: bool = False) -> None:
+    """Record one stage duration, and add it to the current request's timing breakdown"""
+    STAGE_SECONDS.observe(seconds, stage)
+    if error:
+        STAGE_ERRORS.inc(stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block as a stage; an exception counts as an error and propagates"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe(stage, time.perf_counter() - start, error=True)
+        raise
+    observe(stage, time.perf_counter() - start)
+
+def record_tokens(method: str, usage, seconds: Optional[float] = None) -> None:
+    """Add an OpenAI response's usage block to the token metrics; seconds is the call's latency"""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    LLM_TOKENS.inc(method, "prompt", amount=prompt)
+    LLM_TOKENS.inc(method, "completion", amount=completion)
+    LLM_CALL_TOKENS.observe(prompt, method, "prompt")
+    LLM_CALL_TOKENS.observe(completion, method, "completion")
+    if seconds is not None and completion:
+        LLM_SECONDS_PER_TOKEN.observe(seconds / completion, method)
+
+def start_request() -> Dict[str, float]:
+    """Begin collecting stage timings for the current request context"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value (milliseconds) for a request's stages"""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,229 @@
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import or_
+import asyncio
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Persistent queue of analyses run by a bounded pool of async workers.
+
+    Jobs are rows of job_model, so queued and interrupted jobs are picked up
+    again after a restart. At most `workers` jobs run at once, independent of
+    how many HTTP requests are open. on_finish(job) is called with the final
+    row values of every job, e.g. to send a completion webhook.
+
+    Several worker processes can share the table: each job is leased to the
+    process that queued or recovered it, which renews the lease every
+    lease_seconds / 3. Only jobs whose lease has expired (their process died)
+    are taken over by another process, at start and then periodically.
+    """
+
+    def __init__(self, session_factory: Callable, job_model,
+                 runner: Callable[[int, str, Dict[str, float]], Awaitable[Dict[str, Any]]],
+                 workers: int = 4, on_finish: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 lease_seconds: float = 30.0):
+        self.session_factory = session_factory
+        self.job_model = job_model
+        self.runner = runner
+        self.workers = workers
+        self.on_finish = on_finish
+        self.lease_seconds = lease_seconds
+        self.owner = None
+        self._queue = None
+        self._tasks = []
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        """Take over unfinished jobs whose lease expired and start the workers"""
+        if self._tasks:
+            return
+        self.owner = uuid.uuid4().hex
+        self._queue = asyncio.Queue()
+        for job_id in await asyncio.to_thread(self._recover):
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self) -> None:
+        """Stop the workers and release this process's jobs, so any worker resumes them"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.to_thread(self._release)
+
+    async def submit(self, client_id: int, domain: str, metrics: Dict[str, float], notify: bool = False) -> str:
+        """Persist a job and queue it; returns the job id"""
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, client_id, domain, metrics, notify)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str, client_id: int) -> Optional[Dict[str, Any]]:
+        """One of the client's jobs, or None"""
+        db = self.session_factory()
+        try:
+            job = db.query(self.job_model).filter(
+                self.job_model.id == job_id,
+                self.job_model.client_id == client_id
+            ).first()
+            return self._as_dict(job) if job else None
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} bookkeeping failed: {e}")
+
+    async def _maintain(self) -> None:
+        """Renew this process's leases and take over jobs of processes that died"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self._renew)
+                for job_id in await asyncio.to_thread(self._recover):
+                    self._queue.put_nowait(job_id)
+            except Exception as e:
+                logger.error(f"Job lease maintenance failed: {e}")
+
+    async def _run(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self._claim, job_id)
+        if job is None:
+            return
+        try:
+            result = await self.runner(job["client_id"], job["domain"], job["metrics"])
+            job = await asyncio.to_thread(
+                self._update, job_id, status="completed", result=json.dumps(result), finished_at=datetime.utcnow()
+            )
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            job = await asyncio.to_thread(
+                self._update, job_id, status="failed", error=str(e), finished_at=datetime.utcnow()
+            )
+            self.failed += 1
+        if self.on_finish is not None:
+            await asyncio.to_thread(self.on_finish, job)
+
+    def _insert(self, job_id: str, client_id: int, domain: str, metrics: Dict[str, float], notify: bool) -> None:
+        db = self.session_factory()
+        try:
+            db.add(self.job_model(
+                id=job_id, client_id=client_id, domain=domain,
+                metrics=json.dumps(metrics), notify=notify, status="queued",
+                claimed_by=self.owner, lease_expires_at=self._lease_end()
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Mark a queued job running; None if it is gone or was already claimed"""
+        db = self.session_factory()
+        try:
+            model = self.job_model
+            claimed = db.query(model).filter(model.id == job_id, model.status == "queued").update({
+                "status": "running", "started_at": datetime.utcnow(),
+                "claimed_by": self.owner, "lease_expires_at": self._lease_end()
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+            return self._as_dict(db.query(model).filter(model.id == job_id).first())
+        finally:
+            db.close()
+
+    def _update(self, job_id: str, **values) -> Optional[Dict[str, Any]]:
+        db = self.session_factory()
+        try:
+            job = db.query(self.job_model).filter(self.job_model.id == job_id).first()
+            if job is None:
+                return None
+            for name, value in values.items():
+                setattr(job, name, value)
+            db.commit()
+            return self._as_dict(job)
+        finally:
+            db.close()
+
+    def _recover(self) -> List[str]:
+        """Re-queue, leased to this process, unfinished jobs whose lease expired; returns their ids"""
+        db = self.session_factory()
+        try:
+            model = self.job_model
+            orphaned = (
+                model.status.in_(["queued", "running"]),
+                or_(model.lease_expires_at.is_(None), model.lease_expires_at < datetime.utcnow())
+            )
+            recovered = []
+            for row in db.query(model.id).filter(*orphaned).order_by(model.created_at).all():
+                # Conditional, so two processes recovering at once take each job only once
+                if db.query(model).filter(model.id == row.id, *orphaned).update({
+                    "status": "queued", "claimed_by": self.owner, "lease_expires_at": self._lease_end()
+                }, synchronize_session=False):
+                    recovered.append(row.id)
+            db.commit()
+            return recovered
+        finally:
+            db.close()
+
+    def _renew(self) -> None:
+        db = self.session_factory()
+        try:
+            model = self.job_model
+            db.query(model).filter(model.claimed_by == self.owner, model.status.in_(["queued", "running"])).update(
+                {"lease_expires_at": self._lease_end()}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _release(self) -> None:
+        db = self.session_factory()
+        try:
+            model = self.job_model
+            db.query(model).filter(model.claimed_by == self.owner, model.status.in_(["queued", "running"])).update(
+                {"status": "queued", "claimed_by": None, "lease_expires_at": None}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _lease_end(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def _as_dict(self, job) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "client_id": job.client_id,
+            "domain": job.domain,
+            "metrics": json.loads(job.metrics),
+            "notify": job.notify,
+            "status": job.status,
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() + "Z",
+            "started_at": job.started_at.isoformat() + "Z" if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() + "Z" if job.finished_at else None
+        }
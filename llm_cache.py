@@ -0,0 +1,229 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def quantize(value: float, digits: int) -> float:
+    """Round to a number of significant digits so near-identical metrics share a key"""
+    if not value or not math.isfinite(value):
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+def normalize(payload: Any, digits: int) -> Any:
+    """Canonical, order-independent form of a prompt input"""
+    if isinstance(payload, dict):
+        return {str(k).strip().lower(): normalize(v, digits) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return sorted((normalize(v, digits) for v in payload), key=json.dumps)
+    if isinstance(payload, bool):
+        return payload
+    if isinstance(payload, (int, float)):
+        return quantize(float(payload), digits)
+    if isinstance(payload, str):
+        return " ".join(payload.lower().split())
+    return payload
+
+class LLMResultCache:
+    """Memoizes AIService results: in-memory LRU with TTL, plus an optional SQLite tier.
+
+    Only successful LLM results should be stored; fallbacks are never cached.
+    The SQLite tier stays off the event loop: aget()/aget_many() read it in a
+    worker thread, and put() leaves rows to a background writer that commits
+    them in batches every flush_delay seconds.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: float = 3600.0,
+                 digits: int = 2, db_path: Optional[str] = None, flush_delay: float = 0.2):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.digits = digits
+        self.flush_delay = flush_delay
+        self._entries = OrderedDict()  # key -> (expires_at, value_json, latency)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = {}  # key -> (value_json, latency, expires_at epoch) not yet committed
+        self._write_cond = threading.Condition()
+        self._writer = None
+        self._stopping = False
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT, latency REAL, expires_at REAL)"
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def make_key(self, model: str, method: str, domain: str, payload: Any) -> str:
+        canonical = json.dumps(
+            [model, method, (domain or "").lower(), normalize(payload, self.digits)],
+            sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a fresh copy of the cached result, or None on a miss (may read SQLite in this thread)"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Cached results of the keys that hit; the SQLite tier is read in this thread"""
+        found, missing = self._get_memory(keys)
+        if missing:
+            found.update(self._get_disk(missing))
+        return found
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() for event loop callers"""
+        return (await self.aget_many([key])).get(key)
+
+    async def aget_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """get_many() for event loop callers: memory hits inline, SQLite in a worker thread"""
+        found, missing = self._get_memory(keys)
+        if missing:
+            found.update(await asyncio.to_thread(self._get_disk, missing))
+        return found
+
+    def put(self, key: str, value: Any, latency: float) -> None:
+        """Cache a successful result along with the LLM latency it cost"""
+        value_json = json.dumps(value)
+        with self._lock:
+            self._store(key, value_json, latency, time.monotonic() + self.ttl)
+        if self._db is not None:
+            with self._write_cond:
+                self._writes[key] = (value_json, latency, time.time() + self.ttl)
+                if self._writer is None or not self._writer.is_alive():
+                    self._stopping = False
+                    self._writer = threading.Thread(target=self._write_loop, name="llm-cache-writer", daemon=True)
+                    self._writer.start()
+                self._write_cond.notify()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Commit pending writes and stop the writer thread"""
+        with self._write_cond:
+            self._stopping = True
+            self._write_cond.notify()
+            writer = self._writer
+        if writer is not None:
+            writer.join(timeout)
+        self._writer = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._write_cond:
+                self._writes.clear()
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "persistent": self._db is not None,
+                "pending_writes": len(self._writes),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "saved_latency_seconds": round(self.saved_latency, 3)
+            }
+
+    def _get_memory(self, keys: Iterable[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """Memory hits, and the keys left for the SQLite tier (none without one)"""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_latency += entry[2]
+                    found[key] = json.loads(entry[1])
+                    continue
+                if entry is not None:
+                    del self._entries[key]
+                if self._db is None:
+                    self.misses += 1
+                else:
+                    missing.append(key)
+        return found, missing
+
+    def _get_disk(self, keys: List[str]) -> Dict[str, Any]:
+        """Look keys up in uncommitted writes, then SQLite, promoting hits to memory"""
+        with self._write_cond:
+            rows = {key: self._writes[key] for key in keys if key in self._writes}
+        rest = [key for key in keys if key not in rows]
+        with self._db_lock:
+            for i in range(0, len(rest), 500):  # Below SQLite's bound-parameter limit
+                chunk = rest[i:i + 500]
+                for key, value_json, latency, expires_at in self._db.execute(
+                    f"SELECT key, value, latency, expires_at FROM llm_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ):
+                    rows[key] = (value_json, latency, expires_at)
+        now, epoch = time.monotonic(), time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = rows.get(key)
+                # Expired rows are left to be replaced by the next put() or purged at startup
+                if row is None or row[2] <= epoch:
+                    self.misses += 1
+                    continue
+                value_json, latency, expires_at = row
+                self._store(key, value_json, latency, now + expires_at - epoch)
+                self.disk_hits += 1
+                self.saved_latency += latency
+                found[key] = json.loads(value_json)
+        return found
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._write_cond:
+                while not self._writes and not self._stopping:
+                    self._write_cond.wait()
+                if not self._writes:
+                    return
+                if not self._stopping:
+                    # Let puts arriving meanwhile share the commit
+                    self._write_cond.wait(self.flush_delay)
+                batch = dict(self._writes)
+            try:
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO llm_cache (key, value, latency, expires_at) VALUES (?, ?, ?, ?)",
+                        [(key, *row) for key, row in batch.items()]
+                    )
+                    self._db.commit()
+            except Exception as e:
+                logger.error(f"LLM cache write of {len(batch)} rows failed: {e}")
+            with self._write_cond:
+                # Rows put again meanwhile stay for the next batch
+                for key, row in batch.items():
+                    if self._writes.get(key) is row:
+                        del self._writes[key]
+
+    def _store(self, key: str, value_json: str, latency: float, expires_at: float) -> None:
+        # Caller must hold the lock
+        self._entries[key] = (expires_at, value_json, latency)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,241 @@
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+from circuit_breaker import CircuitBreaker
+import asyncio
+import threading
+import time
+import instrumentation
+
+class LatencyTracker:
+    """Latency percentiles of one route over its most recent calls.
+
+    Every call counts, including failures and cancelled hedge losers (at the
+    time they were given up on), so a slowing route can't hide its tail by
+    losing every race.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._sorted = None  # Cached sorted copy, dropped on every new sample
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-quantile (0..1) of recent latencies, or None until min_samples are in"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+class Route:
+    """One model on one OpenAI-compatible endpoint, with its own latency tracker and circuit breaker"""
+
+    def __init__(self, model: str, base_url: Optional[str], api_key: str, tracker: LatencyTracker,
+                 breaker: Callable[[str], CircuitBreaker], timeout: float, max_retries: int):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.tracker = tracker
+        self.name = f"{model}@{base_url or 'openai'}"
+        self.breaker = breaker(self.name)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai
+            self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                         timeout=self.timeout, max_retries=self.max_retries)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import openai
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                    timeout=self.timeout, max_retries=self.max_retries)
+        return self._async_client
+
+class LLMRouter:
+    """Picks the model/endpoint for each AIService method and hedges slow async calls.
+
+    stages maps a method to its (model, base_url); others use default. Once a
+    route has min_samples latencies, an async call still running past that
+    route's hedge_quantile latency gets a duplicate sent to hedge, and the
+    first non-empty answer wins. At most max_hedge_rate of recent calls are
+    hedged, so a slow primary can't double the load. Sync calls are routed
+    and tracked but never hedged.
+
+    Every route has a circuit breaker (made by breaker(route_name)). While a
+    route's breaker is open, calls go to the hedge route if that one is
+    healthy, and otherwise fail at once with CircuitOpen.
+    """
+
+    def __init__(self, default: Tuple[str, Optional[str]], api_key: str,
+                 stages: Optional[Dict[str, Tuple[str, Optional[str]]]] = None,
+                 hedge: Optional[Tuple[str, Optional[str]]] = None, hedge_quantile: float = 0.95,
+                 max_hedge_rate: float = 0.05, min_samples: int = 20, window: int = 200,
+                 breaker: Callable[[str], CircuitBreaker] = CircuitBreaker,
+                 timeout: float = 30.0, max_retries: int = 2):
+        self.api_key = api_key
+        self.min_samples = min_samples
+        self.window = window
+        self.breaker = breaker
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.routes = {}  # (model, base_url) -> Route
+        self.default = self._route(default)
+        self.stages = {method: self._route(target) for method, target in (stages or {}).items()}
+        self.hedge = self._route(hedge) if hedge and max_hedge_rate > 0 else None
+        self.hedge_quantile = hedge_quantile
+        self.max_hedge_rate = max_hedge_rate
+        # Exponentially decayed call and hedge counts (~1000-call memory) for the hedge cap
+        self._recent_calls = 0.0
+        self._recent_hedges = 0.0
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def route(self, method: str) -> Route:
+        return self.stages.get(method, self.default)
+
+    def warm_up(self, use_async: bool) -> None:
+        """Build every route's client ahead of the first call"""
+        for route in self.routes.values():
+            route.async_client if use_async else route.client
+
+    def complete(self, prompt: str, max_tokens: int, method: str) -> str:
+        route = self._available(self.route(method))
+        self._count_call()
+        ticket = route.breaker.acquire()
+        start = time.perf_counter()
+        try:
+            response = route.client.chat.completions.create(
+                model=route.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens
+            )
+        except Exception:
+            seconds = time.perf_counter() - start
+            route.breaker.record(ticket, False, seconds)
+            route.tracker.record(seconds)
+            raise
+        return self._accept(route, ticket, response, method, time.perf_counter() - start)
+
+    async def acomplete(self, prompt: str, max_tokens: int, method: str) -> str:
+        route = self._available(self.route(method))
+        self._count_call()
+        tasks = [asyncio.ensure_future(self._acall(route, prompt, max_tokens, method))]
+        try:
+            delay = route.tracker.percentile(self.hedge_quantile) if self.hedge is not None else None
+            if delay is None:
+                return await tasks[0]
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._take_hedge():
+                return await tasks[0]
+
+            tasks.append(asyncio.ensure_future(self._acall(self.hedge, prompt, max_tokens, method)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        winner = "hedge" if task is tasks[1] else "primary"
+                        instrumentation.LLM_HEDGES.inc(method, winner)
+                        if winner == "hedge":
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+            # Both failed or came back empty: the primary's outcome is the answer
+            return tasks[0].result()
+        finally:
+            # Cancel the loser (or everything, if our caller was cancelled)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # Mark a losing failure as retrieved
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {"hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                     "recent_hedge_rate": round(self._recent_hedges / self._recent_calls, 4) if self._recent_calls else 0.0}
+        stats["stages"] = {method: route.name for method, route in self.stages.items()}
+        stats["default"] = self.default.name
+        stats["hedge"] = self.hedge.name if self.hedge is not None else None
+        stats["routes"] = {
+            route.name: {
+                "p50": route.tracker.percentile(0.5),
+                "p95": route.tracker.percentile(0.95),
+                "p99": route.tracker.percentile(0.99),
+                "breaker": route.breaker.stats()
+            }
+            for route in self.routes.values()
+        }
+        return stats
+
+    async def _acall(self, route: Route, prompt: str, max_tokens: int, method: str) -> str:
+        ticket = route.breaker.acquire()
+        start = time.perf_counter()
+        try:
+            response = await route.async_client.chat.completions.create(
+                model=route.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens
+            )
+        except asyncio.CancelledError:
+            # A hedge race loser (or an abandoned request) says nothing about the route's health,
+            # but it took at least this long
+            route.breaker.release(ticket)
+            route.tracker.record(time.perf_counter() - start)
+            raise
+        except Exception:
+            seconds = time.perf_counter() - start
+            route.breaker.record(ticket, False, seconds)
+            route.tracker.record(seconds)
+            raise
+        return self._accept(route, ticket, response, method, time.perf_counter() - start)
+
+    def _accept(self, route: Route, ticket: str, response, method: str, seconds: float) -> str:
+        route.breaker.record(ticket, True, seconds)
+        route.tracker.record(seconds)
+        instrumentation.record_tokens(method, response.usage, seconds)
+        return response.choices[0].message.content
+
+    def _available(self, route: Route) -> Route:
+        """route, or the hedge route while route's breaker is open and the hedge's isn't"""
+        if self.hedge is None or self.hedge is route or not route.breaker.is_open():
+            return route
+        return route if self.hedge.breaker.is_open() else self.hedge
+
+    def _route(self, target: Tuple[str, Optional[str]]) -> Route:
+        model, base_url = target
+        key = (model, base_url or None)
+        if key not in self.routes:
+            self.routes[key] = Route(model, base_url or None, self.api_key,
+                                     LatencyTracker(self.window, self.min_samples),
+                                     self.breaker, self.timeout, self.max_retries)
+        return self.routes[key]
+
+    def _count_call(self) -> None:
+        with self._lock:
+            self._recent_calls = self._recent_calls * 0.999 + 1
+            self._recent_hedges *= 0.999
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self._recent_hedges + 1 > self.max_hedge_rate * self._recent_calls:
+                return False
+            self._recent_hedges += 1
+            self.hedged += 1
+            return True
@@ -0,0 +1,499 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions in seconds and how long each is kept in memory
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+RETENTION = {"1m": 2 * 86400, "1h": 90 * 86400, "1d": None}
+
+_RAW_RECORD = struct.Struct("<dd")  # timestamp, value
+_ROLLUP_RECORD = struct.Struct("<ddddd")  # bucket start, count, sum, min, max
+
+class _Rollup:
+    """Fixed-interval buckets held as parallel arrays (count, sum, min, max)"""
+
+    __slots__ = ("interval", "starts", "counts", "sums", "mins", "maxs")
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.starts = array("d")
+        self.counts = array("d")
+        self.sums = array("d")
+        self.mins = array("d")
+        self.maxs = array("d")
+
+    def add(self, ts: float, value: float) -> None:
+        start = ts - ts % self.interval
+        if self.starts and self.starts[-1] == start:
+            i = len(self.starts) - 1
+        elif not self.starts or start > self.starts[-1]:
+            self._insert(len(self.starts), start)
+            i = len(self.starts) - 1
+        else:
+            # Late point: find or create its bucket
+            i = bisect_left(self.starts, start)
+            if i == len(self.starts) or self.starts[i] != start:
+                self._insert(i, start)
+        self.counts[i] += 1
+        self.sums[i] += value
+        self.mins[i] = min(self.mins[i], value)
+        self.maxs[i] = max(self.maxs[i], value)
+
+    def prune(self, cutoff: float) -> bool:
+        """Drop buckets older than cutoff; True if any were dropped"""
+        i = bisect_left(self.starts, cutoff)
+        if i:
+            for column in (self.starts, self.counts, self.sums, self.mins, self.maxs):
+                del column[:i]
+        return i > 0
+
+    def records(self) -> bytes:
+        return b"".join(_ROLLUP_RECORD.pack(*row) for row in zip(
+            self.starts, self.counts, self.sums, self.mins, self.maxs
+        ))
+
+    def range(self, start: float, end: float) -> Tuple[int, int]:
+        lo = bisect_left(self.starts, start - start % self.interval) if start > float("-inf") else 0
+        return lo, bisect_left(self.starts, end)
+
+    def _insert(self, i: int, start: float) -> None:
+        self.starts.insert(i, start)
+        self.counts.insert(i, 0.0)
+        self.sums.insert(i, 0.0)
+        self.mins.insert(i, float("inf"))
+        self.maxs.insert(i, float("-inf"))
+
+class _Series:
+    """One (client, metric) series: uncompacted raw points plus rollups"""
+
+    __slots__ = ("ts", "values", "flushing_ts", "flushing_values", "rollups", "disk_tail", "disk_records", "dirty")
+
+    def __init__(self):
+        self.ts = array("d")
+        self.values = array("d")
+        # Points being written to disk by compact(), still served from memory until they are
+        self.flushing_ts = array("d")
+        self.flushing_values = array("d")
+        self.rollups = {name: _Rollup(interval) for name, interval in RESOLUTIONS.items()}
+        self.disk_tail = float("-inf")  # Newest timestamp compacted (or being compacted) to disk
+        self.disk_records = 0  # Complete records in the raw file
+        self.dirty = False  # Changed since the last compaction
+
+def _numeric(metrics: Dict[str, float]) -> List[Tuple[str, float]]:
+    """The metrics whose values convert to finite floats"""
+    numeric = []
+    for metric, value in metrics.items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            numeric.append((metric, value))
+    return numeric
+
+class MetricsStore:
+    """Columnar in-memory store for ingested client metrics.
+
+    Each (client, metric) series keeps its recent raw points in array('d')
+    columns, so they cost 16 bytes per point and can be wrapped by NumPy without
+    copying. It also keeps 1m/1h/1d rollups that are updated on every append.
+    compact() appends raw points to per-series binary files and persists the
+    rollups of changed series, so memory stays bounded and history survives
+    restarts. It writes outside the store lock, so appends never wait on disk.
+
+    Worker processes sharing data_dir each write their own files: a process
+    takes the first free data_dir/.writer-N.lock and suffixes its files with
+    @N (writer 0 keeps the plain names). Queries merge every writer's files
+    with this process's in-memory points and buckets.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, compact_interval: float = 60.0):
+        self.data_dir = data_dir
+        self.compact_interval = compact_interval
+        self._series = {}  # (client_id, metric) -> _Series
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._writer = None  # (writer number, its open lock file, pid)
+        self._writer_lock = threading.Lock()
+        self.points = 0
+
+    def append(self, client_id: int, metrics: Dict[str, float], ts: Optional[float] = None) -> None:
+        """Record one snapshot; every numeric metric becomes a point in its own series"""
+        self.append_many([(client_id, metrics)], ts)
+
+    def append_many(self, snapshots: List[Tuple[int, Dict[str, float]]], ts: Optional[float] = None) -> None:
+        """Record (client_id, metrics) snapshots taken at ts; values that aren't finite numbers are skipped.
+
+        A series seen for the first time is loaded from disk, so call this off the event loop.
+        """
+        ts = time.time() if ts is None else ts
+        points = [(client_id, metric, value) for client_id, metrics in snapshots
+                  for metric, value in _numeric(metrics)]
+        with self._lock:
+            for client_id, metric, value in points:
+                series = self._get_series(client_id, metric)
+                if ts < series.disk_tail:
+                    logger.warning(f"Point for {client_id}/{metric} predates compacted history; kept in rollups only")
+                elif not series.ts or ts >= series.ts[-1]:
+                    series.ts.append(ts)
+                    series.values.append(value)
+                else:
+                    i = bisect_right(series.ts, ts)
+                    series.ts.insert(i, ts)
+                    series.values.insert(i, value)
+                for rollup in series.rollups.values():
+                    rollup.add(ts, value)
+                series.dirty = True
+                self.points += 1
+
+    def metrics(self, client_id: int) -> List[str]:
+        """Names of the series recorded for a client"""
+        names = set()
+        if self.data_dir:
+            client_dir = os.path.join(self.data_dir, str(client_id))
+            if os.path.isdir(client_dir):
+                names.update(unquote(name[:-4].split("@")[0]) for name in os.listdir(client_dir)
+                             if name.endswith(".raw"))
+        with self._lock:
+            names.update(metric for cid, metric in self._series if cid == client_id)
+        return sorted(names)
+
+    def query(self, client_id: int, metric: str, start: Optional[float] = None,
+              end: Optional[float] = None, resolution: str = "raw") -> Dict[str, array]:
+        """Points in [start, end): raw (ts, value) or rollup (ts, count, sum, min, max, mean)"""
+        if resolution != "raw" and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        others = self._other_writers(client_id, metric, resolution)
+        with self._lock:
+            series = self._find_series(client_id, metric)
+            if series is None:
+                columns = ("ts", "value") if resolution == "raw" else ("ts", "count", "sum", "min", "max", "mean")
+                return {name: array("d") for name in columns}
+            if resolution == "raw":
+                records = series.disk_records
+                hot = []
+                for hot_ts, hot_values in ((series.flushing_ts, series.flushing_values), (series.ts, series.values)):
+                    lo, hi = bisect_left(hot_ts, start), bisect_left(hot_ts, end)
+                    hot.append((hot_ts[lo:hi], hot_values[lo:hi]))
+            else:
+                rollup = series.rollups[resolution]
+                lo, hi = rollup.range(start, end)
+                columns = [column[lo:hi] for column in (rollup.starts, rollup.counts, rollup.sums, rollup.mins, rollup.maxs)]
+
+        # Files are read without holding the lock
+        if resolution != "raw":
+            if others:
+                columns = _merge_rollups(columns, others, resolution, start, end)
+            starts, counts, sums, mins, maxs = columns
+            return {
+                "ts": starts,
+                "count": counts,
+                "sum": sums,
+                "min": mins,
+                "max": maxs,
+                "mean": array("d", (s / c for s, c in zip(sums, counts)))
+            }
+        ts, values = self._read_disk(self._path(client_id, metric, "raw"), start, end, records) \
+            if self.data_dir else (array("d"), array("d"))
+        for hot_ts, hot_values in hot:
+            ts.extend(hot_ts)
+            values.extend(hot_values)
+        if others:
+            for path in others:
+                other_ts, other_values = self._read_disk(path, start, end)
+                ts.extend(other_ts)
+                values.extend(other_values)
+            points = sorted(zip(ts, values))
+            ts, values = array("d", (t for t, _ in points)), array("d", (v for _, v in points))
+        return {"ts": ts, "value": values}
+
+    def aggregate(self, client_id: int, metric: str, start: Optional[float] = None,
+                  end: Optional[float] = None, resolution: str = "1m") -> Dict[str, Optional[float]]:
+        """count/mean/min/max over the rollup buckets that start in [start, end)"""
+        buckets = self.query(client_id, metric, start, end, resolution)
+        count = sum(buckets["count"])
+        if not count:
+            return {"count": 0, "mean": None, "min": None, "max": None}
+        return {
+            "count": int(count),
+            "mean": sum(buckets["sum"]) / count,
+            "min": min(buckets["min"]),
+            "max": max(buckets["max"])
+        }
+
+    def compact(self) -> None:
+        """Move raw points to disk, persist changed rollups and drop expired rollup buckets"""
+        now = time.time()
+        with self._compact_lock:
+            # Under the store lock only hand the hot points over and copy the rollups
+            changed = []
+            with self._lock:
+                for (client_id, metric), series in self._series.items():
+                    for name, rollup in series.rollups.items():
+                        if RETENTION[name] is not None and rollup.prune(now - RETENTION[name]):
+                            series.dirty = True
+                    if not self.data_dir:
+                        # Nowhere to compact to: keep raw points only as long as 1m rollups
+                        i = bisect_left(series.ts, now - RETENTION["1m"])
+                        del series.ts[:i]
+                        del series.values[:i]
+                        continue
+                    if not series.dirty:
+                        continue
+                    series.dirty = False
+                    series.flushing_ts, series.ts = series.ts, array("d")
+                    series.flushing_values, series.values = series.values, array("d")
+                    if series.flushing_ts:
+                        series.disk_tail = series.flushing_ts[-1]
+                    rollups = {name: rollup.records() for name, rollup in series.rollups.items()}
+                    changed.append((client_id, metric, series, rollups))
+            for client_id, metric, series, rollups in changed:
+                self._write(client_id, metric, series, rollups)
+
+    def _write(self, client_id: int, metric: str, series: _Series, rollups: Dict[str, bytes]) -> None:
+        """Append a series' flushing points to its raw file and replace its rollup files"""
+        os.makedirs(os.path.join(self.data_dir, str(client_id)), exist_ok=True)
+        try:
+            if series.flushing_ts:
+                with open(self._path(client_id, metric, "raw"), "ab") as f:
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    try:
+                        f.write(b"".join(_RAW_RECORD.pack(t, v)
+                                         for t, v in zip(series.flushing_ts, series.flushing_values)))
+                        f.flush()
+                    except BaseException:
+                        f.truncate(offset)
+                        raise
+            for name, records in rollups.items():
+                # Replace atomically, so a reader never sees a half-written file
+                path = self._path(client_id, metric, name)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(records)
+                os.replace(path + ".tmp", path)
+        except Exception:
+            with self._lock:
+                # Back into the hot arrays, to be retried by the next compaction
+                series.ts = series.flushing_ts + series.ts
+                series.values = series.flushing_values + series.values
+                series.flushing_ts, series.flushing_values = array("d"), array("d")
+                series.dirty = True
+            raise
+        with self._lock:
+            series.disk_records += len(series.flushing_ts)
+            series.flushing_ts, series.flushing_values = array("d"), array("d")
+
+    def start(self) -> None:
+        """Run compact() every compact_interval seconds in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.compact()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "points_ingested": self.points,
+                "hot_points": sum(len(series.ts) for series in self._series.values())
+            }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Metrics compaction failed: {e}")
+
+    def _find_series(self, client_id: int, metric: str) -> Optional[_Series]:
+        # Caller must hold the lock; a read loads a persisted series but never creates an empty one
+        series = self._series.get((client_id, metric))
+        if series is None and self.data_dir and self._files(client_id, metric):
+            series = self._get_series(client_id, metric)
+        return series
+
+    def _get_series(self, client_id: int, metric: str) -> _Series:
+        # Caller must hold the lock; loads persisted rollups on first use
+        key = (client_id, metric)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+            if self.data_dir:
+                self._load(client_id, metric, series)
+        return series
+
+    def _load(self, client_id: int, metric: str, series: _Series) -> None:
+        raw_path = self._path(client_id, metric, "raw")
+        if os.path.exists(raw_path):
+            series.disk_records = os.path.getsize(raw_path) // _RAW_RECORD.size
+        if series.disk_records:
+            with open(raw_path, "rb") as f:
+                f.seek((series.disk_records - 1) * _RAW_RECORD.size)
+                series.disk_tail = _RAW_RECORD.unpack(f.read(_RAW_RECORD.size))[0]
+        for name, rollup in series.rollups.items():
+            path = self._path(client_id, metric, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                for row in _ROLLUP_RECORD.iter_unpack(f.read()):
+                    for column, value in zip(
+                        (rollup.starts, rollup.counts, rollup.sums, rollup.mins, rollup.maxs), row
+                    ):
+                        column.append(value)
+
+    def _read_disk(self, path: str, start: float, end: float, records: Optional[int] = None) -> Tuple[array, array]:
+        """Binary-search the first `records` (default: all complete) fixed-size records of a raw file for [start, end)"""
+        ts, values = array("d"), array("d")
+        if start >= end or not os.path.exists(path):
+            return ts, values
+        size = _RAW_RECORD.size
+        with open(path, "rb") as f:
+            if records is None:
+                records = os.fstat(f.fileno()).st_size // size
+
+            def timestamp_at(i: int) -> float:
+                f.seek(i * size)
+                return _RAW_RECORD.unpack(f.read(size))[0]
+
+            lo, hi = 0, records
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if timestamp_at(mid) < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            f.seek(lo * size)
+            while lo < records:
+                chunk = f.read(size * min(4096, records - lo))
+                if not chunk:
+                    break
+                for t, v in _RAW_RECORD.iter_unpack(chunk):
+                    if t >= end:
+                        return ts, values
+                    ts.append(t)
+                    values.append(v)
+                lo += len(chunk) // size
+        return ts, values
+
+    def _path(self, client_id: int, metric: str, kind: str, writer: Optional[int] = None) -> str:
+        """A series file of the given writer, by default this process"""
+        writer = self._writer_number() if writer is None else writer
+        suffix = f"@{writer}" if writer else ""
+        return os.path.join(self.data_dir, str(client_id), f"{quote(metric, safe='')}{suffix}.{kind}")
+
+    def _files(self, client_id: int, metric: str) -> Dict[str, Dict[int, str]]:
+        """Every writer's files of a series: kind -> writer number -> path"""
+        client_dir = os.path.join(self.data_dir, str(client_id))
+        try:
+            names = os.listdir(client_dir)
+        except FileNotFoundError:
+            return {}
+        prefix = quote(metric, safe="")
+        files = {}
+        for name in names:
+            stem, _, kind = name.rpartition(".")
+            base, _, writer = stem.partition("@")
+            if base == prefix and kind in ("raw", *RESOLUTIONS) and (not writer or writer.isdigit()):
+                files.setdefault(kind, {})[int(writer or 0)] = os.path.join(client_dir, name)
+        return files
+
+    def _other_writers(self, client_id: int, metric: str, kind: str) -> List[str]:
+        """Paths of a series file written by other processes"""
+        if not self.data_dir:
+            return []
+        files = self._files(client_id, metric).get(kind, {})
+        own = self._writer_number()
+        return [path for writer, path in files.items() if writer != own]
+
+    def _writer_number(self) -> int:
+        """This process's writer number: the first data_dir/.writer-N.lock it can lock"""
+        with self._writer_lock:
+            if self._writer is None or self._writer[2] != os.getpid():
+                os.makedirs(self.data_dir, exist_ok=True)
+                writer = 0
+                while True:
+                    lock_file = open(os.path.join(self.data_dir, f".writer-{writer}.lock"), "a+b")
+                    if _try_lock(lock_file):
+                        break
+                    lock_file.close()
+                    writer += 1
+                # The lock file stays open (and locked) for the life of the process
+                self._writer = (writer, lock_file, os.getpid())
+            return self._writer[0]
+
+def _try_lock(f) -> bool:
+    """Take a non-blocking exclusive lock on f, held until it is closed or the process exits"""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        import msvcrt
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _merge_rollups(columns: List[array], paths: List[str], resolution: str, start: float, end: float) -> List[array]:
+    """This process's (start, count, sum, min, max) bucket columns plus other writers' persisted buckets in [start, end)"""
+    interval = RESOLUTIONS[resolution]
+    lo = start - start % interval if start > float("-inf") else start
+    if RETENTION[resolution] is not None:
+        # Another writer may have stopped and never pruned its files
+        lo = max(lo, time.time() - RETENTION[resolution])
+    buckets = {row[0]: list(row[1:]) for row in zip(*columns)}
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        for bucket_start, count, total, low, high in _ROLLUP_RECORD.iter_unpack(
+            data[:len(data) - len(data) % _ROLLUP_RECORD.size]
+        ):
+            if not lo <= bucket_start < end:
+                continue
+            bucket = buckets.get(bucket_start)
+            if bucket is None:
+                buckets[bucket_start] = [count, total, low, high]
+            else:
+                bucket[0] += count
+                bucket[1] += total
+                bucket[2] = min(bucket[2], low)
+                bucket[3] = max(bucket[3], high)
+    merged = [array("d") for _ in range(5)]
+    for bucket_start in sorted(buckets):
+        for column, value in zip(merged, (bucket_start, *buckets[bucket_start])):
+            column.append(value)
+    return merged
+
+def as_numpy(columns: Dict[str, array]):
+    """Zero-copy NumPy views of a query result (NumPy is optional)"""
+    import numpy as np
+    return {name: np.frombuffer(column, dtype=np.float64) for name, column in columns.items()}
@@ -1,5 +1,4 @@
 from typing import Dict, Any
-import requests
 import json
 import os
 
@@ -13,17 +12,23 @@ class PaymentSystem:
             "basic": {
                 "name": "Basic",
                 "price": 14900,  # in cents (R149)
-                "features": ["1000 AI analyses/month", "Basic dashboard", "Email support"]
+                "features": ["1000 AI analyses/month", "Basic dashboard", "Email support"],
+                "monthly_analyses": 1000,
+                "requests_per_minute": 60
             },
             "advanced": {
                 "name": "Advanced", 
                 "price": 49900,  # in cents (R499)
-                "features": ["5000 AI analyses/month", "Advanced dashboard", "Priority support", "API access"]
+                "features": ["5000 AI analyses/month", "Advanced dashboard", "Priority support", "API access"],
+                "monthly_analyses": 5000,
+                "requests_per_minute": 300
             },
             "enterprise": {
                 "name": "Enterprise",
                 "price": 99900,  # in cents (R999)
-                "features": ["Unlimited analyses", "Full dashboard", "24/7 support", "Custom integrations"]
+                "features": ["Unlimited analyses", "Full dashboard", "24/7 support", "Custom integrations"],
+                "monthly_analyses": None,  # Unlimited
+                "requests_per_minute": 1200
             }
         }
     
@@ -0,0 +1,115 @@
+from string import Formatter
+from typing import Any, Dict, List, Sequence
+from llm_cache import quantize
+import math
+import re
+
+# Well-known support acronyms; other metric names are sent as they are
+ABBREVIATIONS = {
+    "customer_satisfaction": "csat",
+    "net_promoter_score": "nps",
+    "first_contact_resolution": "fcr",
+    "first_call_resolution": "fcr_call",
+    "average_handle_time": "aht",
+    "lead_conversion_rate": "lead_conversion",
+    "issue_resolution_rate": "issue_resolution",
+    "qualification_accuracy": "qualification_acc"
+}
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    """Approximate BPE token count: one per punctuation mark, one per 4 characters of a word.
+
+    Errs on the high side of what OpenAI's tokenizers report for English and
+    JSON, so a prompt within budget here is within budget for the model.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _PIECES.findall(text))
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """text cut at a word boundary to at most budget tokens, the "…" marking the cut included"""
+    if count_tokens(text) <= budget:
+        return text
+    if budget < 1:
+        return ""
+    chars = (budget - 1) * 4
+    while True:
+        cut = text[:chars].rsplit(" ", 1)[0] if chars else ""
+        tokens = count_tokens(cut)
+        if tokens < budget:
+            return cut + "…"
+        # Punctuation and short words cost more than 4 characters a token; shrink in proportion
+        chars = len(cut) * (budget - 1) // tokens
+
+def compact_metrics(metrics: Dict[str, Any], digits: int = 3) -> str:
+    """Canonical, short form of a metrics dict: sorted `name=value` pairs, numbers to `digits` significant digits"""
+    pairs = []
+    for name in sorted(metrics):
+        value = metrics[name]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = f"{quantize(float(value), digits):g}"
+        pairs.append(f"{ABBREVIATIONS.get(name, name)}={value}")
+    return " ".join(pairs)
+
+def compact_list(items: Sequence[Any]) -> str:
+    return "; ".join(" ".join(str(item).split()) for item in items)
+
+def fit_samples(samples: Sequence[str], budget: int, per_sample: int) -> List[str]:
+    """Samples within a token budget: each cut to per_sample tokens, then an evenly spaced subset if still too long.
+
+    Deterministic, so the same inputs give the same prompt and cache key.
+    """
+    samples = [truncate_tokens(" ".join(sample.split()), per_sample) for sample in samples]
+    costs = [count_tokens(sample) + 1 for sample in samples]  # + the newline between samples
+    if sum(costs) <= budget:
+        return samples
+    for keep in range(len(samples) - 1, 0, -1):
+        chosen = [samples[round(i * len(samples) / keep)] for i in range(keep)]
+        if sum(count_tokens(sample) + 1 for sample in chosen) <= budget:
+            return chosen
+    return []
+
+class PromptTemplate:
+    """A prompt with {fields}, parsed once; render() only joins strings.
+
+    static_tokens is the token count of the fixed text, so callers can budget
+    the variable parts. max_tokens caps the completion for this prompt.
+    """
+
+    def __init__(self, text: str, max_tokens: int):
+        self.text = text
+        self.max_tokens = max_tokens
+        self._parts = [(literal, field) for literal, field, _, _ in Formatter().parse(text)]
+        self.fields = [field for _, field in self._parts if field is not None]
+        self.static_tokens = count_tokens("".join(literal for literal, _ in self._parts))
+
+    def render(self, **values: Any) -> str:
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field in self._parts)
+
+GAPS = PromptTemplate(
+    "Top 3 performance gaps in these {domain} metrics: {metrics}\n"
+    'Reply with only a JSON array of short gap descriptions, e.g. ["Slow resolution of billing issues"]',
+    max_tokens=150
+)
+
+# Completion cap is per metric set
+GAPS_BATCH = PromptTemplate(
+    "Top 3 performance gaps for each numbered set of {domain} metrics:\n{sets}\n"
+    "Reply with only a JSON object mapping each set number to its array of short gap descriptions, "
+    'e.g. {{"0": ["Slow resolution of billing issues"]}}',
+    max_tokens=100
+)
+
+PLAN = PromptTemplate(
+    "Suggest improvement proposals for these {domain} gaps: {gaps}\n"
+    'Reply with only JSON: {{"proposals": [{{"hypothesis": "...", '
+    '"intervention": "prompt_change|adapter_training", "expected_impact": 0.15}}]}}',
+    max_tokens=300
+)
+
+TEST = PromptTemplate(
+    "Test this hypothesis: {hypothesis}\n"
+    "Sample conversations:\n{conversations}\n"
+    'Reply with only JSON: {{"success_rate": 0.85, "improvement": 0.12, "risks": ["..."]}}',
+    max_tokens=120
+)
@@ -0,0 +1,212 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from sqlalchemy.dialects.sqlite import insert
+from shared_state import LocalState
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class QuotaExceeded(Exception):
+    """A call was refused; retry_after is the number of seconds until it can succeed"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class _Meter:
+    """One client's plan limits; the usage and token counters live in the shared state"""
+
+    __slots__ = ("plan", "monthly", "rate", "capacity", "loaded_at")
+
+    def __init__(self, plan: str, limits: Dict[str, Any], burst_seconds: float):
+        self.plan = plan
+        self.monthly = limits.get("monthly_analyses")
+        self.rate = limits["requests_per_minute"] / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.loaded_at = time.monotonic()
+
+def _period(now: datetime) -> str:
+    return now.strftime("%Y-%m")
+
+def _seconds_to_next_period(now: datetime) -> int:
+    if now.month == 12:
+        start = datetime(now.year + 1, 1, 1)
+    else:
+        start = datetime(now.year, now.month + 1, 1)
+    return max(1, math.ceil((start - now).total_seconds()))
+
+class QuotaManager:
+    """Per-plan rate limiting and monthly quota metering, without a database round trip.
+
+    Each client gets a token bucket refilled at its plan's requests_per_minute
+    and a counter of analyses used this month, kept in state (a shared_state
+    backend, so every worker meters the same bucket and counter). The counter
+    is seeded from the database on first use and the plan is re-read every
+    plan_ttl seconds. Usage is upserted into usage_model in batches by a
+    background thread every flush_interval seconds.
+    """
+
+    def __init__(self, session_factory: Callable, usage_model, plans: Dict[str, Dict[str, Any]],
+                 default_plan: str, burst_seconds: float = 10.0, plan_ttl: float = 300.0,
+                 flush_interval: float = 5.0, state=None):
+        self.session_factory = session_factory
+        self.usage_model = usage_model
+        self.plans = plans
+        self.default_plan = default_plan
+        self.burst_seconds = burst_seconds
+        self.plan_ttl = plan_ttl
+        self.flush_interval = flush_interval
+        self.state = state if state is not None else LocalState()
+        self._meters = {}  # client_id -> _Meter
+        self._pending = {}  # (client_id, period) -> analyses not yet flushed
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.rate_limited = 0
+        self.quota_exceeded = 0
+        self.flushes = 0
+
+    def acquire(self, client_id: int, loader: Callable[[int, str], Tuple[Optional[str], int]],
+                cost: int = 1) -> None:
+        """Take cost tokens and analyses for a client or raise QuotaExceeded.
+
+        The full cost counts against the monthly quota, but at most the
+        bucket's capacity is taken from the rate limit, so a batch larger than
+        the burst allowance waits for a full bucket instead of never fitting.
+        loader(client_id, period) returns the client's active plan (None for
+        the default plan) and its persisted usage for the period; it is only
+        called when the client's meter is missing or older than plan_ttl.
+        """
+        now = datetime.utcnow()
+        period = _period(now)
+        meter = self._meter(client_id, period, loader)
+        usage_key = _usage_key(client_id, period)
+        if meter.monthly is None:
+            self.state.incr(usage_key, cost)
+        elif self.state.incr_within(usage_key, cost, meter.monthly) is None:
+            with self._lock:
+                self.quota_exceeded += 1
+            raise QuotaExceeded(
+                f"Monthly quota of {meter.monthly} analyses reached for plan {meter.plan}",
+                _seconds_to_next_period(now)
+            )
+        wait = self.state.take(_bucket_key(client_id), min(cost, meter.capacity), meter.rate, meter.capacity)
+        if wait:
+            self.state.incr(usage_key, -cost)
+            with self._lock:
+                self.rate_limited += 1
+            raise QuotaExceeded(f"Rate limit of {meter.rate * 60:g} requests/minute exceeded", max(1, math.ceil(wait)))
+        with self._lock:
+            key = (client_id, period)
+            self._pending[key] = self._pending.get(key, 0) + cost
+
+    def release(self, client_id: int, cost: int = 1) -> None:
+        """Give back a cost acquired for work that was then refused"""
+        with self._lock:
+            meter = self._meters.get(client_id)
+        if meter is None:
+            return
+        period = _period(datetime.utcnow())
+        self.state.take(_bucket_key(client_id), -min(cost, meter.capacity), meter.rate, meter.capacity)
+        self.state.incr(_usage_key(client_id, period), -cost)
+        with self._lock:
+            key = (client_id, period)
+            self._pending[key] = self._pending.get(key, 0) - cost
+
+    def usage(self, client_id: int, loader: Callable[[int, str], Tuple[Optional[str], int]]) -> Dict[str, Any]:
+        """The client's plan, analyses used this month and what remains"""
+        period = _period(datetime.utcnow())
+        meter = self._meter(client_id, period, loader)
+        used = int(self.state.get(_usage_key(client_id, period)))
+        return {
+            "plan": meter.plan,
+            "period": period,
+            "analyses_used": used,
+            "monthly_limit": meter.monthly,
+            "remaining": None if meter.monthly is None else max(0, meter.monthly - used),
+            "requests_per_minute": meter.rate * 60
+        }
+
+    def flush(self) -> None:
+        """Add pending usage to the usage table in one transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        pending = {key: count for key, count in pending.items() if count}
+        if not pending:
+            return
+        table = self.usage_model.__table__
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            for (client_id, period), count in pending.items():
+                statement = insert(table).values(client_id=client_id, period=period, analyses=count, updated_at=now)
+                db.execute(statement.on_conflict_do_update(
+                    index_elements=["client_id", "period"],
+                    set_={"analyses": table.c.analyses + statement.excluded.analyses, "updated_at": now}
+                ))
+            db.commit()
+            with self._lock:
+                self.flushes += 1
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Usage flush failed: {e}")
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        """Run flush() every flush_interval seconds in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clients": len(self._meters),
+                "pending_clients": len(self._pending),
+                "rate_limited": self.rate_limited,
+                "quota_exceeded": self.quota_exceeded,
+                "flushes": self.flushes
+            }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _meter(self, client_id: int, period: str,
+               loader: Callable[[int, str], Tuple[Optional[str], int]]) -> _Meter:
+        with self._lock:
+            meter = self._meters.get(client_id)
+            if meter is not None and time.monotonic() - meter.loaded_at < self.plan_ttl:
+                return meter
+        # Load outside the lock; concurrent first calls may both load, which is harmless
+        plan, used = loader(client_id, period)
+        plan = plan if plan in self.plans else self.default_plan
+        # The shared counter already includes every worker's unflushed usage; the
+        # database total only matters when the counter is new or behind it
+        self.state.seed(_usage_key(client_id, period), used)
+        meter = _Meter(plan, self.plans[plan], self.burst_seconds)
+        with self._lock:
+            self._meters[client_id] = meter
+        return meter
+
+def _usage_key(client_id: int, period: str) -> str:
+    return f"quota:usage:{client_id}:{period}"
+
+def _bucket_key(client_id: int) -> str:
+    return f"quota:bucket:{client_id}"
@@ -0,0 +1,170 @@
+from typing import Any, Dict, List, Optional, Set
+import json
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Per-domain thresholds; override or extend with a JSON file of the same shape (RULES_PATH).
+# "op" is the direction that counts as a gap; "ignore" lists known metrics that have no threshold.
+DEFAULT_RULES = {
+    "customer_support": {
+        "rules": [
+            {"metric": "response_accuracy", "op": "<", "threshold": 0.8, "gap": "Improve response accuracy"},
+            {"metric": "resolution_time", "op": ">", "threshold": 2.0, "gap": "Reduce resolution time"},
+            {"metric": "customer_satisfaction", "op": "<", "threshold": 4.0, "gap": "Raise customer satisfaction"},
+            {"metric": "first_contact_resolution", "op": "<", "threshold": 0.7, "gap": "Resolve more issues on first contact"}
+        ]
+    },
+    "technical_support": {
+        "rules": [
+            {"metric": "issue_resolution_rate", "op": "<", "threshold": 0.75, "gap": "Increase issue resolution rate"},
+            {"metric": "first_call_resolution", "op": "<", "threshold": 0.7, "gap": "Resolve more issues on the first call"},
+            {"metric": "escalation_rate", "op": ">", "threshold": 0.2, "gap": "Reduce escalations"},
+            {"metric": "average_handle_time", "op": ">", "threshold": 6.0, "gap": "Shorten average handle time"}
+        ]
+    },
+    "sales": {
+        "rules": [
+            {"metric": "lead_conversion_rate", "op": "<", "threshold": 0.2, "gap": "Improve lead conversion"},
+            {"metric": "qualification_accuracy", "op": "<", "threshold": 0.75, "gap": "Qualify leads more accurately"},
+            {"metric": "response_time", "op": ">", "threshold": 2.0, "gap": "Respond to leads faster"}
+        ],
+        "ignore": ["deal_size"]
+    }
+}
+
+class _DomainRules:
+    """One domain's rules compiled into parallel NumPy vectors"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        import numpy as np
+        rules = spec.get("rules", [])
+        self.index = {rule["metric"]: i for i, rule in enumerate(rules)}
+        self.ignore = set(spec.get("ignore", []))
+        self.gaps = [rule["gap"] for rule in rules]
+        thresholds = np.array([float(rule["threshold"]) for rule in rules])
+        self.thresholds = thresholds
+        self.scale = np.where(thresholds == 0, 1.0, np.abs(thresholds))
+        self.direction = np.array([1.0 if rule["op"] == ">" else -1.0 for rule in rules])
+
+class RuleEngine:
+    """Deterministic fast path in front of AIService.analyze_performance_gaps.
+
+    A metric set is answered from the rules only when every metric is known for
+    its domain, every known metric is a finite number and no value lies within
+    `margin` (relative) of a threshold. Otherwise it returns None and the caller
+    escalates to the LLM.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Any]] = None, margin: float = 0.05, max_gaps: int = 3):
+        self.margin = margin
+        self.max_gaps = max_gaps
+        self.rules = rules or DEFAULT_RULES
+        self._compiled = None  # Built on first evaluation, so importing NumPy doesn't slow startup
+        self._lock = threading.Lock()
+        self.evaluated = 0
+        self.fast_path = 0
+
+    @classmethod
+    def from_file(cls, path: Optional[str], margin: float = 0.05) -> "RuleEngine":
+        """DEFAULT_RULES, with domains from the JSON file at path replacing the defaults"""
+        rules = dict(DEFAULT_RULES)
+        if path and os.path.exists(path):
+            with open(path) as f:
+                rules.update(json.load(f))
+        elif path:
+            logger.warning(f"Rules file {path} not found; using built-in rules")
+        return cls(rules, margin)
+
+    def evaluate(self, metrics: Dict[str, float], domain: str, strict: bool = True) -> Optional[List[str]]:
+        """Gaps for one metric set, or None if it needs the LLM"""
+        return self.evaluate_batch([metrics], domain, strict)[0]
+
+    def evaluate_batch(self, metrics_list: List[Dict[str, float]], domain: str,
+                       strict: bool = True) -> List[Optional[List[str]]]:
+        """Evaluate many metric sets of one domain in a single vectorized pass.
+
+        strict=False answers from the known metrics even when a set is
+        ambiguous or has metrics the rules can't judge (a fallback for when the
+        LLM is unavailable); only an unknown domain still gives None.
+        """
+        import numpy as np
+        compiled = self._domains().get(domain)
+        if compiled is None or not compiled.gaps:
+            if strict:
+                self._count(len(metrics_list), 0)
+            return [None] * len(metrics_list)
+
+        values = np.full((len(metrics_list), len(compiled.gaps)), np.nan)
+        novel = np.zeros(len(metrics_list), dtype=bool)
+        for row, metrics in enumerate(metrics_list):
+            if not metrics:
+                novel[row] = True
+            for metric, value in metrics.items():
+                column = compiled.index.get(metric)
+                if column is not None:
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        value = math.nan
+                    if math.isfinite(value):
+                        values[row, column] = value
+                    else:
+                        novel[row] = True  # Nothing to compare with a threshold
+                elif metric not in compiled.ignore:
+                    novel[row] = True
+
+        # Signed relative distance past each threshold: > 0 is a gap, near 0 is ambiguous
+        distance = compiled.direction * (values - compiled.thresholds) / compiled.scale
+        with np.errstate(invalid="ignore"):
+            ambiguous = (np.abs(distance) < self.margin).any(axis=1)
+            violated = distance > 0
+        escalate = (novel | ambiguous) if strict else np.zeros(len(metrics_list), dtype=bool)
+        # Most severe violations first
+        order = np.argsort(-np.nan_to_num(distance, nan=-np.inf), axis=1)
+
+        results = []
+        for row in range(len(metrics_list)):
+            if escalate[row]:
+                results.append(None)
+                continue
+            gaps = [compiled.gaps[column] for column in order[row] if violated[row, column]]
+            results.append(gaps[:self.max_gaps])
+        if strict:
+            self._count(len(metrics_list), int((~escalate).sum()))
+        return results
+
+    def higher_is_worse(self) -> Set[str]:
+        """Metrics, across all domains, where an increase is a degradation"""
+        return {
+            rule["metric"] for spec in self.rules.values() for rule in spec.get("rules", []) if rule["op"] == ">"
+        }
+
+    def warm_up(self) -> None:
+        """Compile the rules (and import NumPy) ahead of the first evaluation"""
+        self._domains()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "evaluated": self.evaluated,
+                "fast_path": self.fast_path,
+                "escalated": self.evaluated - self.fast_path,
+                "fast_path_rate": round(self.fast_path / self.evaluated, 4) if self.evaluated else 0.0
+            }
+
+    def _domains(self) -> Dict[str, _DomainRules]:
+        if self._compiled is None:
+            compiled = {domain: _DomainRules(spec) for domain, spec in self.rules.items()}
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = compiled
+        return self._compiled
+
+    def _count(self, evaluated: int, fast_path: int) -> None:
+        with self._lock:
+            self.evaluated += evaluated
+            self.fast_path += fast_path
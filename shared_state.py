@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+
+class LocalState:
+    """Counters, token buckets and change versions held in this process.
+
+    Correct for a single worker. SqliteState has the same methods and shares
+    them between every worker process on the host.
+    """
+
+    def __init__(self):
+        self._values = {}  # key -> (value, updated_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            return self._values.get(key, (0, 0.0))[0]
+
+    def incr(self, key: str, amount: float = 1) -> float:
+        """Add to a counter and return its new value; unique across callers, so usable as an id"""
+        with self._lock:
+            value = self._values.get(key, (0, 0.0))[0] + amount
+            self._values[key] = (value, time.time())
+            return value
+
+    def incr_within(self, key: str, amount: float, limit: float) -> Optional[float]:
+        """incr() unless the result would exceed limit, in which case None"""
+        with self._lock:
+            value = self._values.get(key, (0, 0.0))[0] + amount
+            if value > limit:
+                return None
+            self._values[key] = (value, time.time())
+            return value
+
+    def seed(self, key: str, value: float) -> None:
+        """Raise a counter to at least value, e.g. to a total persisted elsewhere"""
+        with self._lock:
+            current = self._values.get(key)
+            if current is None or current[0] < value:
+                self._values[key] = (value, time.time())
+
+    def take(self, key: str, cost: float, rate: float, capacity: float) -> float:
+        """Take cost tokens from a bucket refilled at rate/second; 0 if taken, else seconds to wait.
+
+        A negative cost puts tokens back.
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._values.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            self._values[key] = (min(capacity, tokens - cost), now)
+            return 0.0
+
+class SqliteState:
+    """LocalState's operations on a SQLite file, atomic across processes.
+
+    Every worker opens the same file; read-modify-write operations run in
+    IMMEDIATE transactions, so they serialize on SQLite's file lock instead
+    of a network service. The connection is opened on first use and again
+    after a fork.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            row = self._connection().execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else 0
+
+    def incr(self, key: str, amount: float = 1) -> float:
+        """Add to a counter and return its new value; unique across callers, so usable as an id"""
+        with self._lock, self._transaction() as db:
+            return self._write(db, key, self._read(db, key)[0] + amount)
+
+    def incr_within(self, key: str, amount: float, limit: float) -> Optional[float]:
+        """incr() unless the result would exceed limit, in which case None"""
+        with self._lock, self._transaction() as db:
+            value = self._read(db, key)[0] + amount
+            return None if value > limit else self._write(db, key, value)
+
+    def seed(self, key: str, value: float) -> None:
+        """Raise a counter to at least value, e.g. to a total persisted elsewhere"""
+        with self._lock, self._transaction() as db:
+            current = self._read(db, key)
+            if current[1] is None or current[0] < value:
+                self._write(db, key, value)
+
+    def take(self, key: str, cost: float, rate: float, capacity: float) -> float:
+        """Take cost tokens from a bucket refilled at rate/second; 0 if taken, else seconds to wait.
+
+        A negative cost puts tokens back.
+        """
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            tokens, updated = self._read(db, key)
+            if updated is None:
+                tokens, updated = capacity, now
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            self._write(db, key, min(capacity, tokens - cost), now)
+            return 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Caller must hold the lock
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                 isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state ("
+                "key TEXT PRIMARY KEY, value NUMERIC NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # Caller must hold the lock; IMMEDIATE takes the write lock before reading
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _read(self, db: sqlite3.Connection, key: str) -> Tuple[float, Optional[float]]:
+        row = db.execute("SELECT value, updated_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def _write(self, db: sqlite3.Connection, key: str, value: float, updated_at: Optional[float] = None) -> float:
+        db.execute(
+            "INSERT INTO shared_state (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (key, value, time.time() if updated_at is None else updated_at)
+        )
+        return value
+
+class Watch:
+    """Tells this worker when any worker changed a topic, e.g. to drop a cache.
+
+    Changes are version bumps in the shared state; changed() reads the version
+    at most every poll_interval seconds. A worker's own bump() does not count
+    as a change, since it has already applied it.
+    """
+
+    def __init__(self, state, topic: str, poll_interval: float = 0.5):
+        self.state = state
+        self.key = f"version:{topic}"
+        self.poll_interval = poll_interval
+        self._seen = None
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        """Mark the current version as seen, just before reloading from the source of truth"""
+        version = self.state.get(self.key)
+        with self._lock:
+            self._seen = version
+            self._next_poll = time.monotonic() + self.poll_interval
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_poll:
+                return False
+            self._next_poll = now + self.poll_interval
+        version = self.state.get(self.key)
+        with self._lock:
+            if self._seen is None:
+                self._seen = version
+                return False
+            if version == self._seen:
+                return False
+            self._seen = version
+            return True
+
+    def bump(self) -> None:
+        """Record a change this worker made"""
+        version = self.state.incr(self.key)
+        with self._lock:
+            if self._seen is not None and version == self._seen + 1:
+                self._seen = version
+
+def create_state(path: str = "", database_url: str = ""):
+    """SqliteState at path; "memory" for LocalState. Empty puts the file next to a SQLite database_url"""
+    if not path and database_url.startswith("sqlite:///") and ":memory:" not in database_url:
+        path = database_url[len("sqlite:///"):] + ".state"
+    if not path or path == "memory":
+        return LocalState()
+    return SqliteState(path)
@@ -1,161 +1,259 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Request, Response, Query
 from pydantic import BaseModel
-from typing import Dict, Any, List
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
 from datetime import datetime
-import openai
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import logging
+import time
 import uuid
 import os
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from payments import PaymentSystem
 from datetime import datetime, timedelta
-from webhooks import WebhookManager
-
-# Database setup
-Base = declarative_base()
-engine = create_engine("sqlite:///./aicsa.db")
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Database Models
-class Client(Base):
-    __tablename__ = "clients"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
-    domain = Column(String)
-    api_key = Column(String, unique=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    is_active = Column(Boolean, default=True)
-
-class Experiment(Base):
-    __tablename__ = "experiments"
-    id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer)
-    hypothesis = Column(Text)
-    intervention_type = Column(String)
-    status = Column(String)
-    results = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class Subscription(Base):
-    __tablename__ = "subscriptions"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer)
-    plan_type = Column(String)  # basic, advanced, enterprise
-    status = Column(String)  # active, canceled, expired
-    charge_id = Column(String)  # Yoco charge ID
-    amount_paid = Column(Float)
-    start_date = Column(DateTime, default=datetime.utcnow)
-    end_date = Column(DateTime)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class Webhook(Base):
-    __tablename__ = "webhooks"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer)
-    webhook_url = Column(String)  # Client's URL to receive notifications
-    event_types = Column(String)  # Types of events client wants to receive
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+from webhooks import WebhookManager, WebhookDispatcher, DeliveryLog, SubscriptionIndex, parse_event_types
+from auth_cache import AuthCache, parse_api_key
+from agent_controller import AsyncAgentController
+from experiment_writer import ExperimentWriter
+from single_flight import SingleFlight
+from job_queue import JobQueue
+from metrics_store import MetricsStore
+from rule_engine import RuleEngine
+from anomaly_detector import AnomalyDetector
+from quota import QuotaManager, QuotaExceeded
+from shared_state import Watch, create_state
+from config import Config
+import instrumentation
+from pagination import encode_cursor, decode_cursor
+from database import (
+    init_db, get_db, SessionLocal, Client, Experiment, AnalysisJob, Subscription, ClientUsage, Webhook, WebhookSubscription,
+    WebhookDelivery, WebhookAttempt, WebhookStats, WebhookLatencyBucket
+)
+
+logger = logging.getLogger(__name__)
+
+# Initialize payment system
+payment_system = PaymentSystem()
+
+# Counters and change versions every worker process sees
+shared_state = create_state(Config.SHARED_STATE_DB, Config.DATABASE_URL)
 
-# Initialize database
-Base.metadata.create_all(bind=engine)
+# Delivery attempt log with per-client aggregates
+delivery_log = DeliveryLog(WebhookAttempt, WebhookStats, WebhookLatencyBucket)
 
-def get_db():
+# Background webhook delivery from the outbox table
+webhook_dispatcher = WebhookDispatcher(
+    SessionLocal,
+    WebhookDelivery,
+    workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+    per_destination=int(os.getenv("WEBHOOK_PER_DESTINATION", "2")),
+    max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5")),
+    base_backoff=float(os.getenv("WEBHOOK_BACKOFF", "1.0")),
+    log=delivery_log,
+    lease_seconds=Config.WORKER_LEASE_SECONDS
+)
+
+def subscription_rows():
     db = SessionLocal()
     try:
-        yield db
+        return (
+            db.query(Webhook.id, Webhook.client_id, Webhook.webhook_url, WebhookSubscription.event_type)
+            .join(WebhookSubscription, WebhookSubscription.webhook_id == Webhook.id)
+            .filter(Webhook.is_active == True)
+            .all()
+        )
     finally:
         db.close()
-# Initialize payment system
-payment_system = PaymentSystem()
+
+# Event type -> client -> webhook URLs, loaded at startup and whenever another worker changes it
+subscription_index = SubscriptionIndex(Watch(shared_state, "webhooks", Config.SHARED_STATE_POLL), subscription_rows)
 
 # Initialize webhook manager
-webhook_manager = WebhookManager()
+webhook_manager = WebhookManager(webhook_dispatcher, subscription_index)
 
-# AI Service
-class AIService:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY", "demo_key"))  # REPLACE WITH YOUR KEY
-    
-    def analyze_performance_gaps(self, metrics: Dict[str, float], domain: str) -> List[str]:
-        prompt = f"Analyze these {domain} metrics: {metrics}. Return top 3 gaps as JSON array."
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200
-            )
-            gaps = eval(response.choices[0].message.content)
-            return gaps[:3]
-        except:
-            return ["High response time", "Low accuracy", "Customer dissatisfaction"]
-    
-    def generate_improvement_plan(self, gaps: List[str], domain: str) -> Dict[str, Any]:
-        prompt = f"For {domain}, fix these gaps: {gaps}. Return JSON with proposals."
-        
+def load_subscription_index():
+    """Backfill subscription rows for legacy webhooks, then build the routing index"""
+    db = SessionLocal()
+    try:
+        subscribed = db.query(WebhookSubscription.webhook_id)
+        for webhook in db.query(Webhook).filter(Webhook.id.notin_(subscribed)).all():
+            try:
+                event_types = parse_event_types(webhook.event_types, webhook_manager.webhook_types)
+            except ValueError:
+                event_types = ["all"]
+            db.add_all([
+                WebhookSubscription(webhook_id=webhook.id, client_id=webhook.client_id, event_type=event_type)
+                for event_type in event_types
+            ])
+        db.commit()
+    finally:
+        db.close()
+    subscription_index.reload()
+
+# API key -> client cache in front of the clients table
+auth_cache = AuthCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),
+    negative_ttl=float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "30")),
+    watch=Watch(shared_state, "clients", Config.SHARED_STATE_POLL)
+)
+
+# Per-plan rate limits and monthly analysis quotas, metered in the shared state
+quota_manager = QuotaManager(
+    SessionLocal,
+    ClientUsage,
+    plans={
+        **payment_system.plans,
+        "free": {"monthly_analyses": Config.QUOTA_FREE_MONTHLY, "requests_per_minute": Config.QUOTA_FREE_RPM}
+    },
+    default_plan="free",
+    burst_seconds=Config.QUOTA_BURST_SECONDS,
+    plan_ttl=Config.QUOTA_PLAN_TTL,
+    flush_interval=Config.QUOTA_FLUSH_INTERVAL,
+    state=shared_state
+)
+
+# Endpoints; create_app() mounts them on an app with the lifecycle hooks below
+router = APIRouter()
+
+async def record_request_timing(request: Request, call_next):
+    """Request latency histogram, plus a per-stage Server-Timing header on request"""
+    timings = instrumentation.start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    instrumentation.REQUEST_SECONDS.observe(
+        elapsed, request.method, route.path if route else "unmatched", str(response.status_code)
+    )
+    if Config.TIMING_HEADER or request.headers.get("X-Debug-Timing") == "1":
+        response.headers["Server-Timing"] = instrumentation.server_timing(timings, elapsed)
+    return response
+
+# Experiment rows from all requests are bulk-inserted in the background
+experiment_writer = ExperimentWriter(
+    SessionLocal,
+    Experiment,
+    max_rows=Config.EXPERIMENT_FLUSH_ROWS,
+    max_delay=Config.EXPERIMENT_FLUSH_MS / 1000
+)
+
+# Deterministic thresholds answer clear-cut metric sets without the LLM
+rule_engine = RuleEngine.from_file(Config.RULES_PATH, Config.RULES_AMBIGUITY_MARGIN)
+agent_controller = AsyncAgentController(
+    writer=experiment_writer,
+    rules=rule_engine,
+    single_flight=SingleFlight(grace=Config.SINGLE_FLIGHT_GRACE)
+)
+
+def notify_job_finished(job: Dict[str, Any]) -> None:
+    """Send analysis_completed for jobs submitted with notify=true (runs in a worker thread)"""
+    if not job["notify"]:
+        return
+    db = SessionLocal()
+    try:
+        client = db.query(Client).filter(Client.id == job["client_id"]).first()
+        if client:
+            payload = webhook_manager.create_analysis_completed_alert(client.name, job["job_id"], job["status"])
+            webhook_manager.emit(db, payload, client.id)
+    finally:
+        db.close()
+
+# Analyses submitted with ?async=true, run by a bounded worker pool
+job_queue = JobQueue(
+    SessionLocal,
+    AnalysisJob,
+    runner=agent_controller.analyze_client_performance,
+    workers=Config.JOB_WORKERS,
+    on_finish=notify_job_finished,
+    lease_seconds=Config.WORKER_LEASE_SECONDS
+)
+
+# Fires performance_alert webhooks when an ingested metric degrades sharply
+anomaly_detector = AnomalyDetector(
+    alpha=Config.ANOMALY_ALPHA,
+    enter=Config.ANOMALY_ENTER_SCORE,
+    exit=Config.ANOMALY_EXIT_SCORE,
+    warmup=Config.ANOMALY_WARMUP,
+    cooldown=Config.ANOMALY_COOLDOWN,
+    higher_is_worse=rule_engine.higher_is_worse(),
+    rel_floor=Config.ANOMALY_REL_FLOOR,
+    abs_floor=Config.ANOMALY_ABS_FLOOR
+)
+
+def emit_performance_alerts(client, alerts: List[Dict]) -> None:
+    """Queue a performance_alert per detected anomaly (runs in a worker thread)"""
+    db = SessionLocal()
+    try:
+        for alert in alerts:
+            baseline, value = alert["baseline"], alert["value"]
+            if alert["metric"] in anomaly_detector.higher_is_worse:
+                baseline, value = value, baseline
+            new_score = round(100 * value / baseline) if baseline else 0
+            payload = webhook_manager.create_performance_alert(client.name, 100, new_score, alert["metric"])
+            webhook_manager.emit(db, payload, client.id)
+    finally:
+        db.close()
+
+async def ingest_metrics(snapshots: List[Tuple[Client, Dict[str, float]]]) -> None:
+    """Record (client, metrics) snapshots and check them for anomalies.
+
+    The store can read a new series' files, so it runs in a worker thread; only alerts touch the database.
+    """
+    await asyncio.to_thread(metrics_store.append_many, [(client.id, metrics) for client, metrics in snapshots])
+    for client, metrics in snapshots:
+        alerts = anomaly_detector.update(client.id, metrics)
+        if alerts:
+            await asyncio.to_thread(emit_performance_alerts, client, alerts)
+
+# Every ingested metric snapshot, kept as compact per-series arrays with rollups
+metrics_store = MetricsStore(
+    data_dir=Config.METRICS_DATA_DIR or None,
+    compact_interval=Config.METRICS_COMPACT_INTERVAL
+)
+
+async def start_services():
+    """Lifespan startup: schema, thread pool and background workers (nothing runs at import)"""
+    # One sized pool for blocking work: asyncio.to_thread and, on Starlette before
+    # its move to anyio, sync endpoints and dependencies use the default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=Config.THREADPOOL_SIZE, thread_name_prefix="aicsa-io")
+    )
+    try:
+        import anyio.to_thread
+        anyio.to_thread.current_default_thread_limiter().total_tokens = Config.THREADPOOL_SIZE
+    except ImportError:
+        pass
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(load_subscription_index)
+    metrics_store.start()
+    quota_manager.start()
+    await webhook_dispatcher.start()
+    await job_queue.start()
+    # Load the heavy imports in the background so neither startup nor the first analysis waits for them
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+def warm_up():
+    """Build the LLM client and compile the rules (runs in a worker thread, nobody awaits it)"""
+    for step in (agent_controller.ai_service.warm_up, rule_engine.warm_up):
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300
-            )
-            return eval(response.choices[0].message.content)
-        except:
-            return {"proposals": [{"hypothesis": "Improve response templates", "intervention": "prompt_change", "expected_impact": 0.15}]}
-    
-    def test_intervention(self, hypothesis: str, test_data: List[str]) -> Dict[str, Any]:
-        return {"success_rate": 0.85, "improvement": 0.12, "risks": ["Low risk"]}
-
-# Agent Controller
-class AgentController:
-    def __init__(self):
-        self.ai_service = AIService()
-        self.db = SessionLocal()
-    
-    def analyze_client_performance(self, client_id: int, domain: str, metrics: Dict[str, float]) -> Dict[str, Any]:
-        gaps = self.ai_service.analyze_performance_gaps(metrics, domain)
-        print(f"Found gaps: {gaps}")
-        
-        proposals_data = self.ai_service.generate_improvement_plan(gaps, domain)
-        
-        tested_proposals = []
-        for proposal in proposals_data.get("proposals", [])[:1]:
-            test_result = self.ai_service.test_intervention(proposal["hypothesis"], [])
-            
-            experiment = Experiment(
-                client_id=client_id,
-                hypothesis=proposal["hypothesis"],
-                intervention_type=proposal["intervention"],
-                status="completed",
-                results=str(test_result)
-            )
-            self.db.add(experiment)
-            self.db.commit()
-            
-            tested_proposals.append({
-                "hypothesis": proposal["hypothesis"],
-                "intervention": proposal["intervention"],
-                "test_results": test_result
-            })
-        
-        return {
-            "client_id": client_id,
-            "domain": domain,
-            "performance_gaps": gaps,
-            "tested_proposals": tested_proposals,
-            "recommendations": ["IMPLEMENT: " + p["hypothesis"] for p in tested_proposals]
-        }
+            step()
+        except Exception:
+            # The first analysis retries whatever failed here; only the delay is lost
+            logger.exception(f"Warm-up step {step.__qualname__} failed")
 
-# FastAPI App
-app = FastAPI(title="AICSA Pro")
-app.mount("/static", StaticFiles(directory="templates"), name="static")
-agent_controller = AgentController()
+async def stop_services():
+    """Lifespan shutdown: stop workers and flush everything buffered"""
+    await job_queue.stop()
+    await webhook_dispatcher.stop()
+    await asyncio.to_thread(experiment_writer.stop)
+    await asyncio.to_thread(metrics_store.stop)
+    await asyncio.to_thread(quota_manager.stop)
+    await asyncio.to_thread(agent_controller.ai_service.cache.stop)
 
 class ClientMetrics(BaseModel):
     domain: str
@@ -166,50 +264,140 @@ class RSIRequest(BaseModel):
     domain: str
     metrics: Dict[str, float]
 
+class MetricsSnapshot(BaseModel):
+    metrics: Dict[str, float]
+    api_key: Optional[str] = None  # Submit for another client whose key you hold
+
+class MetricsBatch(BaseModel):
+    snapshots: List[MetricsSnapshot]
+
+def load_client_by_api_key(api_key: str):
+    """Look up an active client by API key in its own short-lived session"""
+    db = SessionLocal()
+    try:
+        client = db.query(Client).filter(
+            Client.api_key == api_key,
+            Client.is_active == True
+        ).first()
+        if client:
+            db.expunge(client)  # Safe to cache and use after the session closes
+        return client
+    finally:
+        db.close()
+
 def get_api_key(request: Request):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header:
+    api_key = parse_api_key(request.headers.get("Authorization"))
+    if not api_key:
         raise HTTPException(status_code=401, detail="Missing API key")
     
-    if auth_header.startswith("Bearer "):
-        api_key = auth_header.replace("Bearer ", "")
-    else:
-        api_key = auth_header
-    
-    db = next(get_db())
-    client = db.query(Client).filter(Client.api_key == api_key).first()
+    with instrumentation.timed("auth"):
+        client = auth_cache.get_client(api_key, load_client_by_api_key)
     if not client:
         raise HTTPException(status_code=401, detail="Invalid API key")
     
     return client
-@app.get("/")
+
+def load_plan_usage(client_id: int, period: str):
+    """The client's active plan (None if it has none) and its recorded usage for period"""
+    db = SessionLocal()
+    try:
+        subscription = db.query(Subscription.plan_type).filter(
+            Subscription.client_id == client_id,
+            Subscription.status == "active",
+            Subscription.end_date > datetime.utcnow()
+        ).first()
+        used = db.query(ClientUsage.analyses).filter(
+            ClientUsage.client_id == client_id,
+            ClientUsage.period == period
+        ).scalar()
+        return (subscription.plan_type if subscription else None), used or 0
+    finally:
+        db.close()
+
+def charge_analyses(client, cost: int = 1) -> None:
+    """Count analyses against the client's plan; 429 with Retry-After when over it"""
+    try:
+        quota_manager.acquire(client.id, load_plan_usage, cost)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def refund_analyses(costs: Dict[int, int]) -> None:
+    """Give back analyses charged (client_id -> cost) for requests that then failed"""
+    for client_id, cost in costs.items():
+        quota_manager.release(client_id, cost)
+
+@router.get("/")
 async def serve_dashboard():
     return FileResponse("templates/simple_dash.html")
 
-@app.post("/register-client")
+@router.post("/register-client")
 def register_client(client_data: RSIRequest):
-    db = next(get_db())
-    api_key = f"acs_{str(uuid.uuid4())[:16]}"
-    
-    client = Client(
-        name=client_data.client_name,
-        domain=client_data.domain,
-        api_key=api_key
-    )
+    db = SessionLocal()
+    try:
+        api_key = f"acs_{str(uuid.uuid4())[:16]}"
+        
+        client = Client(
+            name=client_data.client_name,
+            domain=client_data.domain,
+            api_key=api_key
+        )
+        
+        db.add(client)
+        db.commit()
+        client_id = client.id
+    finally:
+        db.close()
     
-    db.add(client)
-    db.commit()
+    # Drop any negative entry cached for this key before it was issued
+    auth_cache.invalidate(api_key)
     
     return {
-        "client_id": client.id,
+        "client_id": client_id,
         "api_key": api_key,
         "message": "Client registered successfully"
     }
 
-@app.post("/analyze-performance")
-def analyze_performance(metrics: ClientMetrics, client: Client = Depends(get_api_key)):
+@router.post("/deactivate-client")
+def deactivate_client(client: Client = Depends(get_api_key)):
+    """Deactivate the calling client; its API key stops working immediately"""
+    db = SessionLocal()
+    try:
+        db.query(Client).filter(Client.id == client.id).update({"is_active": False})
+        db.commit()
+    finally:
+        db.close()
+    
+    auth_cache.invalidate_client(client.id)
+    
+    return {"status": "success", "message": "Client deactivated"}
+
+@router.get("/auth-cache-stats")
+def get_auth_cache_stats():
+    """API key cache hit/miss counters"""
+    return auth_cache.stats()
+
+@router.post("/analyze-performance")
+async def analyze_performance(
+    metrics: ClientMetrics,
+    response: Response,
+    run_async: bool = Query(False, alias="async"),
+    notify: bool = False,
+    client: Client = Depends(get_api_key)
+):
+    """Analyze performance; with async=true, queue it and poll GET /jobs/{job_id}"""
+    # Charged once the body is valid, and given back if the analysis can't be run
+    await asyncio.to_thread(charge_analyses, client)
+    if run_async:
+        try:
+            job_id = await job_queue.submit(client.id, metrics.domain, metrics.metrics, notify)
+        except Exception:
+            await asyncio.to_thread(refund_analyses, {client.id: 1})
+            raise
+        response.status_code = 202
+        return {"status": "queued", "client": client.name, "job_id": job_id, "poll": f"/jobs/{job_id}"}
+    
     try:
-        result = agent_controller.analyze_client_performance(
+        result = await agent_controller.analyze_client_performance(
             client_id=client.id,
             domain=metrics.domain,
             metrics=metrics.metrics
@@ -222,42 +410,86 @@ def analyze_performance(metrics: ClientMetrics, client: Client = Depends(get_api
         }
         
     except Exception as e:
+        await asyncio.to_thread(refund_analyses, {client.id: 1})
         raise HTTPException(status_code=500, detail=str(e))
     
-@app.post("/client-metrics")
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, client: Client = Depends(get_api_key)):
+    """Status, and once finished the result, of a queued analysis"""
+    job = job_queue.get(job_id, client.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "client": client.name, **job}
+
+@router.get("/job-stats")
+def get_job_stats():
+    """Job workers, queue depth and finished jobs"""
+    return job_queue.stats()
+
+@router.post("/analyze-performance/stream")
+async def analyze_performance_stream(
+    metrics: ClientMetrics,
+    format: str = "sse",
+    client: Client = Depends(get_api_key)
+):
+    """Analyze performance, streaming each stage as it completes (SSE or NDJSON)"""
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be sse or ndjson")
+    await asyncio.to_thread(charge_analyses, client)
+    
+    async def events():
+        try:
+            async for event, data in agent_controller.stream_client_performance(
+                client_id=client.id,
+                domain=metrics.domain,
+                metrics=metrics.metrics
+            ):
+                yield encode_event(event, data, format)
+        except Exception as e:
+            await asyncio.to_thread(refund_analyses, {client.id: 1})
+            yield encode_event("error", {"detail": str(e)}, format)
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+def encode_event(event: str, data: Dict[str, Any], format: str) -> str:
+    if format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+@router.post("/client-metrics")
 async def receive_client_metrics(
     metrics_data: dict,
+    durable: bool = False,
     client: Client = Depends(get_api_key)
 ):
     """Receive metrics from client applications and provide AI analysis"""
+    metrics = metrics_data.get("metrics", {})
+    if not metrics or not isinstance(metrics, dict):
+        raise HTTPException(status_code=400, detail="No metrics provided")
+    await asyncio.to_thread(charge_analyses, client)
+    
     try:
-        metrics = metrics_data.get("metrics", {})
-        
-        if not metrics:
-            raise HTTPException(status_code=400, detail="No metrics provided")
-        
         print(f"Received metrics from client {client.name}: {metrics}")
+        await ingest_metrics([(client, metrics)])
         
         # Analyze the metrics
-        result = agent_controller.analyze_client_performance(
+        result = await agent_controller.analyze_client_performance(
             client_id=client.id,
             domain=client.domain,
             metrics=metrics
         )
         
-        # Store the analysis in database
-        db = next(get_db())
-        
-        # Log this API call
-        experiment = Experiment(
-            client_id=client.id,
-            hypothesis="API-driven metric analysis",
-            intervention_type="api_analysis",
-            status="completed",
-            results=f"Metrics analyzed: {list(metrics.keys())}"
-        )
-        db.add(experiment)
-        db.commit()
+        # Log this API call; durable=true waits until the row is committed
+        saved = experiment_writer.add({
+            "client_id": client.id,
+            "hypothesis": "API-driven metric analysis",
+            "intervention_type": "api_analysis",
+            "status": "completed",
+            "results": f"Metrics analyzed: {list(metrics.keys())}"
+        }, durable=durable)
+        if saved is not None:
+            await asyncio.wrap_future(saved)
         
         # Return comprehensive analysis
         return {
@@ -271,12 +503,198 @@ async def receive_client_metrics(
         }
         
     except Exception as e:
+        await asyncio.to_thread(refund_analyses, {client.id: 1})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/client-metrics/batch")
+async def receive_client_metrics_batch(
+    batch: MetricsBatch,
+    client: Client = Depends(get_api_key)
+):
+    """Receive many metric snapshots at once and analyze them with batched LLM calls"""
+    if not batch.snapshots:
+        raise HTTPException(status_code=400, detail="No snapshots provided")
+    if len(batch.snapshots) > Config.MAX_BATCH_SNAPSHOTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {Config.MAX_BATCH_SNAPSHOTS} snapshots per batch"
+        )
+    
+    # Resolve the client behind each snapshot and group them by domain
+    owners = []
+    by_domain = {}
+    for i, snapshot in enumerate(batch.snapshots):
+        if not snapshot.metrics:
+            raise HTTPException(status_code=400, detail=f"Snapshot {i} has no metrics")
+        owner = client
+        if snapshot.api_key and snapshot.api_key != client.api_key:
+            owner = await asyncio.to_thread(auth_cache.get_client, snapshot.api_key, load_client_by_api_key)
+            if not owner:
+                raise HTTPException(status_code=401, detail=f"Invalid API key in snapshot {i}")
+        owners.append(owner)
+        by_domain.setdefault(owner.domain, []).append(i)
+    
+    # Each snapshot is one analysis on its owner's plan; all or nothing
+    costs = {}
+    for owner in owners:
+        costs[owner.id] = costs.get(owner.id, 0) + 1
+    charged = []
+    try:
+        for owner in {owner.id: owner for owner in owners}.values():
+            await asyncio.to_thread(charge_analyses, owner, costs[owner.id])
+            charged.append(owner.id)
+    except HTTPException:
+        await asyncio.to_thread(refund_analyses, {client_id: costs[client_id] for client_id in charged})
+        raise
+    
+    try:
+        await ingest_metrics([(owner, snapshot.metrics) for owner, snapshot in zip(owners, batch.snapshots)])
+        
+        # Rules answer the clear-cut snapshots of each domain in one vectorized pass
+        gaps = [None] * len(batch.snapshots)
+        escalated = {}
+        for domain, indices in by_domain.items():
+            results = rule_engine.evaluate_batch([batch.snapshots[i].metrics for i in indices], domain)
+            for i, snapshot_gaps in zip(indices, results):
+                if snapshot_gaps is None:
+                    escalated.setdefault(domain, []).append(i)
+                gaps[i] = snapshot_gaps
+        
+        # One batched gap analysis per domain for the rest, all domains in parallel
+        ai_service = agent_controller.ai_service
+        domains = list(escalated)
+        domain_gaps = await asyncio.gather(*(
+            ai_service.analyze_performance_gaps_batch(
+                [batch.snapshots[i].metrics for i in escalated[domain]], domain,
+                [owners[i].id for i in escalated[domain]]
+            )
+            for domain in domains
+        ))
+        for domain, results in zip(domains, domain_gaps):
+            for i, snapshot_gaps in zip(escalated[domain], results):
+                gaps[i] = snapshot_gaps
+        
+        # Log every analysis in a single transaction and wait for it to commit
+        await asyncio.wrap_future(experiment_writer.add_many([
+            {
+                "client_id": owners[i].id,
+                "hypothesis": "API-driven batch metric analysis",
+                "intervention_type": "batch_analysis",
+                "status": "completed",
+                "results": json.dumps({
+                    "metrics": list(snapshot.metrics.keys()),
+                    "performance_gaps": gaps[i]
+                })
+            }
+            for i, snapshot in enumerate(batch.snapshots)
+        ], durable=True))
+        
+        return {
+            "status": "success",
+            "client": client.name,
+            "snapshots_received": len(batch.snapshots),
+            "results": [
+                {
+                    "client": owners[i].name,
+                    "domain": owners[i].domain,
+                    "performance_gaps": gaps[i],
+                    "metrics_received": list(snapshot.metrics.keys())
+                }
+                for i, snapshot in enumerate(batch.snapshots)
+            ],
+            "analysis_timestamp": datetime.utcnow().isoformat()
+        }
+        
+    except Exception as e:
+        await asyncio.to_thread(refund_analyses, costs)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/subscription-status")
-async def get_subscription_status(client: Client = Depends(get_api_key)):
+@router.get("/experiments")
+def list_experiments(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    intervention_type: Optional[str] = None,
+    status: Optional[str] = None,
+    client: Client = Depends(get_api_key),
+    db: Session = Depends(get_db)
+):
+    """Page through the client's experiments, newest first"""
+    limit = max(1, min(limit, 500))
+    query = db.query(Experiment).filter(Experiment.client_id == client.id)
+    if intervention_type:
+        query = query.filter(Experiment.intervention_type == intervention_type)
+    if status:
+        query = query.filter(Experiment.status == status)
+    if cursor:
+        try:
+            created_at, experiment_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Row-value comparison lets SQLite seek straight into the composite index
+        query = query.filter(tuple_(Experiment.created_at, Experiment.id) < (created_at, experiment_id))
+    
+    rows = query.order_by(Experiment.created_at.desc(), Experiment.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    
+    return {
+        "status": "success",
+        "client": client.name,
+        "experiments": [
+            {
+                "id": row.id,
+                "hypothesis": row.hypothesis,
+                "intervention_type": row.intervention_type,
+                "status": row.status,
+                "results": row.results,
+                "created_at": row.created_at.isoformat() + "Z"
+            }
+            for row in rows[:limit]
+        ],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/metrics-history")
+def list_metric_series(client: Client = Depends(get_api_key)):
+    """Names of the metrics recorded for the client"""
+    return {"status": "success", "client": client.name, "metrics": metrics_store.metrics(client.id)}
+
+@router.get("/metrics-history/{metric}")
+def get_metric_history(
+    metric: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    resolution: str = "1m",
+    client: Client = Depends(get_api_key)
+):
+    """Points for one metric in [start, end) (epoch seconds) at raw, 1m, 1h or 1d resolution"""
+    try:
+        points = metrics_store.query(client.id, metric, start, end, resolution)
+        summary = metrics_store.aggregate(client.id, metric, start, end, "1m" if resolution == "raw" else resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "status": "success",
+        "client": client.name,
+        "metric": metric,
+        "resolution": resolution,
+        "points": {name: column.tolist() for name, column in points.items()},
+        "summary": summary
+    }
+
+@router.get("/usage")
+def get_usage(client: Client = Depends(get_api_key)):
+    """Analyses used this month against the client's plan"""
+    return {"status": "success", "client": client.name, **quota_manager.usage(client.id, load_plan_usage)}
+
+@router.get("/quota-stats")
+def get_quota_stats():
+    """Clients metered and calls refused for rate or monthly limits"""
+    return quota_manager.stats()
+
+@router.get("/subscription-status")
+def get_subscription_status(client: Client = Depends(get_api_key), db: Session = Depends(get_db)):
     """Get client's subscription status"""
-    db = next(get_db())
     subscription = db.query(Subscription).filter(
         Subscription.client_id == client.id,
         Subscription.status == "active"
@@ -291,39 +709,76 @@ async def get_subscription_status(client: Client = Depends(get_api_key)):
     else:
         return {"status": "inactive", "plan": "none"}
     
-@app.post("/register-webhook")
-async def register_webhook(
+@router.post("/register-webhook")
+def register_webhook(
     webhook_data: dict,
-    client: Client = Depends(get_api_key)
+    client: Client = Depends(get_api_key),
+    db: Session = Depends(get_db)
 ):
     """Register a webhook URL for a client"""
+    webhook_url = webhook_data.get("webhook_url")
+    if not webhook_url:
+        raise HTTPException(status_code=400, detail="webhook_url is required")
+    try:
+        event_types = parse_event_types(webhook_data.get("event_types", "all"), webhook_manager.webhook_types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        db = next(get_db())
-        
         webhook = Webhook(
             client_id=client.id,
-            webhook_url=webhook_data.get("webhook_url"),
-            event_types=webhook_data.get("event_types", "all")
+            webhook_url=webhook_url,
+            event_types=",".join(event_types)
         )
         
         db.add(webhook)
+        db.flush()
+        db.add_all([
+            WebhookSubscription(webhook_id=webhook.id, client_id=client.id, event_type=event_type)
+            for event_type in event_types
+        ])
         db.commit()
         
+        subscription_index.add(webhook.id, client.id, webhook_url, event_types)
+        
         return {
             "status": "success",
             "message": "Webhook registered successfully",
-            "webhook_id": webhook.id
+            "webhook_id": webhook.id,
+            "event_types": event_types
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/test-webhook")
-async def test_webhook(client: Client = Depends(get_api_key)):
-    """Send a test webhook to the client"""
+@router.delete("/webhooks/{webhook_id}")
+def delete_webhook(webhook_id: int, client: Client = Depends(get_api_key)):
+    """Deactivate one of the client's webhooks and stop routing events to it"""
+    db = SessionLocal()
+    try:
+        updated = db.query(Webhook).filter(
+            Webhook.id == webhook_id,
+            Webhook.client_id == client.id
+        ).update({"is_active": False})
+        if not updated:
+            raise HTTPException(status_code=404, detail="Webhook not found")
+        db.query(WebhookSubscription).filter(WebhookSubscription.webhook_id == webhook_id).delete()
+        db.commit()
+    finally:
+        db.close()
+    
+    subscription_index.remove(webhook_id)
+    
+    return {"status": "success", "message": "Webhook removed"}
+
+@router.post("/test-webhook")
+def test_webhook(client: Client = Depends(get_api_key), db: Session = Depends(get_db)):
+    """Queue a test webhook to the client"""
     try:
-        db = next(get_db())
-        webhook = db.query(Webhook).filter(Webhook.client_id == client.id).first()
+        webhook = db.query(Webhook).filter(
+            Webhook.client_id == client.id,
+            Webhook.is_active == True
+        ).first()
         
         if not webhook:
             raise HTTPException(status_code=404, detail="No webhook registered")
@@ -334,32 +789,88 @@ async def test_webhook(client: Client = Depends(get_api_key)):
             "Test recommendation - your webhook is working!"
         )
         
-        # Send webhook
-        success = webhook_manager.send_webhook(webhook.webhook_url, test_payload)
+        # Queue for background delivery
+        delivery_id = webhook_dispatcher.enqueue(db, client.id, webhook.webhook_url, test_payload)
+        
+        return {"status": "success", "message": "Test webhook queued", "delivery_id": delivery_id}
         
-        if success:
-            return {"status": "success", "message": "Test webhook sent successfully"}
-        else:
-            return {"status": "error", "message": "Failed to send test webhook"}
-            
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/webhook-logs")
-async def get_webhook_logs(client: Client = Depends(get_api_key)):
-    """Get webhook delivery logs (simplified for demo)"""
-    return {
-        "status": "success",
-        "client": client.name,
-        "webhooks_sent": 5,
-        "last_sent": "2025-11-28T17:45:00Z",
-        "success_rate": "100%"
-    }
+@router.get("/webhook-logs")
+def get_webhook_logs(client: Client = Depends(get_api_key)):
+    """Get webhook delivery aggregates for the client"""
+    db = SessionLocal()
+    try:
+        summary = delivery_log.summary(db, client.id)
+    finally:
+        db.close()
+    
+    return {"status": "success", "client": client.name, **summary}
+
+@router.get("/webhook-logs/attempts")
+def get_webhook_attempts(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    client: Client = Depends(get_api_key)
+):
+    """Page through raw delivery attempts, newest first"""
+    db = SessionLocal()
+    try:
+        page = delivery_log.page(db, client.id, cursor, max(1, min(limit, 500)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        db.close()
+    
+    return {"status": "success", "client": client.name, **page}
+
+@router.get("/llm-cache-stats")
+def get_llm_cache_stats():
+    """AIService result cache hits, misses and LLM latency saved"""
+    return agent_controller.ai_service.cache.stats()
+
+@router.get("/rule-engine-stats")
+def get_rule_engine_stats():
+    """Share of metric sets answered by the rules instead of the LLM"""
+    return rule_engine.stats()
 
-@app.get("/health")
-def health_check():
+@router.get("/llm-router-stats")
+def get_llm_router_stats():
+    """Model per stage, route latency percentiles and how often slow calls were hedged"""
+    return agent_controller.ai_service.router.stats()
+
+@router.get("/single-flight-stats")
+def get_single_flight_stats():
+    """Analysis cycles executed versus calls that shared an in-flight or recent result"""
+    return agent_controller.single_flight.stats()
+
+@router.get("/anomaly-stats")
+def get_anomaly_stats():
+    """Tracked metric series and performance alerts fired by the anomaly detector"""
+    return anomaly_detector.stats()
+
+@router.get("/metrics")
+def get_metrics():
+    """Latency histograms, stage errors and LLM token usage in Prometheus text format"""
+    return PlainTextResponse(instrumentation.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/health")
+async def health_check():
     return {"status": "healthy", "service": "AICSA Pro"}
 
+def create_app() -> FastAPI:
+    """The AICSA Pro app; every entry point (app.py, main.py, simple_main.py) serves this"""
+    app = FastAPI(title="AICSA Pro", on_startup=[start_services], on_shutdown=[stop_services])
+    app.middleware("http")(record_request_timing)
+    app.mount("/static", StaticFiles(directory="templates"), name="static")
+    app.include_router(router)
+    return app
+
+app = create_app()
+
 # Render deployment
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+import time
+
+class SingleFlight:
+    """Coalesces concurrent identical async calls into one execution.
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight await the same task, and callers within `grace` seconds after it
+    succeeded get its result directly. Failures are shared with the callers
+    already waiting but never reused afterwards.
+    """
+
+    def __init__(self, grace: float = 1.0, max_recent: int = 10000):
+        self.grace = grace
+        self.max_recent = max_recent
+        self._inflight = {}  # key -> asyncio.Task
+        self._recent = OrderedDict()  # key -> (expires_at, result), oldest first
+        self.leaders = 0
+        self.joined = 0
+        self.recent_hits = 0
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of work(), shared with every identical call in flight or just finished"""
+        now = time.monotonic()
+        while self._recent:
+            oldest = next(iter(self._recent))
+            if self._recent[oldest][0] > now:
+                break
+            del self._recent[oldest]
+        if key in self._recent:
+            self.recent_hits += 1
+            return self._recent[key][1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = self._inflight[key] = asyncio.ensure_future(work())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.joined += 1
+        # A cancelled caller must not cancel the work the others are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        calls = self.leaders + self.joined + self.recent_hits
+        return {
+            "calls": calls,
+            "executed": self.leaders,
+            "coalesced": self.joined + self.recent_hits,
+            "in_flight": len(self._inflight),
+            "coalesced_rate": round((calls - self.leaders) / calls, 4) if calls else 0.0
+        }
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        del self._inflight[key]
+        if task.cancelled() or task.exception() is not None or self.grace <= 0:
+            return
+        self._recent[key] = (time.monotonic() + self.grace, task.result())
+        if len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
@@ -17,9 +17,7 @@ foreach ($pkg in $packages) {
     }
 }
 
-# Initialize database
-Write-Host "Initializing database..." -ForegroundColor Yellow
-python -c "from infrastructure.database import init_db; init_db(); print('Database initialized')"
+# The database schema is created when the app starts
 
 # Start the server
 Write-Host "Starting FastAPI server..." -ForegroundColor Green
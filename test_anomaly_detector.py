@@ -0,0 +1,42 @@
+"""AnomalyDetector tests: flat series must still alert on a cliff, and bad values must not poison the baseline.
+
+Run with pytest or directly: python test_anomaly_detector.py
+"""
+import math
+
+from anomaly_detector import AnomalyDetector
+
+def feed(detector: AnomalyDetector, values, metric: str = "csat", start: float = 0.0):
+    """Alerts raised per value, one value per minute"""
+    return [detector.update(1, {metric: value}, now=start + 60 * i) for i, value in enumerate(values)]
+
+def test_constant_series_then_cliff_alerts():
+    detector = AnomalyDetector()
+    alerts = feed(detector, [0.9] * 20 + [0.5])
+    assert not any(alerts[:-1])
+    assert [alert["metric"] for alert in alerts[-1]] == ["csat"]
+    assert alerts[-1][0]["baseline"] == 0.9
+
+def test_constant_series_ignores_small_wobble():
+    detector = AnomalyDetector()
+    assert not any(feed(detector, [0.9] * 20 + [0.89, 0.9, 0.895]))
+
+def test_flat_zero_series_alerts_when_higher_is_worse():
+    detector = AnomalyDetector(higher_is_worse=["error_rate"])
+    alerts = feed(detector, [0.0] * 10 + [0.2], metric="error_rate")
+    assert alerts[-1] and alerts[-1][0]["metric"] == "error_rate"
+
+def test_non_finite_and_non_numeric_values_are_ignored():
+    detector = AnomalyDetector()
+    feed(detector, [math.nan, 0.9, "abc", 0.9, math.inf, 0.9, None, -math.inf, 0.9, 0.9, 0.9])
+    state = detector._states[(1, "csat")]
+    assert state.mean == 0.9 and state.count == 6
+    assert detector.stats()["rejected_values"] == 5
+    assert detector.update(1, {"csat": 0.5}, now=1e6)
+
+if __name__ == "__main__":
+    test_constant_series_then_cliff_alerts()
+    test_constant_series_ignores_small_wobble()
+    test_flat_zero_series_alerts_when_higher_is_worse()
+    test_non_finite_and_non_numeric_values_are_ignored()
+    print("✅ anomaly detector tests passed")
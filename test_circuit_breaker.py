@@ -0,0 +1,146 @@
+"""CircuitBreaker state transitions, and the per-client fallbacks the AI services serve while it is open.
+
+Run with pytest or directly: python test_circuit_breaker.py
+"""
+import asyncio
+import time
+
+import pytest
+
+import instrumentation
+from ai_service import AIService, AsyncAIService
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from llm_cache import LLMResultCache
+
+OPEN_SECONDS = 0.05
+
+def breaker(name: str, **options) -> CircuitBreaker:
+    settings = {"failure_rate": 0.5, "slow_rate": 0.8, "slow_seconds": 1.0, "window": 10,
+                "min_calls": 4, "open_seconds": OPEN_SECONDS, "probes": 1}
+    settings.update(options)
+    return CircuitBreaker(name, **settings)
+
+def call(circuit: CircuitBreaker, ok: bool = True, seconds: float = 0.01) -> None:
+    circuit.record(circuit.acquire(), ok, seconds)
+
+def trip(circuit: CircuitBreaker) -> None:
+    for _ in range(circuit.min_calls):
+        call(circuit, ok=False)
+    assert circuit.state == OPEN
+
+def test_stays_closed_until_min_calls():
+    circuit = breaker("min_calls")
+    for _ in range(3):
+        call(circuit, ok=False)
+    assert circuit.state == CLOSED
+
+def test_opens_on_failure_rate_and_rejects_calls():
+    circuit = breaker("failures")
+    call(circuit)
+    call(circuit)
+    call(circuit, ok=False)
+    assert circuit.state == CLOSED
+    call(circuit, ok=False)
+    assert circuit.state == OPEN
+    assert circuit.is_open()
+    with pytest.raises(CircuitOpen):
+        circuit.acquire()
+    assert circuit.stats()["rejected"] == 1
+
+def test_opens_on_slow_rate():
+    circuit = breaker("slow")
+    for _ in range(4):
+        call(circuit, seconds=2.0)
+    assert circuit.state == OPEN
+
+def test_half_open_admits_probes_and_closes_on_success():
+    circuit = breaker("recovers")
+    trip(circuit)
+    time.sleep(OPEN_SECONDS * 1.5)
+    assert not circuit.is_open()
+    ticket = circuit.acquire()
+    assert circuit.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        circuit.acquire()  # Only one probe at a time
+    circuit.record(ticket, True, 0.01)
+    assert circuit.state == CLOSED
+    call(circuit)
+
+def test_failed_or_slow_probe_reopens():
+    for ok, seconds in ((False, 0.01), (True, 2.0)):
+        circuit = breaker(f"reopens_{ok}")
+        trip(circuit)
+        time.sleep(OPEN_SECONDS * 1.5)
+        circuit.record(circuit.acquire(), ok, seconds)
+        assert circuit.state == OPEN
+
+def test_released_probe_frees_its_slot():
+    circuit = breaker("released")
+    trip(circuit)
+    time.sleep(OPEN_SECONDS * 1.5)
+    circuit.release(circuit.acquire())
+    assert circuit.acquire() == HALF_OPEN
+
+def test_outcome_from_before_a_transition_is_ignored():
+    circuit = breaker("stale")
+    stale = circuit.acquire()
+    trip(circuit)
+    time.sleep(OPEN_SECONDS * 1.5)
+    probe = circuit.acquire()
+    circuit.record(stale, False, 0.01)  # Admitted while closed; says nothing about the probe
+    assert circuit.state == HALF_OPEN
+    circuit.record(probe, True, 0.01)
+    assert circuit.state == CLOSED
+
+def test_transitions_are_exported_as_metrics():
+    circuit = breaker("exported")
+    trip(circuit)
+    lines = instrumentation.CIRCUIT_STATE.render() + instrumentation.CIRCUIT_TRANSITIONS.render()
+    assert 'aicsa_circuit_state{breaker="exported"} 2' in lines
+    assert 'aicsa_circuit_transitions_total{breaker="exported",state="open"} 1' in lines
+
+def test_fallbacks_never_cross_clients():
+    service = AIService(cache=LLMResultCache())
+    answers = iter(['["Client A gap"]', '{"proposals": [{"hypothesis": "Client A plan"}]}'])
+
+    def complete(prompt: str, max_tokens: int, method: str) -> str:
+        answer = next(answers, None)
+        if answer is None:
+            raise CircuitOpen("Circuit test is open")
+        return answer
+
+    service._complete = complete
+    assert service.analyze_performance_gaps({"novel": 0.1}, "custom", client_id=1) == ["Client A gap"]
+    assert service.generate_improvement_plan(["Client A gap"], "custom", client_id=1)["proposals"]
+
+    # Breaker open: client 1 gets its own last answers, client 2 only the generic fallbacks
+    assert service.analyze_performance_gaps({"novel": 0.9}, "custom", client_id=1) == ["Client A gap"]
+    assert service.analyze_performance_gaps({"novel": 0.9}, "custom", client_id=2) != ["Client A gap"]
+    assert service.generate_improvement_plan(["Other gap"], "custom", client_id=2) == {"proposals": []}
+    assert service.analyze_performance_gaps_batch([{"novel": 0.8}], "custom", [2]) != [["Client A gap"]]
+
+def test_async_service_shares_the_fallbacks():
+    service = AsyncAIService(cache=LLMResultCache())
+    answers = iter(['["Client A gap"]'])
+
+    async def complete(prompt: str, max_tokens: int, method: str) -> str:
+        answer = next(answers, None)
+        if answer is None:
+            raise CircuitOpen("Circuit test is open")
+        return answer
+
+    async def run() -> None:
+        assert await service.analyze_performance_gaps({"novel": 0.1}, "custom", client_id=1) == ["Client A gap"]
+        assert await service.analyze_performance_gaps({"novel": 0.9}, "custom", client_id=1) == ["Client A gap"]
+        assert await service.analyze_performance_gaps({"novel": 0.9}, "custom", client_id=2) != ["Client A gap"]
+        assert await service.analyze_performance_gaps_batch([{"novel": 0.8}], "custom", [1]) == [["Client A gap"]]
+        assert (await service.test_intervention("h", []))["risks"] == ["Test failed"]
+
+    service._complete = complete
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+    print("✅ circuit breaker tests passed")
@@ -0,0 +1,91 @@
+"""Regression test: slow upstreams must not stall the event loop.
+
+A slow LLM and a slow SQLite (every statement) are simulated while /health
+is polled; every poll must still answer promptly. Run with pytest or directly:
+python test_event_loop.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+# For direct runs; under pytest conftest.py has already set these, before anything imported config
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/event_loop_test.db")
+os.environ.setdefault("METRICS_DATA_DIR", "")
+os.environ.setdefault("QUOTA_FREE_RPM", "100000")
+
+import httpx
+from sqlalchemy import event
+import database
+import simple_main
+
+LLM_DELAY = 1.0  # Seconds every simulated LLM call takes
+QUERY_DELAY = 0.3  # Seconds every SQL statement takes
+MAX_HEALTH_LATENCY = 0.25
+
+async def slow_llm(prompt: str, max_tokens: int, method: str) -> str:
+    await asyncio.sleep(LLM_DELAY)
+    if method == "generate_improvement_plan":
+        return '{"proposals": []}'
+    if method == "analyze_performance_gaps_batch":
+        return '{"0": ["Slow upstream gap"]}'
+    return '["Slow upstream gap"]'
+
+def slow_database(conn, cursor, statement, parameters, context, executemany):
+    """Block the calling thread on every statement, like a contended SQLite"""
+    time.sleep(QUERY_DELAY)
+
+async def poll_health(http: httpx.AsyncClient, stop: asyncio.Event, interval: float = 0.02) -> list:
+    """Time each poll from when it was due, so a loop blocked between polls counts too"""
+    latencies = []
+    while not stop.is_set():
+        due = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        response = await http.get("/health")
+        assert response.status_code == 200
+        latencies.append(time.perf_counter() - due)
+    return latencies
+
+async def run_slow_requests_with_health_polling() -> list:
+    transport = httpx.ASGITransport(app=simple_main.app)
+    async with simple_main.app.router.lifespan_context(simple_main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+            keys = []
+            for i in range(2):
+                response = await http.post("/register-client", json={
+                    "client_name": f"loop_{time.time_ns()}_{i}", "domain": "customer_support", "metrics": {}
+                })
+                keys.append(response.json()["api_key"])
+            headers = {"Authorization": keys[0]}
+
+            simple_main.agent_controller.ai_service._complete = slow_llm
+            event.listen(database.engine, "before_cursor_execute", slow_database)
+            try:
+                stop = asyncio.Event()
+                poller = asyncio.create_task(poll_health(http, stop))
+                responses = await asyncio.gather(
+                    http.post("/analyze-performance", headers=headers,
+                              json={"domain": "customer_support", "metrics": {"novel_metric": 0.5}}),
+                    http.post("/register-webhook", headers=headers,
+                              json={"webhook_url": "http://127.0.0.1:9/webhook", "event_types": "all"}),
+                    http.post("/client-metrics/batch", headers=headers, json={"snapshots": [
+                        {"metrics": {"novel_metric": 0.4}, "api_key": keys[1]}
+                    ]}),
+                    http.get("/subscription-status", headers=headers),
+                    http.get("/experiments", headers=headers)
+                )
+                stop.set()
+                assert all(response.status_code == 200 for response in responses)
+                return await poller
+            finally:
+                event.remove(database.engine, "before_cursor_execute", slow_database)
+
+def test_slow_upstreams_do_not_stall_health():
+    latencies = asyncio.run(run_slow_requests_with_health_polling())
+    # The slow requests took at least LLM_DELAY, so /health was polled many times meanwhile
+    assert len(latencies) >= 10
+    assert max(latencies) < MAX_HEALTH_LATENCY, f"/health stalled for {max(latencies):.2f}s"
+
+if __name__ == "__main__":
+    test_slow_upstreams_do_not_stall_health()
+    print("✅ /health stayed responsive while upstream calls were slow")
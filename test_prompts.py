@@ -0,0 +1,31 @@
+"""Prompt budget tests: truncated text and the intervention test prompt must fit their token budgets.
+
+Run with pytest or directly: python test_prompts.py
+"""
+import prompts
+from ai_service import _test_prompt
+from config import Config
+
+def test_truncate_fits_budget_for_punctuation_heavy_text():
+    text = " ".join(["{a:1,b:[2,3]};"] * 200)
+    for budget in (1, 2, 5, 17, 60):
+        cut = prompts.truncate_tokens(text, budget)
+        assert prompts.count_tokens(cut) <= budget
+        assert cut.endswith("…")
+
+def test_truncate_keeps_text_within_budget():
+    assert prompts.truncate_tokens("short text", 10) == "short text"
+    assert prompts.truncate_tokens("anything", 0) == ""
+
+def test_long_hypothesis_is_cut_to_the_prompt_budget():
+    hypothesis = "Reword the greeting, e.g. 'Hi!', 'Hello!' or 'Hey!'; " * 200
+    conversations = ["Customer: where is my order? Agent: it ships today."] * 20
+    prompt = _test_prompt(hypothesis, conversations)
+    assert prompts.count_tokens(prompt) <= Config.PROMPT_TOKEN_BUDGET
+    assert "where is my order" in prompt
+
+if __name__ == "__main__":
+    test_truncate_fits_budget_for_punctuation_heavy_text()
+    test_truncate_keeps_text_within_budget()
+    test_long_hypothesis_is_cut_to_the_prompt_budget()
+    print("✅ prompt tests passed")
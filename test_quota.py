@@ -0,0 +1,50 @@
+"""QuotaManager tests: batches larger than the burst allowance must not be refused forever.
+
+Run with pytest or directly: python test_quota.py
+"""
+import time
+
+import pytest
+
+from quota import QuotaManager, QuotaExceeded
+from shared_state import LocalState
+
+# 600 requests/minute with a 1s burst: a bucket of 10 tokens refilled at 10/s
+PLANS = {"free": {"monthly_analyses": 1000, "requests_per_minute": 600}}
+
+def no_usage(client_id: int, period: str):
+    return None, 0
+
+def quota_manager() -> QuotaManager:
+    return QuotaManager(None, None, PLANS, "free", burst_seconds=1.0, state=LocalState())
+
+def test_batch_over_bucket_capacity_succeeds_once_bucket_refills():
+    quota = quota_manager()
+    quota.acquire(1, no_usage, cost=25)
+
+    with pytest.raises(QuotaExceeded) as refused:
+        quota.acquire(1, no_usage, cost=25)
+    assert refused.value.retry_after == 1
+
+    time.sleep(refused.value.retry_after + 0.05)
+    quota.acquire(1, no_usage, cost=25)
+    assert quota.usage(1, no_usage)["analyses_used"] == 50
+
+def test_batch_counts_in_full_against_monthly_quota():
+    quota = quota_manager()
+    quota.acquire(1, no_usage, cost=999)
+    with pytest.raises(QuotaExceeded, match="Monthly quota"):
+        quota.acquire(1, no_usage, cost=2)
+
+def test_release_refunds_tokens_and_usage():
+    quota = quota_manager()
+    quota.acquire(1, no_usage, cost=25)
+    quota.release(1, cost=25)
+    quota.acquire(1, no_usage, cost=25)
+    assert quota.usage(1, no_usage)["analyses_used"] == 25
+
+if __name__ == "__main__":
+    test_batch_over_bucket_capacity_succeeds_once_bucket_refills()
+    test_batch_counts_in_full_against_monthly_quota()
+    test_release_refunds_tokens_and_usage()
+    print("✅ quota tests passed")
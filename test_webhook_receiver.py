@@ -1,6 +1,16 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import asyncio
+import os
+import random
 import uvicorn
 
+# Simulate a slow or flaky client endpoint, e.g. RECEIVER_DELAY=2 RECEIVER_FAIL_RATE=0.3
+RECEIVER_DELAY = float(os.getenv("RECEIVER_DELAY", "0"))
+RECEIVER_FAIL_RATE = float(os.getenv("RECEIVER_FAIL_RATE", "0"))
+RECEIVER_PORT = int(os.getenv("RECEIVER_PORT", "8001"))
+RECEIVER_QUIET = os.getenv("RECEIVER_QUIET", "") == "1"  # No per-webhook output (load tests)
+
 # This is a test server that receives webhooks
 app = FastAPI(title="Webhook Test Receiver")
 
@@ -9,6 +19,15 @@ async def receive_webhook(request: Request):
     """Receive webhooks from AICSA Pro"""
     payload = await request.json()
     
+    if RECEIVER_DELAY:
+        await asyncio.sleep(RECEIVER_DELAY)
+    if random.random() < RECEIVER_FAIL_RATE:
+        if not RECEIVER_QUIET:
+            print(f"💥 Simulated failure for {payload.get('event_type')}")
+        return JSONResponse(status_code=503, content={"status": "error", "message": "Simulated failure"})
+    if RECEIVER_QUIET:
+        return {"status": "success", "message": "Webhook received"}
+    
     print("🎯 WEBHOOK RECEIVED!")
     print(f"Title: {payload.get('title')}")
     print(f"Message: {payload.get('message')}")
@@ -23,6 +42,6 @@ async def home():
     return {"message": "Webhook test server is running"}
 
 if __name__ == "__main__":
-    print("🚀 Starting webhook test server on http://127.0.0.1:8001")
+    print(f"🚀 Starting webhook test server on http://127.0.0.1:{RECEIVER_PORT}")
     print("This will receive webhooks from your AICSA Pro system")
-    uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=RECEIVER_PORT, log_level="warning" if RECEIVER_QUIET else "info")
\ No newline at end of file
@@ -1,19 +1,128 @@
-import requests
+import httpx
+import asyncio
+import bisect
 import json
-from typing import Dict, List
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from pagination import encode_cursor, decode_cursor
+import instrumentation
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import threading
+import uuid
+from urllib.parse import urlsplit
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+ALL_EVENTS = "all"
+
+def parse_event_types(value: Union[str, Iterable[str], None], known: Iterable[str]) -> List[str]:
+    """Normalize a comma-separated string or list of event types; "all" subscribes to everything"""
+    if value is None:
+        return [ALL_EVENTS]
+    items = value.split(",") if isinstance(value, str) else list(value)
+    event_types = sorted({str(item).strip().lower() for item in items if str(item).strip()})
+    if not event_types or ALL_EVENTS in event_types:
+        return [ALL_EVENTS]
+    unknown = [event_type for event_type in event_types if event_type not in known]
+    if unknown:
+        raise ValueError(f"Unknown event types: {', '.join(unknown)}")
+    return event_types
+
+class SubscriptionIndex:
+    """In-memory routing table: event type -> client id -> {webhook id: url}.
+
+    Loaded once from the subscriptions table and updated in place when webhooks
+    are registered or removed, so fan-out never scans the webhooks table. With a
+    shared_state.Watch, a change made on another worker makes the next match()
+    reload the table through loader().
+    """
+
+    def __init__(self, watch=None, loader: Optional[Callable[[], Iterable[Tuple[int, int, str, str]]]] = None):
+        self.watch = watch
+        self.loader = loader
+        self._routes = {}  # event_type -> {client_id: {webhook_id: url}}
+        self._webhooks = {}  # webhook_id -> (client_id, event_types)
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[int, int, str, str]]) -> None:
+        """Rebuild from (webhook_id, client_id, webhook_url, event_type) rows"""
+        routes, webhooks = {}, {}
+        for webhook_id, client_id, url, event_type in rows:
+            webhooks.setdefault(webhook_id, (client_id, []))[1].append(event_type)
+            routes.setdefault(event_type, {}).setdefault(client_id, {})[webhook_id] = url
+        # Swap, so a concurrent match() never sees a half-built table
+        with self._lock:
+            self._routes, self._webhooks = routes, webhooks
+
+    def reload(self) -> None:
+        """Rebuild from loader(); changes made after this point trigger the next reload"""
+        if self.watch is not None:
+            self.watch.sync()
+        self.load(self.loader())
+
+    def add(self, webhook_id: int, client_id: int, url: str, event_types: List[str]) -> None:
+        self._add(webhook_id, client_id, url, event_types)
+        if self.watch is not None:
+            self.watch.bump()
+
+    def remove(self, webhook_id: int) -> None:
+        self._remove(webhook_id)
+        if self.watch is not None:
+            self.watch.bump()
+
+    def _add(self, webhook_id: int, client_id: int, url: str, event_types: List[str]) -> None:
+        with self._lock:
+            self._webhooks[webhook_id] = (client_id, list(event_types))
+            for event_type in event_types:
+                self._routes.setdefault(event_type, {}).setdefault(client_id, {})[webhook_id] = url
+
+    def _remove(self, webhook_id: int) -> None:
+        with self._lock:
+            client_id, event_types = self._webhooks.pop(webhook_id, (None, []))
+            for event_type in event_types:
+                clients = self._routes.get(event_type, {})
+                urls = clients.get(client_id, {})
+                urls.pop(webhook_id, None)
+                if not urls:
+                    clients.pop(client_id, None)
+                if not clients:
+                    self._routes.pop(event_type, None)
+
+    def match(self, event_type: str, client_id: Optional[int] = None) -> List[Tuple[int, str]]:
+        """(client_id, url) targets subscribed to an event, optionally for one client"""
+        if self.watch is not None and self.loader is not None and self.watch.changed():
+            self.reload()
+        targets = set()
+        with self._lock:
+            for key in (event_type, ALL_EVENTS):
+                clients = self._routes.get(key, {})
+                if client_id is not None:
+                    clients = {client_id: clients.get(client_id, {})}
+                for cid, urls in clients.items():
+                    targets.update((cid, url) for url in urls.values())
+        return sorted(targets)
 
 class WebhookManager:
-    def __init__(self):
+    def __init__(self, dispatcher=None, subscriptions: Optional[SubscriptionIndex] = None):
+        self.dispatcher = dispatcher
+        self.subscriptions = subscriptions
         self.webhook_types = {
             "performance_alert": "Your performance score dropped significantly",
             "new_recommendation": "New AI recommendation available", 
             "subscription_expiring": "Your subscription is expiring soon",
-            "system_update": "System update completed successfully"
+            "system_update": "System update completed successfully",
+            "analysis_completed": "A queued performance analysis finished"
         }
     
     def send_webhook(self, client_webhook_url: str, payload: Dict) -> bool:
         """Send a webhook to a client's URL"""
         try:
+            import requests  # Only the legacy synchronous path needs it
             response = requests.post(
                 client_webhook_url,
                 json=payload,
@@ -32,9 +141,17 @@ class WebhookManager:
             print(f"❌ Webhook error: {e}")
             return False
     
-    def create_performance_alert(self, client_name: str, old_score: int, new_score: int) -> Dict:
+    def emit(self, db, payload: Dict, client_id: Optional[int] = None) -> List[int]:
+        """Queue an alert for every matching subscription (one client's, or all clients')"""
+        targets = self.subscriptions.match(payload["event_type"], client_id)
+        if not targets:
+            return []
+        return self.dispatcher.enqueue_many(db, targets, payload)
+    
+    def create_performance_alert(self, client_name: str, old_score: int, new_score: int,
+                                 metric: Optional[str] = None) -> Dict:
         """Create a performance drop alert"""
-        return {
+        alert = {
             "event_type": "performance_alert",
             "title": "📉 Performance Alert",
             "message": f"Your AI performance score dropped from {old_score}% to {new_score}%",
@@ -42,8 +159,12 @@ class WebhookManager:
             "old_score": old_score,
             "new_score": new_score,
             "priority": "high",
-            "timestamp": "2025-11-28T17:45:00Z"
+            "timestamp": datetime.utcnow().isoformat() + "Z"
         }
+        if metric:
+            alert["metric"] = metric
+            alert["message"] = f"Your {metric} score dropped from {old_score}% to {new_score}%"
+        return alert
     
     def create_new_recommendation_alert(self, client_name: str, recommendation: str) -> Dict:
         """Create a new recommendation alert"""
@@ -54,7 +175,20 @@ class WebhookManager:
             "client": client_name,
             "recommendation": recommendation,
             "priority": "medium",
-            "timestamp": "2025-11-28T17:45:00Z"
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        }
+    
+    def create_analysis_completed_alert(self, client_name: str, job_id: str, status: str) -> Dict:
+        """Create a queued-analysis completion alert"""
+        return {
+            "event_type": "analysis_completed",
+            "title": "✅ Analysis Complete" if status == "completed" else "❌ Analysis Failed",
+            "message": f"Analysis job {job_id} {status}",
+            "client": client_name,
+            "job_id": job_id,
+            "status": status,
+            "priority": "low",
+            "timestamp": datetime.utcnow().isoformat() + "Z"
         }
     
     def create_subscription_alert(self, client_name: str, days_remaining: int) -> Dict:
@@ -66,5 +200,383 @@ class WebhookManager:
             "client": client_name,
             "days_remaining": days_remaining,
             "priority": "medium",
-            "timestamp": "2025-11-28T17:45:00Z"
-        }
\ No newline at end of file
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        }
+
+# Log-spaced latency bucket upper bounds in ms (~25% wide, 1ms to ~60s)
+LATENCY_BUCKETS_MS = [round(1.25 ** i, 1) for i in range(50)]
+
+class DeliveryLog:
+    """Append-only log of webhook delivery attempts with incrementally kept aggregates.
+
+    Every attempt adds one log row, bumps the client's counters and one latency
+    histogram bucket via upserts, so summaries never scan the log.
+    """
+
+    def __init__(self, attempt_model, stats_model, bucket_model):
+        self.attempt = attempt_model
+        self.stats = stats_model
+        self.bucket = bucket_model
+
+    def record(self, db, client_id: int, delivery_id: int, attempt: int,
+               status_code: Optional[int], latency_ms: float, error: Optional[str]) -> None:
+        """Add one attempt to the caller's session; the caller commits"""
+        now = datetime.utcnow()
+        success = 1 if error is None else 0
+        db.add(self.attempt(
+            client_id=client_id,
+            delivery_id=delivery_id,
+            attempt=attempt,
+            status_code=status_code,
+            latency_ms=latency_ms,
+            success=bool(success),
+            error=error,
+            created_at=now
+        ))
+        stats = self.stats.__table__
+        db.execute(insert(stats).values(
+            client_id=client_id, attempts=1, successes=success,
+            last_sent_at=now if success else None
+        ).on_conflict_do_update(
+            index_elements=[stats.c.client_id],
+            set_={
+                "attempts": stats.c.attempts + 1,
+                "successes": stats.c.successes + success,
+                "last_sent_at": now if success else stats.c.last_sent_at
+            }
+        ))
+        buckets = self.bucket.__table__
+        bucket = min(bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms), len(LATENCY_BUCKETS_MS) - 1)
+        db.execute(insert(buckets).values(
+            client_id=client_id, bucket=bucket, count=1
+        ).on_conflict_do_update(
+            index_elements=[buckets.c.client_id, buckets.c.bucket],
+            set_={"count": buckets.c.count + 1}
+        ))
+
+    def summary(self, db, client_id: int) -> Dict:
+        """Per-client aggregates: counts, success rate, p50/p95 latency, last sent"""
+        stats = db.query(self.stats).filter(self.stats.client_id == client_id).first()
+        counts = dict(db.query(self.bucket.bucket, self.bucket.count).filter(
+            self.bucket.client_id == client_id
+        ).all())
+        attempts = stats.attempts if stats else 0
+        successes = stats.successes if stats else 0
+        return {
+            "attempts": attempts,
+            "webhooks_sent": successes,
+            "success_rate": f"{successes / attempts:.0%}" if attempts else "n/a",
+            "latency_p50_ms": self._quantile(counts, 0.50),
+            "latency_p95_ms": self._quantile(counts, 0.95),
+            "last_sent": stats.last_sent_at.isoformat() + "Z" if stats and stats.last_sent_at else None
+        }
+
+    def page(self, db, client_id: int, cursor: Optional[str] = None, limit: int = 50) -> Dict:
+        """Newest-first attempts for a client, keyset-paginated on (created_at, id)"""
+        Attempt = self.attempt
+        query = db.query(Attempt).filter(Attempt.client_id == client_id)
+        if cursor:
+            created_at, attempt_id = decode_cursor(cursor)
+            query = query.filter(tuple_(Attempt.created_at, Attempt.id) < (created_at, attempt_id))
+        rows = query.order_by(Attempt.created_at.desc(), Attempt.id.desc()).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+        return {
+            "attempts": [
+                {
+                    "id": row.id,
+                    "delivery_id": row.delivery_id,
+                    "attempt": row.attempt,
+                    "status_code": row.status_code,
+                    "latency_ms": row.latency_ms,
+                    "success": row.success,
+                    "error": row.error,
+                    "created_at": row.created_at.isoformat() + "Z"
+                }
+                for row in rows[:limit]
+            ],
+            "next_cursor": next_cursor
+        }
+
+    @staticmethod
+    def _quantile(counts: Dict[int, int], q: float) -> Optional[float]:
+        total = sum(counts.values())
+        if not total:
+            return None
+        seen = 0
+        for bucket in sorted(counts):
+            seen += counts[bucket]
+            if seen >= q * total:
+                return LATENCY_BUCKETS_MS[bucket]
+        return LATENCY_BUCKETS_MS[-1]
+
+class WebhookDispatcher:
+    """Delivers webhooks from a durable outbox table with background async workers.
+
+    Request handlers only call enqueue(); the workers POST through one pooled
+    keep-alive client, limit concurrency per destination host, retry failures
+    with exponential backoff and move exhausted deliveries to "dead".
+
+    A worker never waits on a saturated host: the delivery is parked for the
+    worker that frees one of the host's slots, or, once per_destination are
+    already parked, put back to pending for a later poll.
+
+    Claimed deliveries are leased to this process and renewed every
+    lease_seconds / 3, so with several worker processes only the deliveries of
+    a process that died (expired lease) go back to pending.
+    """
+
+    def __init__(self, session_factory: Callable, outbox_model, workers: int = 4,
+                 per_destination: int = 2, max_attempts: int = 5, base_backoff: float = 1.0,
+                 timeout: float = 5.0, poll_interval: float = 1.0, log: Optional[DeliveryLog] = None,
+                 lease_seconds: float = 30.0):
+        self.session_factory = session_factory
+        self.outbox = outbox_model
+        self.log = log
+        self.workers = workers
+        self.per_destination = per_destination
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = None
+        self._queue = None
+        self._wake = None
+        self._loop = None
+        self._tasks = []
+        self._http = None
+        self._active = {}  # host -> deliveries being posted
+        self._parked = {}  # host -> deque of deliveries waiting for a slot
+        self._parked_count = 0
+
+    def enqueue(self, db, client_id: int, webhook_url: str, payload: Dict) -> int:
+        """Write a delivery to the outbox in the caller's session and return its id"""
+        return self.enqueue_many(db, [(client_id, webhook_url)], payload)[0]
+
+    def enqueue_many(self, db, targets: List[Tuple[int, str]], payload: Dict) -> List[int]:
+        """Write one delivery per (client_id, url) target in a single commit"""
+        body = json.dumps(payload)
+        now = datetime.utcnow()
+        deliveries = [
+            self.outbox(
+                client_id=client_id,
+                webhook_url=webhook_url,
+                event_type=payload.get("event_type"),
+                payload=body,
+                status="pending",
+                attempts=0,
+                next_attempt_at=now
+            )
+            for client_id, webhook_url in targets
+        ]
+        db.add_all(deliveries)
+        db.commit()
+        if self._loop is not None:
+            # enqueue may run in a worker thread; wake the poller on its own loop
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return [delivery.id for delivery in deliveries]
+
+    async def start(self) -> None:
+        self.owner = uuid.uuid4().hex
+        self._queue = asyncio.Queue(maxsize=self.workers * 10)
+        self._wake = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.workers * self.per_destination,
+                                max_keepalive_connections=self.workers * self.per_destination)
+        )
+        await asyncio.to_thread(self._recover)
+        self._tasks = [asyncio.create_task(self._poll()), asyncio.create_task(self._maintain())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        # What this process claimed but didn't deliver goes back to pending for any worker
+        await asyncio.to_thread(self._release)
+
+    async def _poll(self) -> None:
+        while True:
+            deliveries = await asyncio.to_thread(
+                self._claim_due, self._queue.maxsize - self._queue.qsize() - self._parked_count
+            )
+            for delivery in deliveries:
+                await self._queue.put(delivery)
+            if deliveries:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _maintain(self) -> None:
+        """Renew this process's leases and put deliveries of processes that died back to pending"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self._renew)
+                await asyncio.to_thread(self._recover)
+            except Exception as e:
+                logger.error(f"Webhook lease maintenance failed: {e}")
+
+    async def _work(self) -> None:
+        while True:
+            delivery = await self._queue.get()
+            try:
+                host = urlsplit(delivery[2]).netloc
+                if self._active.get(host, 0) >= self.per_destination:
+                    await self._park(host, delivery)
+                    continue
+                self._active[host] = self._active.get(host, 0) + 1
+                try:
+                    # Holding one of the host's slots, also drain what was parked for it
+                    while delivery is not None:
+                        await self._deliver(*delivery)
+                        delivery = self._unpark(host)
+                finally:
+                    self._active[host] -= 1
+                    if not self._active[host]:
+                        del self._active[host]
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, delivery_id: int, client_id: int, url: str, payload: str, attempts: int) -> None:
+        start = time.perf_counter()
+        status_code, error = await self._post(url, payload)
+        latency_ms = (time.perf_counter() - start) * 1000
+        instrumentation.observe("webhook_post", latency_ms / 1000, error=error is not None)
+        await asyncio.to_thread(
+            self._record, delivery_id, client_id, attempts + 1, status_code, latency_ms, error
+        )
+
+    async def _park(self, host: str, delivery: Tuple) -> None:
+        """Hold a delivery for a saturated host, or hand it back to the outbox once enough are held"""
+        parked = self._parked.setdefault(host, deque())
+        if len(parked) < self.per_destination:
+            parked.append(delivery)
+            self._parked_count += 1
+            return
+        await asyncio.to_thread(self._defer, delivery[0])
+
+    def _unpark(self, host: str) -> Optional[Tuple]:
+        parked = self._parked.get(host)
+        if not parked:
+            return None
+        delivery = parked.popleft()
+        self._parked_count -= 1
+        if not parked:
+            del self._parked[host]
+        return delivery
+
+    async def _post(self, url: str, payload: str):
+        try:
+            response = await self._http.post(url, content=payload, headers={"Content-Type": "application/json"})
+            if response.status_code in [200, 201, 202]:
+                return response.status_code, None
+            return response.status_code, f"HTTP {response.status_code}"
+        except Exception as e:
+            return None, str(e) or type(e).__name__
+
+    def _claim_due(self, limit: int) -> List:
+        """Atomically move due pending deliveries to "delivering" (runs in a worker thread)"""
+        if limit <= 0:
+            return []
+        db = self.session_factory()
+        try:
+            Outbox = self.outbox
+            due = db.query(Outbox.id, Outbox.client_id, Outbox.webhook_url, Outbox.payload, Outbox.attempts).filter(
+                Outbox.status == "pending",
+                Outbox.next_attempt_at <= datetime.utcnow()
+            ).order_by(Outbox.next_attempt_at).limit(limit).all()
+            claimed = []
+            for row in due:
+                updated = db.query(Outbox).filter(
+                    Outbox.id == row.id, Outbox.status == "pending"
+                ).update({
+                    "status": "delivering", "claimed_by": self.owner,
+                    "lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+                }, synchronize_session=False)
+                if updated:
+                    claimed.append((row.id, row.client_id, row.webhook_url, row.payload, row.attempts))
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _record(self, delivery_id: int, client_id: int, attempts: int, status_code: Optional[int],
+                latency_ms: float, error: Optional[str]) -> None:
+        """Store the outcome of one attempt and schedule a retry if needed"""
+        values = {"attempts": attempts, "last_status_code": status_code, "last_error": error}
+        if error is None:
+            values.update(status="delivered", delivered_at=datetime.utcnow())
+            logger.info(f"Webhook {delivery_id} delivered")
+        elif attempts >= self.max_attempts:
+            values.update(status="dead")
+            logger.error(f"Webhook {delivery_id} dead after {attempts} attempts: {error}")
+        else:
+            backoff = self.base_backoff * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            values.update(status="pending", next_attempt_at=datetime.utcnow() + timedelta(seconds=backoff))
+        db = self.session_factory()
+        try:
+            db.query(self.outbox).filter(self.outbox.id == delivery_id).update(values, synchronize_session=False)
+            if self.log is not None:
+                self.log.record(db, client_id, delivery_id, attempts, status_code, round(latency_ms, 1), error)
+            db.commit()
+        finally:
+            db.close()
+
+    def _defer(self, delivery_id: int) -> None:
+        """Put a claimed delivery back to pending for the next poll, without counting an attempt"""
+        db = self.session_factory()
+        try:
+            db.query(self.outbox).filter(
+                self.outbox.id == delivery_id, self.outbox.claimed_by == self.owner
+            ).update({
+                "status": "pending", "claimed_by": None, "lease_expires_at": None,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=self.poll_interval)
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _recover(self) -> None:
+        """Deliveries whose lease expired (their process died) go back to pending"""
+        Outbox = self.outbox
+        self._requeue(Outbox.status == "delivering",
+                      or_(Outbox.lease_expires_at.is_(None), Outbox.lease_expires_at < datetime.utcnow()))
+
+    def _release(self) -> None:
+        self._requeue(self.outbox.status == "delivering", self.outbox.claimed_by == self.owner)
+
+    def _requeue(self, *conditions) -> None:
+        db = self.session_factory()
+        try:
+            db.query(self.outbox).filter(*conditions).update(
+                {"status": "pending", "claimed_by": None, "lease_expires_at": None}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _renew(self) -> None:
+        db = self.session_factory()
+        try:
+            db.query(self.outbox).filter(
+                self.outbox.status == "delivering", self.outbox.claimed_by == self.owner
+            ).update(
+                {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()